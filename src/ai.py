@@ -0,0 +1,50 @@
+import settings as st
+
+
+class AIScheduler:
+    """decides how often the sprites think (call steer()) based on their
+    distance to the player or the camera. Sprites with an 'lod_tier'
+    attribute are assigned a tier from settings.AI_LOD_TIERS, the time
+    between their updates is accumulated and passed as dt, so that timers
+    like the pathfinding interval still run at the same speed.
+    All other sprites are steered every tick"""
+    def __init__(self, game):
+        self.game = game
+        self.tick = 0
+        # number of steer() calls in the last tick, for profiling
+        self.steered = 0
+
+
+    def get_tier(self, sprite):
+        """returns the index of the first tier the sprite is close enough
+        for"""
+        pos = sprite.pos
+        distance = pos.distance_to(self.game.player.pos)
+        camera = getattr(self.game, 'camera', None)
+        if camera:
+            center = (-camera.rect.x + self.game.world_screen_rect.w / 2,
+                      -camera.rect.y + self.game.world_screen_rect.h / 2)
+            distance = min(distance, pos.distance_to(center))
+        for tier, (max_distance, _) in enumerate(st.AI_LOD_TIERS):
+            if distance <= max_distance:
+                return tier
+        return len(st.AI_LOD_TIERS) - 1
+
+
+    def steer(self, sprites, dt):
+        self.tick += 1
+        self.steered = 0
+        for sprite in sprites:
+            if not hasattr(sprite, 'lod_tier'):
+                sprite.steer(dt)
+                self.steered += 1
+                continue
+
+            sprite.ai_dt += dt
+            sprite.lod_tier = self.get_tier(sprite)
+            interval = st.AI_LOD_TIERS[sprite.lod_tier][1]
+            # spread the updates of sprites in the same tier over the ticks
+            if (self.tick + sprite.id) % interval == 0:
+                sprite.steer(sprite.ai_dt)
+                sprite.ai_dt = 0
+                self.steered += 1
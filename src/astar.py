@@ -13,7 +13,11 @@ class Vector(Vector2):
 
 
 class StepPathing:
-    def __init__(self, start, goal, map_level, map_size, pattern, block_value):
+    def __init__(self, start, goal, map_level, map_size, pattern, block_value,
+                 radius=None):
+        # if radius is given, map_level is a clearance grid (see
+        # clearance.py) and cells with less clearance than radius are
+        # blocked, else cells with values from block_value up
         start = start
         self.goal = goal
         self.break_out = 0
@@ -25,7 +29,11 @@ class StepPathing:
         self.map_size = map_size
         self.map_level = map_level
         self.block_value = block_value
+        self.radius = radius
         self.current = start
+        # statistics
+        self.expanded = 0
+        self.open_peak = 1
 
     def get_low_score(self):
         low_score = -1
@@ -47,6 +55,11 @@ class StepPathing:
 
         return path
 
+    def blocked(self, x, y):
+        if self.radius is None:
+            return self.map_level[x][y] >= self.block_value
+        return self.map_level[x][y] < self.radius
+
     def get_neighbors(self):
         straight = list(map(Vector, ((0, 1), (0, -1), (1, 0), (-1, 0))))
         neighbors = []
@@ -60,8 +73,8 @@ class StepPathing:
             if self.map_size.x > int(new_neighbor.x) >= 0 and \
                self.map_size.y > int(new_neighbor.y) >= 0:
 
-                if self.map_level[int(new_neighbor.x)][int(new_neighbor.y)] \
-                   < self.block_value:
+                if not self.blocked(int(new_neighbor.x),
+                                    int(new_neighbor.y)):
                     if self.map_size.x > new_neighbor.x >= 0 and self.map_size.y \
                        > new_neighbor.y >= 0:
                         neighbors.append(Vector(new_neighbor))
@@ -74,11 +87,9 @@ class StepPathing:
                 x = int(new_neighbor.x)
                 y = int(new_neighbor.y)
                 if self.map_size.x > x >= 0 and self.map_size.y > y >= 0:
-                    wall = self.map_level[x][y] > self.block_value - 1
-                    block = (self.map_level[x][int(self.current.y)] >
-                             self.block_value - 1 or
-                             self.map_level[int(self.current.x)][y] >
-                             self.block_value - 1)
+                    wall = self.blocked(x, y)
+                    block = (self.blocked(x, int(self.current.y)) or
+                             self.blocked(int(self.current.x), y))
 
                     # Don't allow angle movement next to wall.
                     if not wall and not block:
@@ -93,6 +104,7 @@ class StepPathing:
                 return self.reconstructed_path()
 
             self.open_set.remove(self.current)
+            self.expanded += 1
             neighbors = self.get_neighbors()
 
             for neighbor in neighbors:
@@ -111,6 +123,7 @@ class StepPathing:
                         neighbor.distance_to(self.goal)
                     self.came_from[neighbor] = self.current
                     self.open_set.append(neighbor)
+            self.open_peak = max(self.open_peak, len(self.open_set))
         else:
             return []
 
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+
+import settings as st
+
+
+'''
+Wall clearance
+
+The clearance grid stores for every pathfinding cell the distance in pixels
+from the cell's center to the closest wall, up to MAX_CLEARANCE. It is
+built once per map and answers "can a sprite with this radius stand here"
+for every sprite size, so there is no maze per hitbox size.
+'''
+
+
+def occupancy(shape, walls, origin=(0, 0)):
+    """returns a bool array [x, y] that is True for the cells that overlap
+    a wall
+    Args:
+        shape: number of cells (x, y)
+        walls: list of wall rects
+        origin: grid position of the first cell"""
+    occupied = np.zeros(shape, dtype=bool)
+    size = st.CELL_SIZE
+    for wall in walls:
+        left = max(wall.left // size - origin[0], 0)
+        top = max(wall.top // size - origin[1], 0)
+        right = max(-(-wall.right // size) - origin[0], 0)
+        bottom = max(-(-wall.bottom // size) - origin[1], 0)
+        occupied[left:right, top:bottom] = True
+    return occupied
+
+
+def distance_field(occupied, max_distance):
+    """returns the squared distance in half cells from the center of every
+    cell to the closest border of an occupied cell (0 for occupied cells).
+    Cells that are more than max_distance cells away from the occupied
+    ones get (2 * max_distance + 1) ** 2.
+    Two passes: the first finds the closest occupied cell in the same
+    column, the second the best column. Both loop over the offsets up to
+    max_distance and handle all cells at once"""
+    far = 2 * max_distance + 1
+    column = np.where(occupied, 0, far)
+    for dy in range(1, max_distance + 1):
+        # a cell dy cells away has its border dy - 1/2 cells away
+        edge = 2 * dy - 1
+        column[:, :-dy] = np.minimum(column[:, :-dy],
+                                     np.where(occupied[:, dy:], edge, far))
+        column[:, dy:] = np.minimum(column[:, dy:],
+                                    np.where(occupied[:, :-dy], edge, far))
+
+    squared = column * column
+    field = squared.copy()
+    for dx in range(1, max_distance + 1):
+        edge = (2 * dx - 1) ** 2
+        field[:-dx] = np.minimum(field[:-dx], squared[dx:] + edge)
+        field[dx:] = np.minimum(field[dx:], squared[:-dx] + edge)
+    return np.minimum(field, far * far)
+
+
+def build_clearance(size, walls, origin=(0, 0)):
+    """returns the clearance grid in whole pixels, indexed with [x][y]
+    like the maze. The distances are exact for walls that are aligned to
+    the cells and rounded down
+    Args:
+        size: size of the map (or the part of it) in pixels
+        walls: list of wall rects, walls outside of the area that are
+               closer than MAX_CLEARANCE are taken into account
+        origin: grid position of the first cell"""
+    # cells around the area, so that walls next to it count
+    pad = math.ceil(st.MAX_CLEARANCE / st.CELL_SIZE + 0.5)
+    w = int(size[0]) // st.CELL_SIZE
+    h = int(size[1]) // st.CELL_SIZE
+    occupied = occupancy((w + 2 * pad, h + 2 * pad), walls,
+                         (origin[0] - pad, origin[1] - pad))
+    squared = distance_field(occupied, pad)[pad:pad + w, pad:pad + h]
+    clearance = np.sqrt(squared) * (st.CELL_SIZE / 2)
+    clearance = np.minimum(clearance, st.MAX_CLEARANCE)
+    # lists of small ints are faster to index from the A* than an array
+    return clearance.astype(int).tolist()
+
+
+def passable(clearance, cell, radius):
+    """returns True if a sprite with the radius fits into the cell"""
+    x, y = cell
+    return (0 <= x < len(clearance) and 0 <= y < len(clearance[0])
+            and clearance[x][y] >= radius)
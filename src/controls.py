@@ -1,5 +1,6 @@
 import pygame as pg
 import traceback
+import random
 
 
 # TODO move Button mapping to settings?
@@ -25,45 +26,69 @@ class KeyGetter:
                 }
     
     
+        # reverse mapping to look up the action of a key event
+        self.key_actions = {value: key
+                            for key, value in self.keyboard_mapping.items()}
+        
+        # the input dicts are created once and updated in place
+        pad = game.gamepad_controller
+        actions = list(self.keyboard_mapping) + [
+                key for key in pad.button_mapping
+                if key not in self.keyboard_mapping]
+        self.game.keys_pressed = dict.fromkeys(self.keyboard_mapping, 0)
+        self.game.keydown = dict.fromkeys(actions, 0)
+        self.game.keyup = dict.fromkeys(actions, 0)
+        # actions that were set in keydown/keyup in the last call
+        self.changed = []
+    
+    
     def get_input(self, pad, events):
         """Processes the inputs from a gamepad and the keyboard and combines them
         into dictionaries as properties of the game object
         Args:
             pad: GamepadController instance
             events: event list from pygame.event.get()"""
-        # process key status
-        # create empty dict with key status
-        self.game.keys_pressed = {key: 0
-                                  for key in self.keyboard_mapping.keys()}
+        keys_pressed = self.game.keys_pressed
+        keydown = self.game.keydown
+        keyup = self.game.keyup
         
-        key_presses = pg.key.get_pressed()
+        # process key status
+        key_presses = self.game.key_state
+        pad_inputs = pad.inputs[0] if pad.inputs else None
         for key, value in self.keyboard_mapping.items():
-            if not pad.inputs:
-                if key_presses[value]:
-                    self.game.keys_pressed[key] = 1
+            if pad_inputs and pad_inputs[pad.button_mapping[key]]:
+                keys_pressed[key] = 1
             else:
-                if (pad.inputs[0][pad.button_mapping[key]] or 
-                        key_presses[value]):
-                    self.game.keys_pressed[key] = 1
+                keys_pressed[key] = 1 if key_presses[value] else 0
+        
+        # reset the keydown and keyup events of the last call
+        for key in self.changed:
+            keydown[key] = 0
+            keyup[key] = 0
+        self.changed.clear()
         
         # process keydown and keyup events
-        self.game.keydown = {key: 0 for key in self.keyboard_mapping.keys()}
-        self.game.keyup = {key: 0 for key in self.keyboard_mapping.keys()}  
         for event in events:
             if event.type == pg.KEYDOWN:
-                for key, value in self.keyboard_mapping.items():
-                    if event.key == value:
-                        self.game.keydown[key] = 1
+                key = self.key_actions.get(event.key)
+                if key:
+                    keydown[key] = 1
+                    self.changed.append(key)
             elif event.type == pg.KEYUP:
-                for key, value in self.keyboard_mapping.items():
-                    if event.key == value:
-                        self.game.keyup[key] = 1
-                        
-        for key, value in pad.button_mapping.items():
-            if pad.inputs_down and pad.inputs_down[0][value]:
-                self.game.keydown[key] = 1
-            elif pad.inputs_up and pad.inputs_up[0][value]:
-                self.game.keyup[key] = 1
+                key = self.key_actions.get(event.key)
+                if key:
+                    keyup[key] = 1
+                    self.changed.append(key)
+        
+        if pad.inputs:
+            for index in bits(pad.down_masks[0]):
+                key = pad.button_actions[index]
+                keydown[key] = 1
+                self.changed.append(key)
+            for index in bits(pad.up_masks[0]):
+                key = pad.button_actions[index]
+                keyup[key] = 1
+                self.changed.append(key)
                   
     
     def test_inputs(self, inputs):
@@ -84,15 +109,33 @@ class KeyGetter:
 
 
 
+def bits(mask):
+    """yields the indices of the set bits of an integer"""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+
 class GamepadController:
+    """keeps track of the connected gamepads through the JOYDEVICEADDED and
+    JOYDEVICEREMOVED events and updates their state from the button, axis
+    and hat events (see handle_event()).
+    The state of each pad is a preallocated list (self.inputs) and a
+    bitmask of the active inputs. Presses and releases are computed once
+    per tick in update() by comparing the bitmask with the last one"""
     def __init__(self):
         # buttons held down
         self.inputs = []
         # button press events
         self.inputs_down = []
         self.inputs_up = []
-        self.inputs_down_prev = []
-        self.inputs_up_prev = []
+        # the same as bitmasks (bit i is index i of button_mapping)
+        self.masks = []
+        self.prev_masks = []
+        self.down_masks = []
+        self.up_masks = []
         
         self.deadzones = {
                 'stick_l': 0.2,
@@ -125,10 +168,119 @@ class GamepadController:
                     'LEFT': 20,
                     'UP': 21,
                     }
+        self.button_actions = {value: key
+                               for key, value in self.button_mapping.items()}
+        # input index and deadzone of each axis
+        self.axis_mapping = {
+                0: (12, 'stick_l'),
+                1: (13, 'stick_l'),
+                3: (15, 'stick_r'),
+                4: (14, 'stick_r')
+                }
 
-        pg.joystick.init()
+        # connected pads in the order they were added
         self.gamepads = []
+        # instance id: index in self.gamepads
+        self.pad_index = {}
+    
+    
+    def start(self):
+        """starts the joystick module. The pads that are already connected
+        are added by their JOYDEVICEADDED events"""
+        if not pg.joystick.get_init():
+            pg.joystick.init()
+    
+    
+    def add_pad(self, device_index):
+        pad = pg.joystick.Joystick(device_index)
+        pad.init()
+        if pad.get_instance_id() in self.pad_index:
+            return
+        self.gamepads.append(pad)
+        size = len(self.button_mapping)
+        self.inputs.append([0] * size)
+        self.inputs_down.append([0] * size)
+        self.inputs_up.append([0] * size)
+        for masks in (self.masks, self.prev_masks, self.down_masks,
+                      self.up_masks):
+            masks.append(0)
+        self.update_pad_index()
+    
+    
+    def remove_pad(self, instance_id):
+        n = self.pad_index.get(instance_id)
+        if n is None:
+            return
+        for inputs in (self.gamepads, self.inputs, self.inputs_down,
+                       self.inputs_up, self.masks, self.prev_masks,
+                       self.down_masks, self.up_masks):
+            del inputs[n]
+        self.update_pad_index()
+    
+    
+    def update_pad_index(self):
+        self.pad_index = {pad.get_instance_id(): n
+                          for n, pad in enumerate(self.gamepads)}
+    
+    
+    def set_input(self, n, index, value):
+        self.inputs[n][index] = value
+        if value:
+            self.masks[n] |= 1 << index
+        else:
+            self.masks[n] &= ~(1 << index)
+    
+    
+    def handle_event(self, event):
+        """updates the pad state from a pygame event"""
+        if event.type == pg.JOYDEVICEADDED:
+            self.add_pad(event.device_index)
+            return
+        elif event.type == pg.JOYDEVICEREMOVED:
+            self.remove_pad(event.instance_id)
+            return
+        elif event.type not in (pg.JOYBUTTONDOWN, pg.JOYBUTTONUP,
+                                pg.JOYAXISMOTION, pg.JOYHATMOTION):
+            return
+        
+        n = self.pad_index.get(event.instance_id)
+        if n is None:
+            return
         
+        if event.type == pg.JOYBUTTONDOWN:
+            if event.button < 10:
+                self.set_input(n, event.button, 1)
+        elif event.type == pg.JOYBUTTONUP:
+            if event.button < 10:
+                self.set_input(n, event.button, 0)
+        elif event.type == pg.JOYAXISMOTION:
+            axis = event.value
+            if event.axis == 2:
+                # both triggers share one axis
+                if axis > self.deadzones['trigger_l']:
+                    self.set_input(n, 16, axis)
+                    self.set_input(n, 17, 0)
+                elif abs(axis) > self.deadzones['trigger_r']:
+                    self.set_input(n, 17, abs(axis))
+                    self.set_input(n, 16, 0)
+                else:
+                    self.set_input(n, 16, 0)
+                    self.set_input(n, 17, 0)
+            elif event.axis in self.axis_mapping:
+                index, deadzone = self.axis_mapping[event.axis]
+                if abs(axis) > self.deadzones[deadzone]:
+                    self.set_input(n, index, axis)
+                else:
+                    self.set_input(n, index, 0)
+        elif event.type == pg.JOYHATMOTION:
+            X, Y = event.value
+            self.set_input(n, 10, X)
+            self.set_input(n, 11, Y)
+            self.set_input(n, 18, 1 if X > 0 else 0)
+            self.set_input(n, 19, 1 if Y < 0 else 0)
+            self.set_input(n, 20, 1 if X < 0 else 0)
+            self.set_input(n, 21, 1 if Y > 0 else 0)
+    
     
     def test_inputs(self, inputs):
         input_string = ''
@@ -144,90 +296,94 @@ class GamepadController:
                 print(input_string)
         except:
             traceback.print_exc()
+    
+    
+    def set_inputs(self, inputs, inputs_down, inputs_up):
+        """sets the input lists directly instead of reading the gamepads
+        (used by the input replay)"""
+        self.inputs = inputs
+        self.inputs_down = inputs_down
+        self.inputs_up = inputs_up
+        self.masks = [self.to_mask(i) for i in inputs]
+        self.down_masks = [self.to_mask(i) for i in inputs_down]
+        self.up_masks = [self.to_mask(i) for i in inputs_up]
+        self.prev_masks = list(self.masks)
+    
+    
+    def to_mask(self, values):
+        mask = 0
+        for i, value in enumerate(values):
+            if value:
+                mask |= 1 << i
+        return mask
             
     
     def any_key(self):
         """returns if any of the buttons from any gamepad is pressed
         at this frame"""
-        return any([any(i) for i in self.inputs])
+        return any(self.masks)
 
     
     def update(self):
-        self.gamepads = [pg.joystick.Joystick(x) for x in range(
-                         pg.joystick.get_count())]
-    
-        self.inputs = []
-        self.inputs_down = []
-        self.inputs_up = []
-        
-        if len(self.gamepads) > 0:
-            for n, pad in enumerate(self.gamepads):
-                self.inputs.append([0 for i in range(len(self.button_mapping))])
-                pad.init()
-                
-                # get button values
-                for i in range(pad.get_numbuttons()):
-                    if pad.get_button(i):
-                        self.inputs[n][i] = 1
-                            
-                # get axes values
-                for i in range(pad.get_numaxes()):
-                    axis = pad.get_axis(i)
-                    # compare each axis to deadzone
-                    if i == 0:
-                        # X axis left stick
-                        if abs(axis) > self.deadzones['stick_l']:
-                            self.inputs[n][12] = axis
-                    elif i == 1:
-                        # Y axis left stick
-                        if abs(axis) > self.deadzones['stick_l']:
-                            self.inputs[n][13] = axis
-                    elif i == 2:
-                        if axis > self.deadzones['trigger_l']:
-                            self.inputs[n][16] = axis
-                            self.inputs[n][17] = 0
-                        elif abs(axis) > self.deadzones['trigger_r']:
-                            self.inputs[n][17] = abs(axis)
-                            self.inputs[n][16] = 0
-                    elif i == 3:
-                        # y axis right stick
-                        if abs(axis) > self.deadzones['stick_r']:
-                            self.inputs[n][15] = axis
-                    elif i == 4:
-                        # X axis right stick
-                        if abs(axis) > self.deadzones['stick_r']:
-                            self.inputs[n][14] = axis
-                        
-                # get dpad values
-                for i in range(pad.get_numhats()):
-                    self.inputs[n][10], self.inputs[n][11] = pad.get_hat(i)
-                    X = self.inputs[n][10]
-                    Y = self.inputs[n][11]
-                    self.inputs[n][18] = 1 if X > 0 else 0
-                    self.inputs[n][19] = 1 if Y < 0 else 0
-                    self.inputs[n][20] = 1 if X < 0 else 0
-                    self.inputs[n][21] = 1 if Y > 0 else 0
-                
-                # save button_pressed events by comparing to previous presses
-                if len(self.inputs_down_prev) == n:
-                    # if this gamepad has no previous inputs
-                    self.inputs_down_prev.append([0 for _ in self.inputs[n]])
-                else:
-                    # compare current input to prev input
-                    diff = [1 if elem and not self.inputs_down_prev[n][i] 
-                            else 0 for i, elem in enumerate(self.inputs[n])]
-                    self.inputs_down.append(diff)
-                    # set prev input to current input
-                    self.inputs_down_prev[n] = [inp for inp in self.inputs[n]]
-                
-                # do the same for release events
-                if len(self.inputs_up_prev) == n:
-                    # if this gamepad has no previous inputs
-                    self.inputs_up_prev.append([0 for _ in self.inputs[n]])
-                else:
-                    # compare current input to prev input
-                    diff = [1 if not elem and self.inputs_up_prev[n][i] 
-                            else 0 for i, elem in enumerate(self.inputs[n])]
-                    self.inputs_up.append(diff)
-                    # set prev input to current input
-                    self.inputs_up_prev[n] = [inp for inp in self.inputs[n]]  
+        """computes the press and release events of this tick"""
+        for n, mask in enumerate(self.masks):
+            prev = self.prev_masks[n]
+            changed = mask ^ prev
+            down = self.inputs_down[n]
+            up = self.inputs_up[n]
+            # clear the events of the last tick
+            for i in bits(self.down_masks[n]):
+                down[i] = 0
+            for i in bits(self.up_masks[n]):
+                up[i] = 0
+            self.down_masks[n] = changed & mask
+            self.up_masks[n] = changed & prev
+            for i in bits(self.down_masks[n]):
+                down[i] = 1
+            for i in bits(self.up_masks[n]):
+                up[i] = 1
+            self.prev_masks[n] = mask
+
+
+
+class ScriptedController:
+    """moves the player along a list of (ticks, (x, y)) steps instead of
+    reading the keyboard. The script is repeated when it ends
+    Args:
+        script: e.g. [(60, (1, 0)), (30, (0, 1))] moves right for 60 ticks,
+                then down for 30 ticks"""
+    def __init__(self, script):
+        self.script = script
+        self.step = 0
+        self.ticks = 0
+
+
+    def get_move(self, player):
+        duration, move = self.script[self.step]
+        self.ticks += 1
+        if self.ticks >= duration:
+            self.ticks = 0
+            self.step = (self.step + 1) % len(self.script)
+        return move
+
+
+
+class RandomWalkController:
+    """moves the player in a random direction that changes every few
+    ticks or when the player runs into a wall. Seeded, so runs can be
+    repeated"""
+    def __init__(self, seed=0, interval=90):
+        self.random = random.Random(seed)
+        self.interval = interval
+        self.ticks = 0
+        self.move = (0, 0)
+
+
+    def get_move(self, player):
+        self.ticks -= 1
+        stuck = player.vel.x == 0 and player.vel.y == 0
+        if self.ticks <= 0 or stuck:
+            self.ticks = self.interval
+            self.move = (self.random.randint(-1, 1),
+                         self.random.randint(-1, 1))
+        return self.move
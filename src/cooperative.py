@@ -0,0 +1,300 @@
+import heapq
+import numpy as np
+
+import settings as st
+
+
+'''
+Cooperative pathfinding (windowed hierarchical cooperative A*)
+
+Time is split into steps of COOP_STEP_TICKS ticks, about the time an NPC
+needs to walk one grid cell. Every NPC plans COOP_WINDOW steps ahead with
+a search over (cell, time step) that may also wait in a cell, and reserves
+the cells of its plan in a table that the other NPCs plan around.
+The search is guided by the true distance to the goal on the empty grid
+(the abstract level of the hierarchy), so the part of the path beyond the
+window doesn't have to be searched. These distance fields are built
+COOP_FIELD_ITERATIONS iterations per tick, until one is done the search
+only uses the distance without walls.
+NPCs plan again after COOP_REPLAN_STEPS steps, at most COOP_PLANS_PER_TICK
+of them in one tick.
+'''
+
+DIAGONAL = 2 ** 0.5
+MOVES = ((1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1),
+         (1, 1, DIAGONAL), (-1, -1, DIAGONAL), (1, -1, DIAGONAL),
+         (-1, 1, DIAGONAL))
+# cost of staying in a cell for one step
+WAIT_COST = 1
+
+
+def octile(dx, dy):
+    """returns the distance without walls"""
+    dx, dy = abs(dx), abs(dy)
+    return max(dx, dy) + (DIAGONAL - 1) * min(dx, dy)
+
+
+
+class DistanceField:
+    """the length of the shortest path (in cells) from every cell to the
+    goal, inf where it can't be reached.
+    Every iteration updates all cells at once, so there are about as many
+    iterations as cells on the longest path. step() runs some of them, so
+    that the work can be spread over several ticks.
+    Diagonal moves past corners are allowed here, so the distances are
+    never longer than the real ones"""
+    def __init__(self, goal, passable):
+        self.goal = goal
+        self.passable = passable.copy()
+        self.passable[goal] = True
+        self.distance = np.full(passable.shape, np.inf)
+        self.distance[goal] = 0
+        # list [x][y] of the distances when the field is done
+        self.distances = None
+
+
+    @property
+    def done(self):
+        return self.distances is not None
+
+
+    def step(self, iterations):
+        """runs up to this many iterations, returns True when the field is
+        done"""
+        for _ in range(iterations):
+            if self.done:
+                break
+            distance = self.distance
+            new = distance.copy()
+            for dx, dy, cost in MOVES:
+                # new[x, y] = min(new[x, y], distance[x + dx, y + dy] + cost)
+                target = new[max(-dx, 0):new.shape[0] - max(dx, 0),
+                             max(-dy, 0):new.shape[1] - max(dy, 0)]
+                source = distance[max(dx, 0):distance.shape[0] - max(-dx, 0),
+                                  max(dy, 0):distance.shape[1] - max(-dy, 0)]
+                np.minimum(target, source + cost, out=target)
+            new[~self.passable] = np.inf
+            if np.array_equal(new, distance):
+                # lists are faster to index one cell at a time
+                self.distances = distance.tolist()
+                self.distance = self.passable = None
+            else:
+                self.distance = new
+        return self.done
+
+
+
+class CooperativePlanner:
+    """plans the paths of the NPCs around each other's reservations (see
+    above). The NPCs ask with wants_plan() if they should plan and read
+    their target point with plan_step()"""
+    def __init__(self, game):
+        self.game = game
+        self.tick = 0
+        # number of plans in the current tick
+        self.planned = 0
+        # (x, y, time step): sprite id
+        self.reservations = {}
+        # sprite id: list of reserved keys
+        self.reserved = {}
+        # sprite id: time step at the start of its plan
+        self.plan_starts = {}
+        # (goal, radius): DistanceField, done or being built
+        self.fields = {}
+
+
+    def clear(self):
+        """drops all plans, call this when the map or the walls change"""
+        self.reservations.clear()
+        self.reserved.clear()
+        self.plan_starts.clear()
+        self.fields.clear()
+
+
+    @property
+    def step(self):
+        return self.tick // st.COOP_STEP_TICKS
+
+
+    def update(self):
+        """advances the clock, forgets the reservations of the past and
+        continues building the distance fields"""
+        self.tick += 1
+        for field in self.fields.values():
+            if not field.done:
+                field.step(st.COOP_FIELD_ITERATIONS)
+        self.planned = 0
+        if self.tick % st.COOP_STEP_TICKS == 0:
+            step = self.step
+            for key in [key for key in self.reservations if key[2] < step]:
+                del self.reservations[key]
+
+
+    def wants_plan(self, sprite):
+        """returns True if the sprite should plan now: it has no plan or
+        the plan is getting old, and the budget of this tick isn't used"""
+        if self.planned >= st.COOP_PLANS_PER_TICK:
+            return False
+        start = self.plan_starts.get(sprite.id)
+        return start is None or self.step - start >= st.COOP_REPLAN_STEPS
+
+
+    def plan_step(self, sprite):
+        """returns the number of time steps since the sprite's plan started,
+        None if it has no plan"""
+        start = self.plan_starts.get(sprite.id)
+        if start is None:
+            return None
+        return self.step - start
+
+
+    def release(self, sprite):
+        """removes the plan and the reservations of the sprite"""
+        for key in self.reserved.pop(sprite.id, ()):
+            if self.reservations.get(key) == sprite.id:
+                del self.reservations[key]
+        self.plan_starts.pop(sprite.id, None)
+
+
+    def heuristic(self, goal, radius):
+        """returns a function h(x, y) with a lower bound of the distance from
+        the cell to the goal. It is computed per cell when the search asks
+        for it.
+        The goal moves with the player, so instead of a new distance field
+        the field of a goal within COOP_HEURISTIC_REUSE cells is used if
+        there is one: the distance to the other goal minus the distance
+        between the goals is never longer than the distance to this goal.
+        Without a field that is done the distance without walls is used and
+        a new field is started"""
+        gx, gy = goal
+        distances = None
+        building = False
+        for (_, other_radius), field in self.fields.items():
+            if other_radius != radius:
+                continue
+            if not field.done:
+                building = True
+            elif field.distances[gx][gy] <= st.COOP_HEURISTIC_REUSE:
+                distances = field.distances
+                offset = distances[gx][gy]
+                break
+        if distances is None and not building:
+            self.add_field(goal, radius)
+
+        if distances is None:
+            return lambda x, y: octile(x - gx, y - gy)
+        return lambda x, y: max(distances[x][y] - offset,
+                                octile(x - gx, y - gy))
+
+
+    def add_field(self, goal, radius):
+        """starts building the distance field of the goal, see update()"""
+        if len(self.fields) >= st.COOP_HEURISTIC_CACHE:
+            # forget the oldest one
+            del self.fields[next(iter(self.fields))]
+        passable = np.array(self.game.clearance) >= radius
+        self.fields[(goal, radius)] = DistanceField(goal, passable)
+
+
+    def blocked(self, sprite_id, cell, next_cell, step):
+        """returns True if another sprite reserved next_cell for step + 1
+        or comes the other way from next_cell to cell"""
+        x, y = next_cell
+        other = self.reservations.get((x, y, step + 1))
+        if other is not None and other != sprite_id:
+            return True
+        other = self.reservations.get((x, y, step))
+        return (other is not None and other != sprite_id and
+                self.reservations.get((cell[0], cell[1], step + 1)) == other)
+
+
+    def plan(self, sprite, start, goal):
+        """searches a path for the sprite from the start to the goal cell
+        for the next COOP_WINDOW time steps and reserves it.
+        Returns (cells, distance, expanded nodes, peak size of the open
+        list). cells has one cell per time step from the start, it is
+        empty if the goal can't be reached. distance is the length of the
+        whole path in cells"""
+        self.release(sprite)
+        self.planned += 1
+        clearance = self.game.clearance
+        radius = sprite.radius
+        width, height = len(clearance), len(clearance[0])
+        h = self.heuristic(goal, radius)
+
+        def free(x, y):
+            return 0 <= x < width and 0 <= y < height and \
+                   clearance[x][y] >= radius
+
+        if not (0 <= start[0] < width and 0 <= start[1] < height):
+            return [], 0, 0, 0
+        # the sprite can be pushed into a cell where it doesn't fit
+        start_h = min([h(*start)] + [
+                h(start[0] + dx, start[1] + dy) + cost
+                for dx, dy, cost in MOVES if free(start[0] + dx,
+                                                  start[1] + dy)])
+        if start_h == float('inf'):
+            return [], 0, 0, 0
+
+        now = self.step
+        sprite_id = sprite.id
+        # (f, g, time, cell)
+        open_list = [(start_h, 0, 0, start)]
+        g_score = {(start, 0): 0}
+        came_from = {}
+        expanded = 0
+        open_peak = 1
+        end = None
+        while open_list:
+            _, g, t, cell = heapq.heappop(open_list)
+            if g > g_score[(cell, t)]:
+                continue
+            if cell == goal or t == st.COOP_WINDOW:
+                end = (cell, t)
+                break
+            expanded += 1
+            x, y = cell
+            moves = [(x + dx, y + dy, cost) for dx, dy, cost in MOVES
+                     if free(x + dx, y + dy)
+                     # no diagonal moves past corners, like StepPathing
+                     and (cost == 1 or (free(x + dx, y) and free(x, y + dy)))]
+            moves.append((x, y, WAIT_COST))
+            for nx, ny, cost in moves:
+                next_cell = (nx, ny)
+                if self.blocked(sprite_id, cell, next_cell, now + t):
+                    continue
+                score = g + cost
+                key = (next_cell, t + 1)
+                if score < g_score.get(key, float('inf')):
+                    g_score[key] = score
+                    came_from[key] = (cell, t)
+                    heapq.heappush(open_list, (score + h(nx, ny), score,
+                                               t + 1, next_cell))
+            open_peak = max(open_peak, len(open_list))
+
+        if end is None:
+            # boxed in by the reservations, wait and try again
+            end = (start, 0)
+        cells = [end[0]]
+        node = end
+        while node in came_from:
+            node = came_from[node]
+            cells.append(node[0])
+        cells.reverse()
+        if end[0] == goal:
+            distance = g_score[end]
+        elif end[0] == start:
+            distance = start_h
+        else:
+            distance = g_score[end] + h(*end[0])
+
+        # reserve the cells, a sprite that arrived stays in its cell
+        keys = [(x, y, now + t) for t, (x, y) in enumerate(cells)]
+        last_x, last_y = cells[-1]
+        keys += [(last_x, last_y, now + t)
+                 for t in range(len(cells), st.COOP_WINDOW + 1)]
+        for key in keys:
+            self.reservations.setdefault(key, sprite_id)
+        self.reserved[sprite_id] = keys
+        self.plan_starts[sprite_id] = now
+        return cells, distance, expanded, open_peak
@@ -0,0 +1,86 @@
+import pygame as pg
+
+import settings as st
+import utilities as utils
+
+
+class DebugOverlay:
+    """draws the debug visuals (hitboxes, line of sight and NPC paths)
+    in one pass after the map and sprites have been drawn.
+    Static geometry like the wall hitboxes is drawn once to a surface in
+    world space, paths are only converted to world positions when the
+    sprite gets a new path"""
+    def __init__(self, game):
+        self.game = game
+        self.static_layer = None
+        self.static_key = None
+        # sprite: (path list, path positions in world space)
+        self.paths = {}
+
+
+    def wall_key(self):
+        """changes when the map or its walls change (see
+        dynamicwalls.py)"""
+        return (id(self.game.map), self.game.dynamic_walls.version)
+
+
+    def build_static_layer(self):
+        map_rect = self.game.map.rect
+        self.static_layer = pg.Surface(map_rect.size, pg.SRCALPHA)
+        self.static_layer.fill((0, 0, 0, 0))
+        for wall in self.game.walls:
+            pg.draw.rect(self.static_layer, pg.Color('Red'), wall.hitbox, 1)
+        self.static_key = self.wall_key()
+
+
+    def path_points(self, sprite):
+        """returns the sprite's path in world positions"""
+        cached = self.paths.get(sprite)
+        if cached is None or cached[0] is not sprite.path:
+            points = [utils.grid_to_pos(p, st.CELL_SIZE, st.CELL_OFFSET)
+                      for p in sprite.path]
+            cached = (sprite.path, points)
+            self.paths[sprite] = cached
+        return cached[1]
+
+
+    def draw(self, screen, camera):
+        offset_x, offset_y = camera.rect.x, camera.rect.y
+        # the part of the world that is visible on the screen
+        view = screen.get_rect().move(-offset_x, -offset_y)
+
+        if self.game.map.streamed:
+            # a layer the size of the world would be too big, and the
+            # walls change whenever a region is loaded
+            for wall in self.game.walls:
+                if view.colliderect(wall.hitbox):
+                    pg.draw.rect(screen, pg.Color('Red'),
+                                 camera.apply_rect(wall.hitbox), 1)
+        else:
+            if self.static_key != self.wall_key():
+                self.build_static_layer()
+            screen.blit(self.static_layer, (0, 0), view)
+
+        # forget the paths of sprites that don't exist anymore
+        for sprite in [s for s in self.paths if not s.alive()]:
+            del self.paths[sprite]
+
+        for sprite in self.game.all_sprites:
+            if hasattr(sprite, 'line_to_target') and sprite.line_to_target:
+                sprite.line_to_target.draw(screen, camera=camera)
+
+            if getattr(sprite, 'path', None):
+                points = self.path_points(sprite)
+                if len(points) > 1:
+                    pg.draw.lines(screen, pg.Color('Blue'), False,
+                                  [(x + offset_x, y + offset_y)
+                                   for x, y in points])
+            if hasattr(sprite, 'hitbox') and view.colliderect(sprite.rect):
+                pg.draw.rect(screen, pg.Color('Red'),
+                             camera.apply_rect(sprite.hitbox), 1)
+
+        screen_rect = screen.get_rect()
+        pg.draw.line(screen, pg.Color('white'),
+                     screen_rect.midleft, screen_rect.midright)
+        pg.draw.line(screen, pg.Color('white'),
+                     screen_rect.midtop, screen_rect.midbottom)
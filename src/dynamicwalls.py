@@ -0,0 +1,206 @@
+import pygame as pg
+
+import sprites as spr
+import tilemaps
+import clearance
+import settings as st
+
+
+'''
+Dynamic walls
+
+Walls can be added and removed while the game runs (doors, barricades,
+destructible walls). Instead of building everything again, only the part
+around the changed wall is updated:
+    maze: the cells within a cell of the wall
+    clearance grid: the cells within MAX_CLEARANCE of the wall
+    PVS: the pairs of regions that have lines across the wall
+    paths: NPCs whose path crosses the changed cells search again
+Every change bumps the version of the PVS regions it touches, caches of
+other systems can compare them to find out if a region changed.
+The map keeps the difference to its tmx file (see state()), so that saves,
+snapshots of the WorldHistory and recordings can restore it.
+'''
+
+
+class DynamicWalls:
+    """adds and removes the walls of the current map at runtime, see above.
+    Only for maps that are loaded completely, the regions of a streamed
+    map have their walls baked in"""
+    def __init__(self, game):
+        self.game = game
+        # (column, row) of a PVS region: number of changes in it
+        self.versions = {}
+        # number of all changes
+        self.version = 0
+
+
+    def clear(self):
+        """forgets the versions, call this when the map changes"""
+        self.versions.clear()
+
+
+    def region_version(self, pos):
+        """returns the version of the region at the position"""
+        size = st.PVS_REGION_SIZE
+        return self.versions.get((int(pos[0] // size),
+                                  int(pos[1] // size)), 0)
+
+
+    def add(self, rect, record=True):
+        """adds a wall and returns its sprite
+        Args:
+            rect: (x, y, width, height) of the wall
+            record: False for changes that replay by themselves (e.g. the
+                    ones of a rewind), see replay.InputRecorder"""
+        rect = pg.Rect(rect)
+        self.check_map()
+        game_map = self.game.map
+        wall = game_map.spawn(spr.Wall, {'x': rect.x, 'y': rect.y,
+                                         'width': rect.w, 'height': rect.h},
+                              None)
+        if tuple(rect) in game_map.removed_walls:
+            # a wall of the tmx file is back
+            game_map.removed_walls.remove(tuple(rect))
+        else:
+            game_map.added_walls.append(wall)
+        self.changed(wall.hitbox, added=True)
+        if record and self.game.input_recorder:
+            self.game.input_recorder.record_wall(rect, added=True)
+        return wall
+
+
+    def remove(self, wall, record=True):
+        """removes a wall sprite (added with add() or from the map), see
+        add() for record"""
+        self.check_map()
+        game_map = self.game.map
+        wall.kill()
+        if wall in game_map.sprites:
+            game_map.sprites.remove(wall)
+        game_map.static_sprites = [(s, groups) for s, groups
+                                   in game_map.static_sprites
+                                   if s is not wall]
+        if wall in game_map.added_walls:
+            game_map.added_walls.remove(wall)
+        else:
+            game_map.removed_walls.append(tuple(wall.hitbox))
+        self.changed(wall.hitbox, added=False)
+        if record and self.game.input_recorder:
+            self.game.input_recorder.record_wall(wall.hitbox, added=False)
+
+
+    def find(self, rect):
+        """returns the wall sprite with this hitbox, None if there is none"""
+        rect = tuple(rect)
+        return next((wall for wall in self.game.walls
+                     if tuple(wall.hitbox) == rect), None)
+
+
+    def state(self):
+        """returns the changes of the map's walls as (added, removed), two
+        tuples of (x, y, width, height)"""
+        game_map = self.game.map
+        if game_map.streamed:
+            return (), ()
+        return (tuple(tuple(wall.hitbox) for wall in game_map.added_walls),
+                tuple(game_map.removed_walls))
+
+
+    def restore(self, state):
+        """adds and removes walls until the changes of the map are the ones
+        of a state() that was taken before. The changes aren't recorded,
+        the rewind or load that restores them is"""
+        added, removed = (tuple(tuple(rect) for rect in rects)
+                          for rects in state)
+        if self.state() == (added, removed):
+            return
+        game_map = self.game.map
+        for wall in list(game_map.added_walls):
+            if tuple(wall.hitbox) not in added:
+                self.remove(wall, record=False)
+        for rect in list(game_map.removed_walls):
+            if rect not in removed:
+                self.add(rect, record=False)
+        current = self.state()
+        for rect in removed:
+            if rect not in current[1]:
+                self.remove(self.find(rect), record=False)
+        for rect in added:
+            if rect not in current[0]:
+                self.add(rect, record=False)
+
+
+    def check_map(self):
+        if self.game.map.streamed:
+            raise ValueError('Walls of streamed maps can\'t be changed')
+
+
+    def changed(self, rect, added):
+        """updates everything that depends on the walls around the rect"""
+        game = self.game
+        game_map = game.map
+        walls = [wall.hitbox for wall in game.walls]
+
+        # the maze cells are blocked within half a cell of a wall
+        self.update_grid(game_map.maze, tilemaps.build_maze,
+                         rect.inflate(st.CELL_SIZE * 2, st.CELL_SIZE * 2),
+                         walls, st.CELL_SIZE * 2)
+        margin = (st.MAX_CLEARANCE + st.CELL_SIZE) * 2
+        self.update_grid(game_map.clearance, clearance.build_clearance,
+                         rect.inflate(margin, margin), walls, margin)
+        game_map.pvs.update(game_map.size, walls, rect)
+
+        size = st.PVS_REGION_SIZE
+        area = rect.inflate(margin, margin)
+        for column in range(area.left // size, (area.right - 1) // size + 1):
+            for row in range(area.top // size, (area.bottom - 1) // size + 1):
+                key = (column, row)
+                self.versions[key] = self.versions.get(key, 0) + 1
+        self.version += 1
+
+        # the meshes are built again when they are needed
+        game_map.navmeshes.clear()
+        if not added:
+            # the distances to the goals can be shorter now, new walls
+            # only make them longer, so the old ones still work as a
+            # heuristic
+            game.path_planner.fields.clear()
+        self.invalidate_paths(area, added)
+
+
+    def update_grid(self, grid, build, area, walls, margin):
+        """builds the cells of a grid ([x][y]) in the area again
+        Args:
+            build: tilemaps.build_maze or clearance.build_clearance
+            margin: walls within this distance of the area are used"""
+        size = st.CELL_SIZE
+        left, top = max(area.left // size, 0), max(area.top // size, 0)
+        right = min(-(-area.right // size), len(grid))
+        bottom = min(-(-area.bottom // size), len(grid[0]))
+        if right <= left or bottom <= top:
+            return
+        cells = pg.Rect(left * size, top * size, (right - left) * size,
+                        (bottom - top) * size)
+        near = [wall for wall in walls
+                if wall.colliderect(cells.inflate(margin, margin))]
+        for x, column in enumerate(build(cells.size, near, (left, top))):
+            grid[left + x][top:bottom] = column
+
+
+    def invalidate_paths(self, area, added):
+        """makes the NPCs whose path crosses the area search again, the
+        other paths are kept"""
+        planner = self.game.path_planner
+        for sprite in self.game.all_sprites:
+            if not isinstance(sprite, spr.NPC):
+                continue
+            if not added and sprite.is_lost:
+                # the player might be reachable now
+                sprite.is_lost = False
+            points = [sprite.pos] + list(reversed(sprite.path_to_follow
+                                                  or ()))
+            if any(area.clipline(a, b) for a, b in zip(points, points[1:])):
+                # search in the next tick
+                sprite.counter = sprite.pathfinding_interval
+                planner.release(sprite)
@@ -1,20 +1,52 @@
 import pygame as pg
-import pygame.freetype
-import inspect
 import os
-import json
+import time
 
 import states
+import sprites
 import settings as st
+import snapshot
+from kinematics import Kinematics
 from load_assets import Loader
 import controls
 import utilities as utils
+from profiler import FrameProfiler, StartupTimer
+from pathstats import PathfindingStats
+from ai import AIScheduler
+from spatial import SpatialGrid
+from history import WorldHistory
+from maploader import MapLoader
+from mapcache import MapCache
+from cooperative import CooperativePlanner
+from dynamicwalls import DynamicWalls
 
 
 
 class Game:
-    def __init__(self):
-        pg.init()
+    def __init__(self, headless=False, player_controller=None,
+                 start_state=None, start_time=None):
+        """
+        Args:
+            headless: run without a window and without drawing, see
+                      run_headless()
+            player_controller: object with a get_move(player) method that
+                               replaces the keyboard input for the player
+            start_state: name of the first state, defaults to 'GameStart'
+                         if headless, else 'TitleScreen'
+            start_time: time.perf_counter() at the start of the program,
+                        for the startup report
+        """
+        # reported when the first frame is drawn, see finish_startup()
+        self.startup_timer = StartupTimer(start_time)
+        self.headless = headless
+        if headless:
+            # SDL needs a video driver to create surfaces, but this one
+            # doesn't open a window
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        # the other modules (fonts, joysticks) are started when they are
+        # needed, the mixer on a worker thread (see Loader.load_sounds)
+        pg.display.init()
         self.clock = pg.time.Clock()
         self.actual_screen = pg.display.set_mode((st.WINDOW_W, st.WINDOW_H))
         self.screen = pg.Surface((st.GAME_SCREEN_W, st.GAME_SCREEN_H))
@@ -23,49 +55,91 @@ class Game:
         self.world_screen_rect = self.world_screen.get_rect()
         self.world_screen_rect.topleft = (0,0)
         self.display_rect = self.actual_screen.get_rect()
+        self.startup_timer.mark('display')
         self.fps = st.FPS
+        # fixed timestep for the simulation, see run()
+        self.tick_dt = 1 / st.TICK_RATE
+        self.accumulator = 0
+        self.alpha = 0  # interpolation factor between two simulation steps
         self.all_sprites = pg.sprite.Group()
+        # physics data of all moving sprites
+        self.kinematics = Kinematics()
+        # neighbor queries between moving sprites
+        self.spatial_grid = SpatialGrid(st.SPATIAL_CELL_SIZE)
         self.walls = pg.sprite.Group()
         
+        self.text_renderer = utils.text_renderer
         self.fonts = {
-                'default': pygame.freetype.Font(file=None, size=14)
+                'default': self.text_renderer.get_font(None, 14,
+                                                       freetype=True)
                 }
         
-        self.fonts['default'].antialiased = False
-        
         self.base_dir = os.path.join(os.path.dirname(__file__), '..')
         
         map_path = os.path.join(self.base_dir, 'data', 'tilemaps')
         files = os.listdir(map_path)
         self.map_files = [os.path.join(map_path, f) for f in files
                           if f[-3:] == 'tmx']
+        # index of the current map in map_files
+        self.map_index = 0
+        self.map = None
+        # directory of a streamed world (see streaming.py), used instead of
+        # map_files if it is set
+        self.world_dir = None
+        self.map_loader = MapLoader(self)
+        self.map_cache = MapCache(st.MAP_CACHE_BUDGET)
         
         self.save_dir = os.path.join(self.base_dir, 'data', 'saves')
+        self.snapshot_writer = snapshot.SnapshotWriter()
         
         self.asset_loader = Loader(self)
-        self.graphics = self.asset_loader.load_graphics()
+        # ready before the first map is played
         self.asset_loader.load_sounds()
+        self.graphics = self.asset_loader.load_graphics()
+        self.startup_timer.mark('graphics')
         
         self.gamepad_controller = controls.GamepadController()
         self.key_getter = controls.KeyGetter(self)
+        self.player_controller = player_controller
+        # pressed keys of the current tick, like pg.key.get_pressed()
+        self.key_state = pg.key.get_pressed()
+        # replay.InputRecorder / replay.InputReplay instances
+        self.input_recorder = None
+        self.input_replay = None
 
         # initialise the state machine
         self.state_dict = {}
         self.state_name = ''
         self.state = None
-        self.setup_states()
+        if start_state is None:
+            # skip the title screen when running without a window
+            start_state = 'GameStart' if headless else 'TitleScreen'
+        self.setup_states(start_state)
+        self.startup_timer.mark('states')
 
         self.events_list = []
+        # False while the last tick updated a state like loading
+        self.tick_simulated = True
 
         self.running = True  # flag for the game loop
         self.debug_mode = False  # flag for debug mode
+        # frame timings, toggle the overlay with F3
+        self.profiler = FrameProfiler(self)
+        # statistics of the NPC path searches
+        self.path_stats = PathfindingStats()
+        self.ai_scheduler = AIScheduler(self)
+        # reservations of the cooperative pathfinding
+        self.path_planner = CooperativePlanner(self)
+        # walls that are added and removed at runtime
+        self.dynamic_walls = DynamicWalls(self)
+        self.history = WorldHistory(self, st.SNAPSHOT_CAPACITY,
+                                    st.SNAPSHOT_INTERVAL)
     
     
-    def setup_states(self):
-        # get a dictionary with all classes from the 'states' module
-        self.state_dict = dict(inspect.getmembers(states, inspect.isclass))
+    def setup_states(self, start='TitleScreen'):
+        self.state_dict = states.STATES
         # define the state at the start of the program
-        self.state_name = 'TitleScreen'
+        self.state_name = start
         self.state = self.state_dict[self.state_name](self)
         self.state.startup()
     
@@ -85,52 +159,118 @@ class Game:
         
     
     def save(self, filename):
-        """default save function. Saves all sprites' attributes
+        """default save function. Saves the persisted fields of all sprites
+        (see BaseSprite.persisted) and the changes of the walls as a binary
+        snapshot. The file is written on a background thread
         TODO: experimental
         Args:
-            filename: 'example.json'"""
-        save_data = {}
-        for sprite in self.all_sprites.sprites():
-            # check if attribute is serializable
-            keys_ok = []
-            for key, value in sprite.__dict__.items():
-                if utils.is_jsonable(value):
-                    keys_ok.append(key)
-            save_data['all_sprites'] = {key: sprite.__dict__[key]
-                                        for key in keys_ok}
-            
-        with open(os.path.join(self.save_dir, filename), 'w') as f:
-            json.dump(save_data, f)
+            filename: 'example.sav'"""
+        data = snapshot.dumps(self.all_sprites, self.dynamic_walls.state())
+        os.makedirs(self.save_dir, exist_ok=True)
+        self.snapshot_writer.write(os.path.join(self.save_dir, filename),
+                                   data)
+    
+    
+    def load(self, filename):
+        """restores the walls and the sprites of the current map from a
+        file written by save(). Sprites are matched by their class and id"""
+        # make sure that the file isn't being written right now
+        self.snapshot_writer.close()
+        with open(os.path.join(self.save_dir, filename), 'rb') as f:
+            data, walls = snapshot.loads(f.read(), sprites.SPRITES)
+        self.dynamic_walls.restore(walls)
+        
+        current = {(type(s).__name__, s.id): s for s in self.all_sprites}
+        for class_name, records in data.items():
+            for fields in records:
+                sprite = current.get((class_name, fields['id']))
+                if sprite is None:
+                    continue
+                for field, value in fields.items():
+                    setattr(sprite, field, value)
 
 
     def events(self):
         """empty the event queue and pass the events to the states"""
-        self.events_list = pg.event.get()
-        for event in self.events_list:
-            if event.type == pg.QUIT:
-                self.running = False
-            elif event.type == pg.KEYDOWN:
-                if event.key == pg.K_F12:
-                    self.debug_mode = not self.debug_mode
-            self.state.get_event(event)
+        start = time.perf_counter_ns()
+        events = pg.event.get()
+        if self.input_replay:
+            # the recorded events are passed in update()
+            events = [e for e in events if e.type == pg.QUIT]
+        # keep the events until the next simulation step has used them
+        self.events_list.extend(events)
+        for event in events:
+            self.handle_event(event)
+        self.profiler.add('events', time.perf_counter_ns() - start)
+
+
+    def handle_event(self, event):
+        self.gamepad_controller.handle_event(event)
+        if event.type == pg.QUIT:
+            self.running = False
+        elif event.type == pg.KEYDOWN:
+            if event.key == pg.K_F12:
+                self.debug_mode = not self.debug_mode
+            elif event.key == pg.K_F3:
+                self.profiler.toggle()
+        self.state.get_event(event)
 
 
     def update(self, dt):
         # get input before state updates
-        self.gamepad_controller.update()
+        start = time.perf_counter_ns()
+        # ticks of states like loading are left out of recordings
+        self.tick_simulated = self.is_simulated()
+        if self.input_replay and self.tick_simulated:
+            self.input_replay.apply(self)
+            dt = self.input_replay.dt
+        else:
+            self.key_state = pg.key.get_pressed()
+            self.gamepad_controller.update()
+        if self.input_recorder and self.tick_simulated:
+            self.input_recorder.record(self, dt)
         self.key_getter.get_input(self.gamepad_controller, self.events_list)
+        self.events_list = []
+        input_done = time.perf_counter_ns()
+        self.profiler.add('input', input_done - start)
 
         if self.state.done:
             self.flip_state()
         self.state.update(dt)
-        
-        current_fps = self.clock.get_fps()
-        pg.display.set_caption(f'FPS: {current_fps:2.2f}/{st.FPS} ({current_fps/st.FPS * 100:.1f} %)')
+        self.profiler.add('update', time.perf_counter_ns() - input_done)
+
+
+    def finish_startup(self):
+        """prints the startup times and starts the modules that aren't
+        needed for the first frame"""
+        self.startup_timer.mark('first frame')
+        self.startup_timer.report()
+        self.startup_timer = None
+        if not self.headless:
+            self.gamepad_controller.start()
+
+
+    def is_simulated(self):
+        """returns True if the state that is updated in the next tick
+        advances the game world (see State.simulated)"""
+        if self.state.done:
+            if self.state.next is None:
+                return False
+            return self.state_dict[self.state.next].simulated
+        return self.state.simulated
 
 
     def draw(self):
         # draw everything that happens in the current state
+        start = time.perf_counter_ns()
         self.state.draw()
+        if self.profiler.visible:
+            self.profiler.draw(self.screen)
+        draw_done = time.perf_counter_ns()
+        self.profiler.add('draw', draw_done - start)
+
+        current_fps = self.clock.get_fps()
+        pg.display.set_caption(f'FPS: {current_fps:2.2f}/{st.FPS} ({current_fps/st.FPS * 100:.1f} %)')
         
         # transform the drawing surface to the window size
         transformed_screen = pg.transform.scale(self.screen, (st.WINDOW_W,
@@ -138,13 +278,70 @@ class Game:
         # blit the drawing surface to the application window
         self.actual_screen.blit(transformed_screen, (0, 0))
         pg.display.update()
+        self.profiler.add('present', time.perf_counter_ns() - draw_done)
+        if self.startup_timer:
+            self.finish_startup()
 
 
     def run(self):
+        """fixed timestep game loop: the simulation advances in steps of
+        tick_dt, rendering happens once per loop and interpolates between
+        the last two simulation steps"""
         while self.running:
-            delta_time = self.clock.tick(self.fps) / 1000  # "dt"
+            frame_time = self.clock.tick(self.fps) / 1000
+            self.accumulator += frame_time
             self.events()
-            self.update(delta_time)
+
+            steps = 0
+            while (self.accumulator >= self.tick_dt and
+                   steps < st.MAX_TICKS_PER_FRAME):
+                self.update(self.tick_dt)
+                self.accumulator -= self.tick_dt
+                steps += 1
+            if steps == st.MAX_TICKS_PER_FRAME:
+                # too slow to catch up, drop the remaining time
+                self.accumulator = min(self.accumulator, self.tick_dt)
+
+            self.alpha = self.accumulator / self.tick_dt
             self.draw()
+            self.profiler.end_frame()
 
+        if self.input_recorder:
+            self.input_recorder.close()
+        self.profiler.close()
+        self.snapshot_writer.close()
+        self.map_loader.close()
+        self.asset_loader.close()
         pg.quit()
+
+
+    def run_headless(self, ticks):
+        """advances the simulation for a number of ticks as fast as
+        possible, without drawing or waiting for the clock
+        Returns the number of ticks per second"""
+        start = time.perf_counter()
+        done = 0
+        while done < ticks and self.running:
+            self.events()
+            self.update(self.tick_dt)
+            self.profiler.end_frame()
+            if self.startup_timer:
+                self.finish_startup()
+            # loading ticks are not counted, so that a replay runs for
+            # as many ticks as it was recorded
+            if self.tick_simulated:
+                done += 1
+        elapsed = time.perf_counter() - start
+
+        if self.input_recorder:
+            self.input_recorder.close()
+        self.profiler.close()
+        self.snapshot_writer.close()
+        self.map_loader.close()
+        self.asset_loader.close()
+
+        ticks_per_second = done / elapsed if elapsed > 0 else 0
+        print(f'{done} ticks in {elapsed:.3f} s '
+              f'({ticks_per_second:.1f} ticks/s)')
+        print(f'Pathfinding: {self.path_stats.summary()}')
+        return ticks_per_second
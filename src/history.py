@@ -0,0 +1,129 @@
+import pygame as pg
+from collections import deque
+
+
+'''
+In-memory snapshots of the world for rewinding and quick-loading
+
+A snapshot holds copies of the Kinematics arrays and the fields in
+rewind_fields of every moving sprite (see sprites.KinematicSprite). Values
+that are replaced instead of changed in place (paths, images, vectors) are
+shared between snapshots, only rects are copied. Restoring a snapshot is
+linear in the number of sprites and doesn't touch the disk. The changes of
+the walls are stored as well, the map is only updated if they differ.
+Sprites that were killed since the snapshot are added back to their groups,
+the ones that were created since are removed.
+'''
+
+
+class WorldState:
+    __slots__ = ('tick', 'kinematics', 'sprites', 'camera', 'walls')
+
+    def __init__(self, tick, kinematics, sprites, camera, walls):
+        self.tick = tick
+        # copies of the arrays (see Kinematics.get_state)
+        self.kinematics = kinematics
+        # [(sprite, (field values), groups)]
+        self.sprites = sprites
+        self.camera = camera
+        # see DynamicWalls.state()
+        self.walls = walls
+
+
+
+class WorldHistory:
+    """ring buffer of the last snapshots, taken every interval ticks. The
+    oldest snapshots are dropped when it is full
+    Args:
+        game: Game instance
+        capacity: max number of snapshots
+        interval: ticks between two snapshots"""
+    def __init__(self, game, capacity, interval):
+        self.game = game
+        self.interval = interval
+        self.states = deque(maxlen=capacity)
+        self.quick_save_state = None
+        self.tick = 0
+
+
+    def clear(self):
+        """drops all snapshots, call this when a new map is loaded"""
+        self.states.clear()
+        self.quick_save_state = None
+        self.tick = 0
+
+
+    def update(self):
+        """counts the ticks and takes a snapshot every interval ticks"""
+        self.tick += 1
+        if self.tick % self.interval == 0:
+            self.states.append(self.capture())
+
+
+    def capture(self):
+        kinematics = self.game.kinematics
+        sprites = [(sprite, tuple(copy(getattr(sprite, field))
+                                  for field in sprite.rewind_fields),
+                    sprite.groups())
+                   for sprite in kinematics.sprites[:kinematics.count]]
+        camera = self.game.camera
+        return WorldState(self.tick, kinematics.get_state(), sprites,
+                          (camera.rect.copy(), camera.last_rect,
+                           camera.next_rect),
+                          self.game.dynamic_walls.state())
+
+
+    def restore(self, state):
+        # the walls first, changing them makes NPCs search again
+        self.game.dynamic_walls.restore(state.walls)
+        kinematics = self.game.kinematics
+        restored = {sprite for sprite, _, _ in state.sprites}
+        created = [sprite for sprite in kinematics.sprites[:kinematics.count]
+                   if sprite not in restored]
+        kinematics.set_state(state.kinematics)
+        for sprite in created:
+            # its body isn't in the restored arrays
+            sprite.body_index = None
+            sprite.kill()
+        for sprite, values, groups in state.sprites:
+            for field, value in zip(sprite.rewind_fields, values):
+                setattr(sprite, field, copy(value))
+            sprite.add(*groups)
+        camera = self.game.camera
+        rect, camera.last_rect, camera.next_rect = state.camera
+        camera.rect = rect.copy()
+        self.tick = state.tick
+        # the reservations were made for the time that is undone
+        self.game.path_planner.clear()
+
+
+    def rewind(self):
+        """restores the most recent snapshot and removes it from the buffer.
+        Returns False if there is none left"""
+        if not self.states:
+            return False
+        self.restore(self.states.pop())
+        return True
+
+
+    def quick_save(self):
+        self.quick_save_state = self.capture()
+
+
+    def quick_load(self):
+        """restores the state of the last quick_save(). The snapshots that
+        were taken after it are dropped"""
+        if self.quick_save_state is None:
+            return False
+        while self.states and self.states[-1].tick > self.quick_save_state.tick:
+            self.states.pop()
+        self.restore(self.quick_save_state)
+        return True
+
+
+
+def copy(value):
+    # rects are changed in place by the sprites, everything else is replaced
+    if isinstance(value, pg.Rect):
+        return value.copy()
+    return value
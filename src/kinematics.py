@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class Kinematics:
+    """stores position, velocity, acceleration, speed and friction of all
+    moving sprites in contiguous arrays and integrates all of them in
+    one vectorized step per tick.
+    Sprites get an index into the arrays with add() and read and write
+    their values through it (see sprites.KinematicSprite)"""
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.sprites = []
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.acc = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.friction = np.zeros(capacity)
+        # False if the velocity fell below the threshold in the last step
+        self.moving = np.zeros(capacity, dtype=bool)
+        # velocities smaller than this are set to 0
+        self.min_speed = 0.05
+
+
+    def grow(self):
+        capacity = len(self.speed) * 2
+        for name in ('pos', 'vel', 'acc', 'speed', 'friction', 'moving'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+
+    def add(self, sprite, pos, speed, friction):
+        """adds a sprite and returns its index"""
+        if self.count == len(self.speed):
+            self.grow()
+        i = self.count
+        self.pos[i] = pos
+        self.vel[i] = 0
+        self.acc[i] = 0
+        self.speed[i] = speed
+        self.friction[i] = friction
+        self.moving[i] = False
+        self.sprites.append(sprite)
+        self.count += 1
+        return i
+
+
+    def remove(self, index):
+        """removes the sprite at index by moving the last sprite into its
+        place, so that the arrays stay contiguous"""
+        last = self.count - 1
+        if index != last:
+            for array in (self.pos, self.vel, self.acc, self.speed,
+                          self.friction, self.moving):
+                array[index] = array[last]
+            moved = self.sprites[last]
+            self.sprites[index] = moved
+            moved.body_index = index
+        self.sprites.pop()
+        self.count -= 1
+
+
+    def get_state(self):
+        """returns copies of the used part of the arrays and the sprites"""
+        n = self.count
+        return (list(self.sprites), self.pos[:n].copy(), self.vel[:n].copy(),
+                self.acc[:n].copy(), self.speed[:n].copy(),
+                self.friction[:n].copy(), self.moving[:n].copy())
+
+
+    def set_state(self, state):
+        """restores the arrays from get_state()"""
+        sprites, pos, vel, acc, speed, friction, moving = state
+        while len(self.speed) < len(sprites):
+            self.grow()
+        n = len(sprites)
+        self.pos[:n] = pos
+        self.vel[:n] = vel
+        self.acc[:n] = acc
+        self.speed[:n] = speed
+        self.friction[:n] = friction
+        self.moving[:n] = moving
+        self.sprites = list(sprites)
+        self.count = n
+        for index, sprite in enumerate(sprites):
+            sprite.body_index = index
+
+
+    def step(self, dt):
+        n = self.count
+        if n == 0:
+            return
+        acc = self.acc[:n]
+        vel = self.vel[:n]
+
+        # prevent faster diagonal movement
+        length = np.hypot(acc[:, 0], acc[:, 1])
+        scale = np.where(length > 1, 1 / np.maximum(length, 1), 1)
+        # laws of motion
+        vel += acc * (scale * self.speed[:n] * dt)[:, None]
+        vel *= self.friction[:n, None]
+
+        moving = np.hypot(vel[:, 0], vel[:, 1]) >= self.min_speed
+        vel[~moving] = 0
+        self.moving[:n] = moving
+
+        self.pos[:n] += vel
@@ -1,7 +1,9 @@
 import pygame as pg
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import settings as st
+from sound import SoundBank, load_effects
 
 
 def images_from_strip(strip, number):
@@ -16,6 +18,54 @@ def images_from_strip(strip, number):
     return images
 
 
+def pack_atlas(frames, max_width=256):
+    """packs a list of surfaces into one atlas surface, row by row
+    (simple shelf packing)
+    Returns the atlas surface and a list with one rect per frame"""
+    rects = []
+    x = y = row_h = 0
+    for frame in frames:
+        w, h = frame.get_size()
+        if x + w > max_width:
+            # start a new row
+            x = 0
+            y += row_h
+            row_h = 0
+        rects.append(pg.Rect(x, y, w, h))
+        x += w
+        row_h = max(row_h, h)
+
+    atlas_w = max([r.right for r in rects] + [1])
+    atlas_h = max([r.bottom for r in rects] + [1])
+    atlas = pg.Surface((atlas_w, atlas_h), pg.SRCALPHA)
+    for frame, rect in zip(frames, rects):
+        atlas.blit(frame, rect)
+
+    return atlas.convert_alpha(), rects
+
+
+def animations_from_atlas(atlas, rects, names):
+    """builds a dict with 'animation_right' and 'animation_left' lists of
+    subsurfaces of the atlas. The left facing frames are taken from one
+    mirrored copy of the whole atlas, so no frame is flipped twice
+    Args:
+        atlas: the packed atlas surface
+        rects: rects of the frames on the atlas
+        names: animation name for each frame (e.g. 'idle', 'run')"""
+    flipped = pg.transform.flip(atlas, True, False)
+    atlas_w = atlas.get_width()
+
+    animations = {}
+    for rect, name in zip(rects, names):
+        mirrored = pg.Rect(atlas_w - rect.right, rect.y, rect.w, rect.h)
+        animations.setdefault(f'{name}_right', []).append(
+                atlas.subsurface(rect))
+        animations.setdefault(f'{name}_left', []).append(
+                flipped.subsurface(mirrored))
+
+    return animations
+
+
 class Loader:
     def __init__(self, game):
         self.game = game
@@ -27,74 +77,81 @@ class Loader:
         self.gui_image_folder = os.path.join(self.graphics_folder, 'GUI')
         self.font_folder = os.path.join(base_dir, 'assets', 'fonts')
             
-        self.channel = None
+        # the sound effects, decoded by load_sounds() on a worker thread
+        self.sound_executor = ThreadPoolExecutor(max_workers=1)
+        self.sound_future = None
+        # SoundBank, created on the main thread when they are needed
+        self._sound_bank = None
         
         # TODO: dict comprehension?
         self.fonts = {
                 'slkscr': os.path.join(self.font_folder, 'slkscr.ttf')
                 }
-
-        # sound libs stored as (filename, relative volume)
-        self.music_lib = {}
-        self.sfx_lib = {}
         
         
     def load_graphics(self):
-        """load sprite image strips here"""
-        files = os.listdir(self.sprite_folder)
-        img_files = [os.path.join(self.sprite_folder, f)
-                     for f in files if f[-3:] == 'png']
-
-        knight_imgs = sorted(list(filter(lambda x: 'knight' in x, img_files)))
-        elf_imgs = sorted(list(filter(lambda x: 'elf' in x, img_files)))
+        """load the sprite frames, pack them into one atlas and build the
+        animation sets that are shared by all sprite instances"""
+        files = sorted(f for f in os.listdir(self.sprite_folder)
+                       if f[-3:] == 'png')
         tileset_img = os.path.join(self.tileset_folder,
                                    '0x72_DungeonTilesetII_v1.3.png')
 
+        # decode the files in parallel, converting them needs the main thread
+        paths = [os.path.join(self.sprite_folder, f) for f in files]
+        with ThreadPoolExecutor() as executor:
+            *frames, tileset = executor.map(pg.image.load,
+                                            paths + [tileset_img])
+        atlas, rects = pack_atlas(frames)
+
         gfx_lib = {
-                'knight': [pg.image.load(im).convert_alpha()
-                           for im in knight_imgs],
-                'elf': [pg.image.load(im).convert_alpha() for im in elf_imgs],
-                'tileset0': pg.image.load(tileset_img).convert_alpha()
+                'atlas': atlas,
+                'tileset0': tileset.convert_alpha()
                 }
-        
+        # filenames look like 'knight_f_run_anim_f0.png'
+        for character in ('knight', 'elf'):
+            indices = [i for i, f in enumerate(files)
+                       if f.startswith(character + '_')]
+            names = [files[i].split('_')[2] for i in indices]
+            gfx_lib[character] = animations_from_atlas(
+                    atlas, [rects[i] for i in indices], names)
+
         return gfx_lib
     
     
     def load_sounds(self):
-        pg.mixer.init()
-        
-        music_files = []
-        sfx_files = []
+        """starts the mixer and decodes the sound effects on a worker
+        thread. The mixer isn't thread-safe, only the decoding is moved"""
+        if self.sound_future is None:
+            pg.mixer.init()
+            self.sound_future = self.sound_executor.submit(
+                    load_effects, os.path.join(self.sounds_folder, 'sfx'))
+
+
+    def sounds_ready(self):
+        return self.sound_future is not None and self.sound_future.done()
+
+
+    @property
+    def sound_bank(self):
+        """waits until the sounds are loaded. Exceptions from the worker
+        thread are raised here"""
+        if self._sound_bank is None:
+            self.load_sounds()
+            self._sound_bank = SoundBank(self.sounds_folder,
+                                         effects=self.sound_future.result())
+        return self._sound_bank
 
-        music_objects = [os.path.join(self.sounds_folder, 'bgm', f)
-                         for f in music_files]     
-        sfx_objects = [pg.mixer.Sound(os.path.join(self.sounds_folder,
-                                                   'sfx', f))
-                       for f in sfx_files]
 
+    def close(self):
+        # pygame must not quit while a sound is decoded
+        self.sound_executor.shutdown(wait=True)
         
         
     def play_music(self, key, loop=True):
-        if loop:
-            loops = -1
-        else:
-            loops = 0
-        pg.mixer.music.load(self.music_lib[key][0])
-        pg.mixer.music.play(loops)
-        volume = st.MUSIC_VOLUME * self.music_lib[key][1]
-        pg.mixer.music.set_volume(volume)
+        self.sound_bank.play_music(key, loop)
         
           
-    def play_sound(self, key):
-        sound = self.sfx_lib[key][0]
-        volume = st.SFX_VOLUME * self.sfx_lib[key][1]
-        sound.set_volume(volume)
-        # play the sound if it isn't already being played
-        if self.channel is None:
-            self.channel = sound.play()
-        else:
-            if self.channel.get_sound() == sound:
-                if not self.channel.get_busy():
-                    self.channel = sound.play()
-            else:
-                self.channel = sound.play()
+    def play_sound(self, key, priority=None):
+        """plays a sound effect, see SoundBank.play()"""
+        return self.sound_bank.play(key, priority)
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+
+class MapCache:
+    """keeps the maps that were played before (tilemaps.Map with its
+    layers, walls, maze and spawn data) so that going back to them doesn't
+    load the file again. When the maps together need more memory than the
+    budget, the least recently used ones are dropped
+    Args:
+        budget: max size of all maps in bytes (see Map.memory_size)"""
+    def __init__(self, budget):
+        self.budget = budget
+        # filename: (Map, size), the most recently used map is last
+        self.maps = OrderedDict()
+        self.size = 0
+
+
+    def __contains__(self, filename):
+        return filename in self.maps
+
+
+    def get(self, filename):
+        """returns the map or None if it isn't cached"""
+        entry = self.maps.get(filename)
+        if entry is None:
+            return None
+        self.maps.move_to_end(filename)
+        return entry[0]
+
+
+    def put(self, game_map):
+        """adds the map as the most recently used one. The map that was
+        added last is never dropped, even if it exceeds the budget"""
+        if game_map.filename in self.maps:
+            self.maps.move_to_end(game_map.filename)
+            return
+        size = game_map.memory_size()
+        self.maps[game_map.filename] = (game_map, size)
+        self.size += size
+        while self.size > self.budget and len(self.maps) > 1:
+            _, (_, dropped_size) = self.maps.popitem(last=False)
+            self.size -= dropped_size
+
+
+    def clear(self):
+        self.maps.clear()
+        self.size = 0
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import tilemaps
+import clearance
+from pvs import PVS, cache_file
+
+
+class MapLoader:
+    """loads maps in the background. Parsing the tmx file and building
+    the maze, the clearance grid and the PVS happen on a worker thread,
+    everything that creates Surfaces (tile images, layers) and the sprites
+    is left to the main thread
+    Usage:
+        loader.request(filename)  # starts loading
+        ...
+        if loader.ready(filename):
+            game.map = loader.get(filename)
+            game.map.create_map()  # or create_steps()"""
+    def __init__(self, game):
+        self.game = game
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # filename: Future of (tiled map without images, maze, clearance,
+        # pvs)
+        self.futures = {}
+
+
+    def request(self, filename):
+        """starts loading the map, if it isn't loading already"""
+        if filename not in self.futures:
+            self.futures[filename] = self.executor.submit(self.parse,
+                                                          filename)
+
+
+    def parse(self, filename):
+        # runs on the worker thread
+        tiled_map = tilemaps.parse_map(filename)
+        size = (tiled_map.width * tiled_map.tilewidth,
+                tiled_map.height * tiled_map.tileheight)
+        walls = tilemaps.wall_rects(tiled_map)
+        maze = tilemaps.build_maze(size, walls)
+        return (tiled_map, maze, clearance.build_clearance(size, walls),
+                PVS.cached(cache_file(filename), size, walls))
+
+
+    def ready(self, filename):
+        future = self.futures.get(filename)
+        return future is not None and future.done()
+
+
+    def get(self, filename):
+        """waits until the map is parsed and returns it as a tilemaps.Map
+        with its images loaded. Its layers and sprites are not created
+        yet. Exceptions from the worker thread are raised here"""
+        self.request(filename)
+        tiled_map, maze, clearance_grid, pvs = self.futures.pop(
+                filename).result()
+        tilemaps.load_images(tiled_map)
+        return tilemaps.Map(self.game, filename, tiled_map, maze,
+                            clearance_grid, pvs)
+
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
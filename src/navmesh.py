@@ -0,0 +1,251 @@
+import heapq
+from bisect import bisect_right
+import numpy as np
+
+
+'''
+Navigation mesh
+
+The free space of a map is split into rectangles that don't overlap. Two
+rectangles that share a piece of an edge are connected by a portal (that
+piece of the edge). A path search visits rectangles instead of grid cells
+and the funnel algorithm pulls the path through the portals, so the path
+only has points at the corners it has to go around.
+
+The walls are grown by the hitbox size first, so the mesh is the space
+where the center of the hitbox can be, and there is one mesh per hitbox
+size.
+'''
+
+
+def triarea2(a, b, c):
+    """twice the signed area of the triangle a, b, c"""
+    return ((c[0] - a[0]) * (b[1] - a[1])
+            - (b[0] - a[0]) * (c[1] - a[1]))
+
+
+def string_pull(start, end, portals):
+    """simple stupid funnel algorithm (Mikko Mononen). Returns the
+    shortest path from start to end through the portals
+    Args:
+        portals: list of (left, right) points in the order they are
+                 crossed"""
+    portals = [(start, start)] + portals + [(end, end)]
+    path = [start]
+    apex = left = right = start
+    apex_index = left_index = right_index = 0
+
+    i = 1
+    while i < len(portals):
+        portal_left, portal_right = portals[i]
+        # try to narrow the funnel from the right
+        if triarea2(apex, right, portal_right) <= 0:
+            if apex == right or triarea2(apex, left, portal_right) > 0:
+                right = portal_right
+                right_index = i
+            else:
+                # the right side crosses the left one, the left point
+                # is a corner of the path
+                path.append(left)
+                apex = right = left
+                apex_index = right_index = left_index
+                i = apex_index + 1
+                continue
+        # try to narrow the funnel from the left
+        if triarea2(apex, left, portal_left) >= 0:
+            if apex == left or triarea2(apex, right, portal_left) < 0:
+                left = portal_left
+                left_index = i
+            else:
+                path.append(right)
+                apex = left = right
+                apex_index = left_index = right_index
+                i = apex_index + 1
+                continue
+        i += 1
+
+    if path[-1] != end:
+        path.append(end)
+    return path
+
+
+
+class NavMesh:
+    """rectangle decomposition of the free space of a map for hitboxes of
+    one size
+    Args:
+        size: size of the map in pixels
+        walls: list of wall rects
+        agent_size: (width, height) of the hitbox"""
+    def __init__(self, size, walls, agent_size):
+        width, height = int(size[0]), int(size[1])
+        w, h = agent_size
+        # the hitbox touches a wall if its center is in the grown wall
+        grown = [wall.inflate(w, h).clip((0, 0, width, height))
+                 for wall in walls]
+        grown = [rect for rect in grown if rect.w and rect.h]
+
+        # the wall edges split the map into a grid of cells that are
+        # either completely blocked or completely free
+        self.xs = sorted({0, width}.union(
+                *((rect.left, rect.right) for rect in grown)))
+        self.ys = sorted({0, height}.union(
+                *((rect.top, rect.bottom) for rect in grown)))
+        columns, rows = len(self.xs) - 1, len(self.ys) - 1
+        column_of = {x: i for i, x in enumerate(self.xs)}
+        row_of = {y: i for i, y in enumerate(self.ys)}
+        blocked = np.zeros((columns, rows), dtype=bool)
+        for rect in grown:
+            blocked[column_of[rect.left]:column_of[rect.right],
+                    row_of[rect.top]:row_of[rect.bottom]] = True
+
+        # region index of every cell, -1 for blocked cells
+        self.cells = np.full((columns, rows), -1, dtype=int)
+        # (left, top, right, bottom) of the regions in pixels
+        self.regions = []
+        self.merge_cells(blocked)
+        # region: list of (neighbor, portal start, portal end)
+        self.links = [[] for _ in self.regions]
+        self.find_portals()
+
+
+    def merge_cells(self, blocked):
+        """grows rectangles of free cells, first to the right, then down"""
+        free = ~blocked
+        columns, rows = free.shape
+        for y in range(rows):
+            for x in range(columns):
+                if not free[x, y]:
+                    continue
+                right = x + 1
+                while right < columns and free[right, y]:
+                    right += 1
+                bottom = y + 1
+                while bottom < rows and free[x:right, bottom].all():
+                    bottom += 1
+                free[x:right, y:bottom] = False
+                self.cells[x:right, y:bottom] = len(self.regions)
+                self.regions.append((self.xs[x], self.ys[y],
+                                     self.xs[right], self.ys[bottom]))
+
+
+    def find_portals(self):
+        # neighboring cells of different regions are on a shared edge
+        pairs = set()
+        for a, b in ((self.cells[:-1], self.cells[1:]),
+                     (self.cells[:, :-1], self.cells[:, 1:])):
+            touching = (a != b) & (a >= 0) & (b >= 0)
+            pairs.update(zip(a[touching].tolist(), b[touching].tolist()))
+
+        for a, b in pairs:
+            left_a, top_a, right_a, bottom_a = self.regions[a]
+            left_b, top_b, right_b, bottom_b = self.regions[b]
+            if right_a == left_b or right_b == left_a:
+                x = right_a if right_a == left_b else left_a
+                start = (x, max(top_a, top_b))
+                end = (x, min(bottom_a, bottom_b))
+            else:
+                y = bottom_a if bottom_a == top_b else top_a
+                start = (max(left_a, left_b), y)
+                end = (min(right_a, right_b), y)
+            self.links[a].append((b, start, end))
+            self.links[b].append((a, start, end))
+
+
+    def region_at(self, pos):
+        """returns the region that contains the position or the closest
+        one (e.g. if the position is in a wall), None if there are no
+        regions"""
+        x = bisect_right(self.xs, pos[0]) - 1
+        y = bisect_right(self.ys, pos[1]) - 1
+        if 0 <= x < self.cells.shape[0] and 0 <= y < self.cells.shape[1]:
+            region = int(self.cells[x, y])
+            if region >= 0:
+                return region
+        if not self.regions:
+            return None
+        return min(range(len(self.regions)),
+                   key=lambda i: self.distance_to_region(pos, i))
+
+
+    def distance_to_region(self, pos, region):
+        left, top, right, bottom = self.regions[region]
+        dx = max(left - pos[0], 0, pos[0] - right)
+        dy = max(top - pos[1], 0, pos[1] - bottom)
+        return dx * dx + dy * dy
+
+
+    def clamp(self, pos, region):
+        """moves the position into the region"""
+        left, top, right, bottom = self.regions[region]
+        return (min(max(pos[0], left), right),
+                min(max(pos[1], top), bottom))
+
+
+    def find_path(self, start, end):
+        """returns the corner points of the shortest path from start to end
+        (both included, moved into the mesh), the number of expanded
+        regions and the peak size of the open list.
+        The points are an empty list if end can't be reached"""
+        start_region = self.region_at(start)
+        end_region = self.region_at(end)
+        if start_region is None or end_region is None:
+            return [], 0, 0
+        start = self.clamp(start, start_region)
+        end = self.clamp(end, end_region)
+
+        # A* over the regions, a region is entered at the middle of the
+        # portal it was reached through
+        def distance(a, b):
+            return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+
+        entry = {start_region: start}
+        g_score = {start_region: 0}
+        came_from = {}
+        open_list = [(distance(start, end), start_region)]
+        closed = set()
+        expanded = 0
+        open_peak = 1
+        while open_list:
+            _, region = heapq.heappop(open_list)
+            if region == end_region:
+                break
+            if region in closed:
+                continue
+            closed.add(region)
+            expanded += 1
+            point = entry[region]
+            for neighbor, portal_start, portal_end in self.links[region]:
+                if neighbor in closed:
+                    continue
+                middle = ((portal_start[0] + portal_end[0]) / 2,
+                          (portal_start[1] + portal_end[1]) / 2)
+                score = g_score[region] + distance(point, middle)
+                if score < g_score.get(neighbor, float('inf')):
+                    g_score[neighbor] = score
+                    entry[neighbor] = middle
+                    came_from[neighbor] = (region, portal_start, portal_end)
+                    heapq.heappush(open_list,
+                                   (score + distance(middle, end), neighbor))
+            open_peak = max(open_peak, len(open_list))
+        else:
+            return [], expanded, open_peak
+
+        portals = []
+        region = end_region
+        while region != start_region:
+            previous, portal_start, portal_end = came_from[region]
+            portals.append(self.orient(previous, portal_start, portal_end))
+            region = previous
+        portals.reverse()
+        return string_pull(start, end, portals), expanded, open_peak
+
+
+    def orient(self, region, start, end):
+        """returns the portal's end points as (left, right), seen from
+        the region it is crossed from"""
+        left, top, right, bottom = self.regions[region]
+        center = ((left + right) / 2, (top + bottom) / 2)
+        if triarea2(center, start, end) > 0:
+            return start, end
+        return end, start
@@ -0,0 +1,107 @@
+import json
+from collections import deque, Counter
+
+
+# outcomes of a search
+FOUND = 'found'
+UNREACHABLE = 'unreachable'
+CAPPED = 'capped'  # a path was found but it is longer than max_path_length
+
+
+class Histogram:
+    """counts values in power of two buckets (0, 1, 2-3, 4-7, ...)"""
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def add(self, value):
+        self.buckets[int(value).bit_length()] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+    def rows(self):
+        """returns a list of (lower bound, upper bound, count)"""
+        return [(0 if b == 0 else 1 << (b - 1), (1 << b) - 1, n)
+                for b, n in sorted(self.buckets.items())]
+
+
+
+class PathfindingStats:
+    """collects data about every path search (nodes expanded, peak size of
+    the open set, time, path length and outcome) and aggregates it in
+    histograms. The most recent searches can be exported as Chrome trace
+    events (chrome://tracing or https://ui.perfetto.dev)"""
+    def __init__(self, max_events=10000):
+        self.histograms = {
+                'expanded': Histogram(),
+                'open_peak': Histogram(),
+                'time_us': Histogram(),
+                'path_length': Histogram()
+                }
+        self.outcomes = Counter()
+        # how often the NPC gave up on following the player
+        self.lost_count = 0
+        self.events = deque(maxlen=max_events)
+
+
+    def record(self, agent, start_ns, end_ns, expanded, open_peak,
+               path_length, outcome):
+        time_us = (end_ns - start_ns) / 1000
+        self.histograms['expanded'].add(expanded)
+        self.histograms['open_peak'].add(open_peak)
+        self.histograms['time_us'].add(time_us)
+        self.histograms['path_length'].add(path_length)
+        self.outcomes[outcome] += 1
+        self.events.append((agent, start_ns, end_ns, expanded, open_peak,
+                            path_length, outcome))
+
+
+    def record_lost(self):
+        self.lost_count += 1
+
+
+    @property
+    def searches(self):
+        return sum(self.outcomes.values())
+
+
+    def summary(self):
+        """returns a short text with the averages and outcomes"""
+        h = self.histograms
+        outcomes = ', '.join(f'{k}: {v}' for k, v in self.outcomes.items())
+        return (f'{self.searches} searches ({outcomes}), '
+                f'lost {self.lost_count} times, '
+                f'avg {h["expanded"].mean():.1f} nodes expanded '
+                f'(max {h["expanded"].max}), '
+                f'avg {h["time_us"].mean():.1f} us '
+                f'(max {h["time_us"].max:.1f}), '
+                f'avg path length {h["path_length"].mean():.1f}')
+
+
+    def export_trace(self, filename):
+        """writes the recorded searches as Chrome trace events"""
+        trace_events = []
+        for (agent, start_ns, end_ns, expanded, open_peak, path_length,
+             outcome) in self.events:
+            trace_events.append({
+                    'name': 'find_path',
+                    'cat': outcome,
+                    'ph': 'X',
+                    'ts': start_ns / 1000,
+                    'dur': (end_ns - start_ns) / 1000,
+                    'pid': 0,
+                    'tid': agent,
+                    'args': {'expanded': expanded, 'open_peak': open_peak,
+                             'path_length': path_length}
+                    })
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace_events}, f)
@@ -0,0 +1,151 @@
+import pygame as pg
+import csv
+import time
+from collections import deque
+
+import settings as st
+
+
+# phases of a frame in the order they are shown
+# (pathfinding and collision are measured inside of 'update')
+PHASES = ['events', 'input', 'update', 'pathfinding', 'collision', 'draw',
+          'present']
+
+
+class StartupTimer:
+    """measures the steps of the startup until the first frame is drawn
+    Usage:
+        timer = StartupTimer()
+        ...
+        timer.mark('graphics')  # time since the last mark
+        ...
+        timer.report()
+    Args:
+        start: time.perf_counter() at the start of the program, the time
+               until the timer is created is reported as 'imports'"""
+    def __init__(self, start=None):
+        self.start = time.perf_counter()
+        self.last = self.start
+        # (step, seconds)
+        self.steps = []
+        if start is not None:
+            self.steps.append(('imports', self.start - start))
+            self.start = start
+
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+
+    def total(self):
+        return self.last - self.start
+
+
+    def report(self):
+        steps = ', '.join(f'{step} {seconds * 1000:.1f}'
+                          for step, seconds in self.steps)
+        print(f'Startup: {self.total() * 1000:.1f} ms ({steps})')
+
+
+
+class FrameProfiler:
+    """measures how long each phase of a frame takes and keeps the last
+    frames in a rolling window. Shows the median and 99th percentile of
+    each phase in an overlay and can write every frame to a csv file
+    Usage:
+        start = time.perf_counter_ns()
+        ...
+        profiler.add('update', time.perf_counter_ns() - start)"""
+    def __init__(self, game, window=240):
+        self.game = game
+        self.samples = {phase: deque(maxlen=window) for phase in PHASES}
+        self.current = dict.fromkeys(PHASES, 0)
+        self.frame = 0
+        self.visible = False
+        # percentiles are recalculated every few frames
+        self.stats = {}
+        self.stats_interval = 15
+        self.csv_file = None
+        self.csv_writer = None
+        self.background = pg.Surface((118, 12 + 9 * len(PHASES)),
+                                     pg.SRCALPHA)
+        self.background.fill((0, 0, 0, 160))
+
+
+    def add(self, phase, nanoseconds):
+        self.current[phase] += nanoseconds
+
+
+    def end_frame(self):
+        """stores the timings of this frame and starts a new one"""
+        for phase, value in self.current.items():
+            self.samples[phase].append(value)
+            self.current[phase] = 0
+        if self.csv_writer:
+            self.csv_writer.writerow(
+                    [self.frame] + [self.samples[p][-1] for p in PHASES])
+        self.frame += 1
+        if self.visible and self.frame % self.stats_interval == 0:
+            self.calculate_stats()
+
+
+    def percentile(self, phase, p):
+        values = sorted(self.samples[phase])
+        if not values:
+            return 0
+        index = min(len(values) - 1, int(len(values) * p / 100))
+        return values[index]
+
+
+    def calculate_stats(self):
+        """returns {phase: (p50, p99)} in milliseconds"""
+        self.stats = {phase: (self.percentile(phase, 50) / 1e6,
+                              self.percentile(phase, 99) / 1e6)
+                      for phase in PHASES}
+        return self.stats
+
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.calculate_stats()
+
+
+    def start_csv(self, filename):
+        """writes the timings of every following frame (in ns) to a csv
+        file"""
+        self.csv_file = open(filename, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(['frame'] + PHASES)
+
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+
+    def draw(self, screen):
+        renderer = self.game.text_renderer
+        font = renderer.get_font(self.game.asset_loader.fonts['slkscr'], 8)
+        white = pg.Color('White')
+        # phases that exceed the frame budget are shown in red
+        budget = 1000 / st.FPS
+
+        screen.blit(self.background, (0, 0))
+
+        rows = [('phase', 'p50', 'p99', white)]
+        for phase in PHASES:
+            p50, p99 = self.stats.get(phase, (0, 0))
+            color = pg.Color('Red') if p99 > budget else white
+            rows.append((phase, f'{p50:.2f}', f'{p99:.2f}', color))
+
+        for y, row in enumerate(rows):
+            screen.blit(renderer.render(row[0], font, row[3]), (2, 2 + y * 9))
+            # the numbers change with every refresh
+            for x, text in zip((66, 92), row[1:3]):
+                renderer.draw_glyphs(screen, text, font, row[3],
+                                     (x, 2 + y * 9))
@@ -0,0 +1,510 @@
+import math
+import os
+import zlib
+import struct
+import numpy as np
+
+import settings as st
+
+
+'''
+Potentially visible sets
+
+The map is split into square regions of PVS_REGION_SIZE pixels. For every
+pair of regions two bits are stored:
+    visible: some point of one region might see some point of the other
+    clear: every point of one region sees every point of the other
+A line of sight test between two positions is then a bit test. Only if
+the regions are visible but not clear ("maybe") the line has to be tested
+against the walls.
+Pairs of regions that are farther apart than PVS_DISTANCE are not tested
+and always "maybe".
+Building the sets takes a while, so they are saved next to the map file
+(see PVS.cached) and only built again when the walls change.
+A PVS has two bits for every pair of regions of the map, which is too much
+for a large streamed world. A LocalPVS only has the bits of the pairs
+within PVS_DISTANCE, stored per region, and only keeps the regions that
+are loaded.
+'''
+
+# corners and center of a region, relative to its size
+SAMPLES = ((0, 0), (1, 0), (0, 1), (1, 1), (0.5, 0.5))
+# magic, checksum, columns, rows, region size
+HEADER = struct.Struct('<4sIIII')
+MAGIC = b'PVS1'
+EPSILON = 1e-12
+# the lines for the visible bits may touch the walls, so that they aren't
+# blocked by walls next to the sample points
+SHRINK = (0.01, 0.01, -0.01, -0.01)
+
+
+def cache_file(filename):
+    """returns the path of the saved PVS of a map file"""
+    return os.path.splitext(filename)[0] + '.pvs'
+
+
+def checksum(size, walls, region_size, distance):
+    """identifies the input of PVS.build(), to find out if a saved PVS is
+    still valid"""
+    data = (int(size[0]), int(size[1]), [tuple(wall) for wall in walls],
+            region_size, distance)
+    return zlib.crc32(repr(data).encode())
+
+
+def segments_blocked(starts, ends, walls):
+    """returns a bool array that is True for the segments that touch a wall
+    Args:
+        starts, ends: arrays (n, 2) of the end points of the segments
+        walls: array (m, 4) of (left, top, right, bottom)"""
+    if len(walls) == 0:
+        return np.zeros(len(starts), dtype=bool)
+    starts = starts.astype(np.float32)
+    delta = ends.astype(np.float32) - starts
+    # a tiny delta instead of 0 gives +-inf for the parallel segments, which
+    # is the same as testing if the start is between the slab's sides
+    delta[delta == 0] = EPSILON
+    inverse = 1 / delta
+    walls = walls.astype(np.float32)
+    enter = leave = None
+    # clip the segments to the slab of the walls on each axis
+    for axis in (0, 1):
+        start = starts[:, axis, None]
+        scale = inverse[:, axis, None]
+        t1 = (walls[None, :, axis] - start) * scale
+        t2 = (walls[None, :, axis + 2] - start) * scale
+        low, high = np.minimum(t1, t2), np.maximum(t1, t2)
+        enter = low if enter is None else np.maximum(enter, low)
+        leave = high if leave is None else np.minimum(leave, high)
+    return ((enter <= leave) & (enter <= 1) & (leave >= 0)).any(axis=1)
+
+
+def convex_hull(points):
+    """monotone chain, returns the hull in counter clockwise order"""
+    points = sorted(set(points))
+    def half(points):
+        hull = []
+        for p in points:
+            while len(hull) >= 2 and (
+                    (hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1])
+                    - (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0])
+                    ) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull[:-1]
+    return half(points) + half(points[::-1])
+
+
+def hull_blocked(a, b, walls):
+    """returns True if a wall touches the convex hull of the rects a and b,
+    which is the area that all lines between them cover
+    Args:
+        a, b: (left, top, right, bottom)
+        walls: array (m, 4) of (left, top, right, bottom)"""
+    corners = [(x, y) for rect in (a, b) for x in (rect[0], rect[2])
+               for y in (rect[1], rect[3])]
+    hull = np.array(convex_hull(corners), dtype=float)
+    wall_corners = np.stack([walls[:, [0, 1]], walls[:, [2, 1]],
+                             walls[:, [0, 3]], walls[:, [2, 3]]], axis=1)
+    # separating axis test with the axes of the walls and the hull
+    edges = np.roll(hull, -1, axis=0) - hull
+    axes = np.concatenate([[(1, 0), (0, 1)], edges[:, ::-1] * (1, -1)])
+    touching = np.ones(len(walls), dtype=bool)
+    for axis in axes:
+        hull_projection = hull @ axis
+        projection = wall_corners @ axis
+        touching &= ((projection.min(axis=1) <= hull_projection.max()) &
+                     (projection.max(axis=1) >= hull_projection.min()))
+    return bool(touching.any())
+
+
+
+def hull_spans(hull, xs):
+    """returns the (top, bottom) of the convex polygon at each x"""
+    edges = [(min(x1, x2), max(x1, x2), x1, y1,
+              (y2 - y1) / (x2 - x1) if x1 != x2 else None, y2)
+             for (x1, y1), (x2, y2) in zip(hull, hull[1:] + hull[:1])]
+    spans = []
+    for x in xs:
+        ys = []
+        for low, high, x1, y1, slope, y2 in edges:
+            if low <= x <= high:
+                if slope is None:
+                    ys += [y1, y2]
+                else:
+                    ys.append(y1 + slope * (x - x1))
+        spans.append((min(ys), max(ys)))
+    return spans
+
+
+def sweep_slabs(a, b, walls):
+    """cuts the convex hull of the rects a and b into vertical slabs at the
+    edges of the rects and the walls. Every wall covers a slab completely
+    or not at all.
+    Returns a list of (left, right, free spans) with the (top, bottom) of
+    the parts of the slab that no wall covers"""
+    hull = convex_hull([(x, y) for rect in (a, b) for x in (rect[0], rect[2])
+                        for y in (rect[1], rect[3])])
+    left, right = min(a[0], b[0]), max(a[2], b[2])
+    xs = {a[0], a[2], b[0], b[2]}
+    xs.update(x for wall in walls for x in (wall[0], wall[2])
+              if left < x < right)
+    xs = sorted(xs)
+    sides = hull_spans(hull, xs)
+    slabs = []
+    for l, r, (top_l, bottom_l), (top_r, bottom_r) in zip(xs, xs[1:], sides,
+                                                          sides[1:]):
+        # the hull is convex, so its span in the slab is between the spans
+        # at the sides
+        top, bottom = min(top_l, top_r), max(bottom_l, bottom_r)
+        covered = sorted((wall[1], wall[3]) for wall in walls
+                         if wall[0] <= l and wall[2] >= r)
+        spans = []
+        y = top
+        for wall_top, wall_bottom in covered:
+            if wall_top >= bottom:
+                break
+            if wall_top > y:
+                spans.append((y, wall_top))
+            y = max(y, wall_bottom)
+        if y < bottom:
+            spans.append((y, bottom))
+        slabs.append((l, r, spans))
+    return slabs
+
+
+def sweep_reaches(slabs, a, b):
+    """returns True if a line could get from rect a to rect b through the
+    free spans of the slabs, in the order of the slabs"""
+    reached = []
+    for l, r, spans in slabs:
+        in_a = a[0] <= l and r <= a[2]
+        reached = [(top, bottom) for top, bottom in spans
+                   if (in_a and top <= a[3] and bottom >= a[1]) or
+                   any(top <= other_bottom and bottom >= other_top
+                       for other_top, other_bottom in reached)]
+        if (b[0] <= l and r <= b[2] and
+                any(top <= b[3] and bottom >= b[1]
+                    for top, bottom in reached)):
+            return True
+    return False
+
+
+def sweep_blocked(a, b, walls):
+    """returns True if every line between the rects a and b touches a wall.
+    Only True if that is certain, it may miss some blocked pairs.
+    A line moves in one direction along the x axis, so it goes from slab
+    to slab (see sweep_slabs) in one direction as well, and only where the
+    free spans of the neighboring slabs overlap. If no such way leads from
+    a to b in either direction, on the x or on the y axis, there is no
+    line. The spans are closed, so a line that only touches a wall isn't
+    blocked, unless it runs along a side of the hull. These lines are
+    sample lines of PVS.build() though
+    Args:
+        a, b: (left, top, right, bottom)
+        walls: array (m, 4) of (left, top, right, bottom)"""
+    walls = walls[(walls[:, 2] > min(a[0], b[0])) &
+                  (walls[:, 0] < max(a[2], b[2])) &
+                  (walls[:, 3] > min(a[1], b[1])) &
+                  (walls[:, 1] < max(a[3], b[3]))]
+    if len(walls) == 0:
+        return False
+
+    def mirror(rect):
+        # the y axis of the rects is the x axis of the mirrored rects
+        return rect[1], rect[0], rect[3], rect[2]
+
+    walls = walls.tolist()
+    for first, second, sides in ((a, b, walls),
+                                 (mirror(a), mirror(b),
+                                  [mirror(wall) for wall in walls])):
+        slabs = sweep_slabs(first, second, sides)
+        if not (sweep_reaches(slabs, first, second) or
+                sweep_reaches(slabs[::-1], first, second)):
+            return True
+    return False
+
+
+
+class PVS:
+    """visibility between the regions of a map, see above. Built with
+    PVS.build() or loaded with PVS.loads()
+    Args:
+        columns, rows: number of regions
+        region_size: size of a region in pixels
+        visible, clear: one bitset (int) per region, bit i is region i
+        checksum: see checksum()"""
+    def __init__(self, columns, rows, region_size, visible, clear,
+                 checksum=0):
+        self.columns = columns
+        self.rows = rows
+        self.region_size = region_size
+        self.visible = visible
+        self.clear = clear
+        self.checksum = checksum
+
+
+    @classmethod
+    def build(cls, size, walls, region_size=st.PVS_REGION_SIZE,
+              distance=st.PVS_DISTANCE):
+        """computes the sets for a map. A pair is only not visible if
+        sweep_blocked() is sure, the lines between the corners and the
+        centers of the regions are tested first because most visible pairs
+        have one that no wall blocks. The clear bits are exact
+        Args:
+            size: size of the map in pixels
+            walls: list of wall rects"""
+        columns = math.ceil(size[0] / region_size)
+        rows = math.ceil(size[1] / region_size)
+        pvs = cls.maybe(columns, rows, region_size, distance)
+        pvs.checksum = checksum(size, walls, region_size, distance)
+        rects, centers, samples = pvs.geometry(size)
+        wall_array = np.array([(w.left, w.top, w.right, w.bottom)
+                               for w in walls], dtype=float).reshape(-1, 4)
+        for a in range(columns * rows):
+            pvs.test_pairs(a, pvs.targets(a, centers, distance), rects,
+                           centers, samples, wall_array, distance)
+        return pvs
+
+
+    @classmethod
+    def maybe(cls, columns, rows, region_size, distance):
+        """returns sets where the lines of all pairs have to be tested"""
+        count = columns * rows
+        return cls(columns, rows, region_size, [(1 << count) - 1] * count,
+                   [0] * count)
+
+
+    def bit(self, a, b):
+        """returns the bit of region b in the sets of region a"""
+        return b
+
+
+    def set_pair(self, a, b, visible, clear):
+        for first, second in ((a, b), (b, a)):
+            bit = 1 << self.bit(first, second)
+            if visible:
+                self.visible[first] |= bit
+            else:
+                self.visible[first] &= ~bit
+            if clear:
+                self.clear[first] |= bit
+            else:
+                self.clear[first] &= ~bit
+
+
+    def geometry(self, size):
+        """returns the rects (left, top, right, bottom), the centers and
+        the sample points of the regions"""
+        rects = [(x * self.region_size, y * self.region_size,
+                  min((x + 1) * self.region_size, size[0]),
+                  min((y + 1) * self.region_size, size[1]))
+                 for y in range(self.rows) for x in range(self.columns)]
+        boxes = np.array(rects, dtype=float)
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        samples = np.array([[(r[0] + (r[2] - r[0]) * sx,
+                              r[1] + (r[3] - r[1]) * sy)
+                             for sx, sy in SAMPLES] for r in rects])
+        return rects, centers, samples
+
+
+    def targets(self, a, centers, distance):
+        """returns the regions that are tested with region a: every pair
+        is tested once, from the region with the lower index"""
+        offsets = centers[a + 1:] - centers[a]
+        targets = np.nonzero(np.hypot(offsets[:, 0], offsets[:, 1])
+                             <= distance)[0] + a + 1
+        # the region itself sees itself if it has no walls
+        return np.concatenate([[a], targets]).astype(int)
+
+
+    def test_pairs(self, a, targets, rects, centers, samples, walls,
+                   distance):
+        """sets the bits of the pairs of region a and the targets"""
+        # only the walls in reach
+        reach = distance + self.region_size * 2
+        near = walls[(walls[:, 2] >= centers[a, 0] - reach) &
+                     (walls[:, 0] <= centers[a, 0] + reach) &
+                     (walls[:, 3] >= centers[a, 1] - reach) &
+                     (walls[:, 1] <= centers[a, 1] + reach)]
+
+        n = len(SAMPLES)
+        starts = np.tile(np.repeat(samples[a], n, axis=0),
+                         (len(targets), 1))
+        ends = np.tile(samples[targets], (1, n, 1)).reshape(-1, 2)
+        blocked = segments_blocked(starts, ends, near + SHRINK).reshape(
+                len(targets), n * n)
+
+        for b, lines in zip(targets.tolist(), blocked):
+            # the sample lines can miss a gap, the sweep can't
+            if lines.all() and sweep_blocked(rects[a], rects[b], near):
+                self.set_pair(a, b, False, False)
+            else:
+                self.set_pair(a, b, True, not lines.any() and
+                              not hull_blocked(rects[a], rects[b], near))
+
+
+    def update(self, size, walls, rect, distance=st.PVS_DISTANCE):
+        """tests the pairs of regions again that have lines across the
+        rect, e.g. after a wall was added or removed there
+        Args:
+            size: size of the map in pixels
+            walls: list of wall rects after the change
+            rect: the changed area"""
+        rects, centers, samples = self.geometry(size)
+        wall_array = np.array([(w.left, w.top, w.right, w.bottom)
+                               for w in walls], dtype=float).reshape(-1, 4)
+        # the lines between two regions (squares of the same size) are
+        # inside the line between their centers grown by half a region
+        half = self.region_size / 2
+        grown = np.array([[rect[0] - half, rect[1] - half,
+                           rect[0] + rect[2] + half,
+                           rect[1] + rect[3] + half]])
+        for a in range(self.columns * self.rows):
+            targets = self.targets(a, centers, distance)
+            crossing = segments_blocked(
+                    np.repeat(centers[a, None], len(targets), axis=0),
+                    centers[targets], grown)
+            if crossing.any():
+                self.test_pairs(a, targets[crossing], rects, centers,
+                                samples, wall_array, distance)
+        self.checksum = checksum(size, walls, self.region_size, distance)
+
+
+    @classmethod
+    def cached(cls, path, size, walls):
+        """loads the PVS from the file if it was built from the same walls,
+        otherwise builds it and saves it to the file"""
+        key = checksum(size, walls, st.PVS_REGION_SIZE, st.PVS_DISTANCE)
+        try:
+            with open(path, 'rb') as f:
+                pvs = cls.loads(f.read())
+            if pvs.checksum == key:
+                return pvs
+        except (OSError, ValueError, struct.error, zlib.error):
+            pass
+        pvs = cls.build(size, walls)
+        try:
+            with open(path, 'wb') as f:
+                f.write(pvs.dumps())
+        except OSError:
+            # e.g. a read only data folder, it is built again next time
+            pass
+        return pvs
+
+
+    def region(self, pos):
+        """returns the index of the region at the position, None if it is
+        outside of the map. The index of the region in column x and row y
+        is y * columns + x"""
+        x = int(pos[0] // self.region_size)
+        y = int(pos[1] // self.region_size)
+        if 0 <= x < self.columns and 0 <= y < self.rows:
+            return y * self.columns + x
+        return None
+
+
+    def test(self, start, end):
+        """returns True if the line between the positions is free, False if
+        it is blocked and None if it has to be tested against the walls"""
+        a = self.region(start)
+        b = self.region(end)
+        if a is None or b is None:
+            return None
+        if not self.visible[a] >> b & 1:
+            return False
+        if self.clear[a] >> b & 1:
+            return True
+        return None
+
+
+    def dumps(self):
+        """returns the sets as compressed bytes"""
+        count = self.columns * self.rows
+        length = (count + 7) // 8
+        data = b''.join(bits.to_bytes(length, 'little')
+                        for bits in self.visible + self.clear)
+        return HEADER.pack(MAGIC, self.checksum, self.columns, self.rows,
+                           self.region_size) + zlib.compress(data)
+
+
+    @classmethod
+    def loads(cls, data):
+        magic, key, columns, rows, region_size = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a PVS file')
+        count = columns * rows
+        length = (count + 7) // 8
+        data = zlib.decompress(data[HEADER.size:])
+        sets = [int.from_bytes(data[i * length:(i + 1) * length], 'little')
+                for i in range(count * 2)]
+        return cls(columns, rows, region_size, sets[:count], sets[count:],
+                   key)
+
+
+    def memory_size(self):
+        count = self.columns * self.rows
+        return 2 * count * ((count + 7) // 8)
+
+
+
+class LocalPVS(PVS):
+    """a PVS that only has the pairs of regions within a distance of reach
+    columns and rows. The sets of a region are bitsets of the offsets to
+    the other region (see bit()) and are only kept for the regions that
+    were added. All other pairs are "maybe"
+    Args:
+        reach: PVS_DISTANCE in regions
+        visible, clear: {region index: bitset}"""
+    def __init__(self, columns, rows, region_size, reach, visible=None,
+                 clear=None, checksum=0):
+        super().__init__(columns, rows, region_size, visible or {},
+                         clear or {}, checksum)
+        self.reach = reach
+        self.width = reach * 2 + 1
+
+
+    @classmethod
+    def maybe(cls, columns, rows, region_size, distance):
+        pvs = cls(columns, rows, region_size, int(distance // region_size))
+        for a in range(columns * rows):
+            pvs.add(a, (1 << pvs.width ** 2) - 1, 0)
+        return pvs
+
+
+    def bit(self, a, b):
+        """returns the bit of region b in the sets of region a, None if b
+        is out of reach"""
+        dx = b % self.columns - a % self.columns + self.reach
+        dy = b // self.columns - a // self.columns + self.reach
+        if 0 <= dx < self.width and 0 <= dy < self.width:
+            return dy * self.width + dx
+        return None
+
+
+    def add(self, a, visible, clear):
+        self.visible[a] = visible
+        self.clear[a] = clear
+
+
+    def remove(self, a):
+        self.visible.pop(a, None)
+        self.clear.pop(a, None)
+
+
+    def test(self, start, end):
+        a = self.region(start)
+        b = self.region(end)
+        if a is None or b is None or a not in self.visible:
+            return None
+        bit = self.bit(a, b)
+        if bit is None:
+            return None
+        if not self.visible[a] >> bit & 1:
+            return False
+        if self.clear[a] >> bit & 1:
+            return True
+        return None
+
+
+    def memory_size(self):
+        return 2 * len(self.visible) * ((self.width ** 2 + 7) // 8)
@@ -0,0 +1,192 @@
+import pygame as pg
+import gzip
+import json
+
+
+'''
+Input recording and replay
+
+A recording is a gzipped file with one JSON object per line. The first
+line is a header, every following line describes the input of a tick that
+differs from the tick before:
+    s: number of unchanged ticks that are skipped before this tick
+    k: pressed keys as a bitmask (index into header['keys']), XOR'd with
+       the previous tick's mask
+    e: key events of this tick as [1 (down) or 0 (up), key]
+    p: gamepad state [inputs, inputs_down, inputs_up] if it changed
+    dt: time step if it changed
+    w: walls that were added or removed since the tick before, as
+       [1 (added) or 0 (removed), x, y, width, height], see dynamicwalls.py.
+       They are changed again at the start of this tick
+'''
+
+VERSION = 1
+
+# keys that are stored in the recording
+RECORDED_KEYS = [pg.K_w, pg.K_a, pg.K_s, pg.K_d, pg.K_F1, pg.K_F12,
+                 pg.K_RIGHT, pg.K_DOWN, pg.K_LEFT, pg.K_UP, pg.K_b,
+                 pg.K_x, pg.K_y, pg.K_l, pg.K_r, pg.K_RETURN, pg.K_BACKSPACE]
+RECORDED_KEYS = sorted(set(RECORDED_KEYS))
+
+
+class KeyState:
+    """replacement for pygame.key.get_pressed() that can be indexed
+    with the key constants"""
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+
+
+    def __getitem__(self, key):
+        return 1 if key in self.pressed else 0
+
+
+
+class InputRecorder:
+    """writes the combined key and gamepad state of every tick to a file
+    Args:
+        filename: path of the recording
+        game: Game instance, the current state name is stored in the
+              header so that the replay can start from the same state"""
+    def __init__(self, filename, game):
+        self.file = gzip.open(filename, 'wt')
+        self.keys = RECORDED_KEYS
+        header = {'version': VERSION, 'state': game.state_name,
+                  'dt': game.tick_dt, 'keys': self.keys}
+        self.file.write(json.dumps(header) + '\n')
+
+        self.prev_mask = 0
+        self.prev_pad = [[], [], []]
+        self.prev_dt = game.tick_dt
+        self.skipped = 0
+        self.ticks = 0
+        # wall changes since the last tick
+        self.walls = []
+
+
+    def record_wall(self, rect, added):
+        """stores a wall change, it is written with the next tick"""
+        self.walls.append([1 if added else 0, *rect])
+
+
+    def record(self, game, dt):
+        """stores the input the game uses in this tick. Has to be called
+        before game.events_list is cleared"""
+        mask = 0
+        for i, key in enumerate(self.keys):
+            if game.key_state[key]:
+                mask |= 1 << i
+
+        pad = game.gamepad_controller
+        pad_state = [pad.inputs, pad.inputs_down, pad.inputs_up]
+
+        events = []
+        for event in game.events_list:
+            if event.type == pg.KEYDOWN:
+                events.append([1, event.key])
+            elif event.type == pg.KEYUP:
+                events.append([0, event.key])
+
+        entry = {}
+        if mask != self.prev_mask:
+            entry['k'] = mask ^ self.prev_mask
+        if events:
+            entry['e'] = events
+        if pad_state != self.prev_pad:
+            entry['p'] = pad_state
+        if dt != self.prev_dt:
+            entry['dt'] = dt
+        if self.walls:
+            entry['w'] = self.walls
+            self.walls = []
+
+        self.ticks += 1
+        if entry:
+            entry['s'] = self.skipped
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.skipped = 0
+        else:
+            self.skipped += 1
+
+        self.prev_mask = mask
+        self.prev_pad = [[list(p) for p in inputs] for inputs in pad_state]
+        self.prev_dt = dt
+
+
+    def close(self):
+        # store the unchanged ticks at the end
+        if self.skipped:
+            self.file.write(json.dumps({'s': self.skipped - 1}) + '\n')
+        self.file.close()
+
+
+
+class InputReplay:
+    """feeds a recording back into the game tick by tick, through the same
+    attributes the live input uses (game.key_state, the gamepad controller
+    and the event handling)"""
+    def __init__(self, filename):
+        with gzip.open(filename, 'rt') as f:
+            self.header = json.loads(f.readline())
+            self.entries = [json.loads(line) for line in f]
+        if self.header['version'] != VERSION:
+            raise ValueError(f'Unsupported recording version '
+                             f'{self.header["version"]}')
+
+        self.keys = self.header['keys']
+        self.state = self.header['state']
+        self.dt = self.header['dt']
+        self.ticks = sum(entry['s'] + 1 for entry in self.entries)
+
+        self.entry_index = 0
+        self.skip = self.entries[0]['s'] if self.entries else 0
+        self.mask = 0
+        self.pad_state = [[], [], []]
+        self.done = not self.entries
+
+
+    def next_tick(self):
+        """returns the key state, key events, the gamepad state and the
+        wall changes of the next tick"""
+        events = []
+        walls = []
+        if self.done:
+            pass
+        elif self.skip > 0:
+            self.skip -= 1
+        else:
+            entry = self.entries[self.entry_index]
+            self.mask ^= entry.get('k', 0)
+            self.pad_state = entry.get('p', self.pad_state)
+            self.dt = entry.get('dt', self.dt)
+            walls = entry.get('w', walls)
+            for down, key in entry.get('e', []):
+                event_type = pg.KEYDOWN if down else pg.KEYUP
+                events.append(pg.event.Event(event_type, key=key, mod=0,
+                                             unicode='', scancode=0))
+            self.entry_index += 1
+            if self.entry_index < len(self.entries):
+                self.skip = self.entries[self.entry_index]['s']
+            else:
+                self.done = True
+
+        pressed = [key for i, key in enumerate(self.keys)
+                   if self.mask & (1 << i)]
+        return KeyState(pressed), events, self.pad_state, walls
+
+
+    def apply(self, game):
+        """sets the game's input for the next tick"""
+        key_state, events, pad_state, walls = self.next_tick()
+        for added, *rect in walls:
+            if added:
+                game.dynamic_walls.add(rect)
+            else:
+                wall = game.dynamic_walls.find(rect)
+                # already gone if the recording is from an older version
+                if wall is not None:
+                    game.dynamic_walls.remove(wall)
+        game.key_state = key_state
+        game.gamepad_controller.set_inputs(*pad_state)
+        for event in events:
+            game.handle_event(event)
+        game.events_list.extend(events)
@@ -1,15 +1,84 @@
+import time
+# taken before the other imports, for the startup report
+START_TIME = time.perf_counter()
+
 import pygame as pg
 import traceback
 import datetime
+import argparse
 from os import path
 
 import game
+import controls
+import replay
+import streaming
+import settings as st
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', type=int, metavar='TICKS',
+                        help='simulate TICKS ticks without a window as '
+                        'fast as possible and print the ticks per second')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the headless player controller')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the input of this session to FILE')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay a recorded session without a window')
+    parser.add_argument('--profile-csv', metavar='FILE',
+                        help='write the timings of every frame to FILE')
+    parser.add_argument('--path-trace', metavar='FILE',
+                        help='write the path searches as Chrome trace '
+                        'events to FILE when the game ends')
+    parser.add_argument('--split-map', nargs=2, metavar=('TMX', 'DIR'),
+                        help='split the map TMX into regions for streaming '
+                        'and write them to DIR')
+    parser.add_argument('--world', metavar='DIR',
+                        help='play the streamed world in DIR (see '
+                        '--split-map)')
+    parser.add_argument('--pathfinder',
+                        choices=('grid', 'navmesh', 'cooperative'),
+                        default=st.PATHFINDER,
+                        help='search the NPC paths over the grid cells, the '
+                        'navigation mesh or cooperatively over the grid '
+                        'cells and time')
+    args = parser.parse_args()
+    st.PATHFINDER = args.pathfinder
+
     try:
-        g = game.Game()
-        g.run()
+        if args.split_map:
+            streaming.split_map(*args.split_map)
+            parser.exit()
+        if args.replay:
+            input_replay = replay.InputReplay(args.replay)
+            g = game.Game(headless=True, start_state=input_replay.state,
+                          start_time=START_TIME)
+            g.input_replay = input_replay
+            ticks = input_replay.ticks
+        elif args.headless is not None:
+            g = game.Game(headless=True,
+                          player_controller=controls.RandomWalkController(
+                                  args.seed),
+                          start_time=START_TIME)
+            ticks = args.headless
+        else:
+            g = game.Game(start_time=START_TIME)
+            if args.record:
+                g.input_recorder = replay.InputRecorder(args.record, g)
+        if args.world:
+            g.world_dir = args.world
+        if args.profile_csv:
+            g.profiler.start_csv(args.profile_csv)
+
+        if g.headless:
+            g.run_headless(ticks)
+            pg.quit()
+        else:
+            g.run()
+
+        if args.path_trace:
+            g.path_stats.export_trace(args.path_trace)
     except Exception:
         e = traceback.format_exc()
         print(e)
@@ -17,12 +17,91 @@ WINDOW_W = GAME_SCREEN_W * WINDOW_SCALE
 WINDOW_H = GAME_SCREEN_H * WINDOW_SCALE
 # Frames per second
 FPS = 60
+# simulation steps per second (independent of the drawing frame rate)
+TICK_RATE = 60
+# maximum number of simulation steps to catch up on in one frame
+MAX_TICKS_PER_FRAME = 5
+# maximum number of rendered text surfaces kept in the text cache
+TEXT_CACHE_SIZE = 256
 
 # MUSIC
 # global volumes
 MUSIC_VOLUME = 0.5
 SFX_VOLUME = 0.6
+# relative volume of the music files (name without extension), default 1
+MUSIC = {}
+# sound effects (name without extension): (relative volume, max number of
+# voices at the same time, priority). A sound can take the channel of a
+# sound with a lower or the same priority if all channels are busy
+SFX = {}
+SFX_DEFAULT = (1.0, 4, 0)
+# number of channels that are reserved for the sound effects
+SFX_CHANNELS = 16
 
 # pathfinding 
 CELL_SIZE = 8
 CELL_OFFSET = (CELL_SIZE // 2, CELL_SIZE // 2)
+# distances to walls are measured up to this many pixels (see clearance.py),
+# it has to be at least the radius of the largest hitbox
+MAX_CLEARANCE = 16
+# line of sight (see pvs.py)
+# size of the regions of the visibility sets in pixels
+PVS_REGION_SIZE = 32
+# regions that are farther apart are not tested when the sets are built
+PVS_DISTANCE = GAME_SCREEN_W
+# 'grid' searches the NPC paths with A* over the grid cells, 'navmesh' over
+# the rectangles of the navigation mesh (see navmesh.py), 'cooperative' over
+# the grid cells and time around the paths of the other NPCs
+PATHFINDER = 'grid'
+
+# cooperative pathfinding (PATHFINDER = 'cooperative', see cooperative.py)
+# ticks per time step, about the time an NPC needs to walk one cell
+COOP_STEP_TICKS = 12
+# number of time steps that are planned ahead
+COOP_WINDOW = 8
+# time steps until an NPC plans again, less than the window
+COOP_REPLAN_STEPS = 4
+# max number of NPCs that plan in one tick
+COOP_PLANS_PER_TICK = 2
+# number of distance fields (one per goal and hitbox size) that are kept
+COOP_HEURISTIC_CACHE = 8
+# the distance field of a goal is used for goals up to this many cells away
+COOP_HEURISTIC_REUSE = 6
+# iterations per tick while a distance field is built, a field needs about
+# one per cell of its longest path
+COOP_FIELD_ITERATIONS = 8
+
+# crowd steering of NPCs
+# size of the grid cells for neighbor queries
+SPATIAL_CELL_SIZE = 32
+# NPCs closer than this push each other away
+SEPARATION_RADIUS = 12
+# NPCs within this distance are pulled towards each other
+COHESION_RADIUS = 32
+SEPARATION_WEIGHT = 1.0
+COHESION_WEIGHT = 0.2
+
+# AI level of detail
+# (max distance to the player or camera center in pixels, update interval
+# in ticks). Sprites in tiers other than the first use a coarser line of
+# sight check and don't animate
+AI_LOD_TIERS = [(GAME_SCREEN_W * 0.75, 1),
+                (GAME_SCREEN_W * 2, 4),
+                (float('inf'), 15)]
+
+# in-memory snapshots for rewinding (hold SELECT) and quick-loading
+# ticks between two snapshots
+SNAPSHOT_INTERVAL = 10
+# number of snapshots that are kept (60 seconds)
+SNAPSHOT_CAPACITY = 360
+
+# max memory of the maps that are kept after leaving them, in bytes
+MAP_CACHE_BUDGET = 64 * 1024 * 1024
+
+# streamed worlds (see streaming.py)
+# width and height of a region in tiles
+REGION_TILES = 16
+# regions closer than this to the camera center or the NPC are loaded
+STREAM_LOAD_DISTANCE = GAME_SCREEN_W
+# loaded regions are unloaded when they are farther away than this
+STREAM_UNLOAD_DISTANCE = GAME_SCREEN_W * 1.5
@@ -0,0 +1,168 @@
+import pygame as pg
+import struct
+import threading
+import queue
+import traceback
+import os
+
+
+'''
+Binary snapshots of the sprites
+
+Layout (little endian):
+    header:  b'NPCS', version (H), number of sections (H)
+    walls:   number of added walls (I), their rects,
+             number of removed walls (I), their rects,
+             as x, y, width, height (4i), see DynamicWalls.state()
+    section: length of the class name (B), class name (utf-8),
+             length of the record format (B), record format (ascii),
+             number of records (I), records
+A section holds all sprites of one class. Each record is packed with
+struct from the class's persisted fields (see BaseSprite.persisted), so
+that e.g. positions and velocities are stored as raw doubles.
+'''
+
+MAGIC = b'NPCS'
+VERSION = 2
+HEADER = struct.Struct('<4sHH')
+COUNT = struct.Struct('<I')
+RECT = struct.Struct('<4i')
+
+
+def record_format(sprite_class):
+    return '<' + ''.join(sprite_class.persisted.values())
+
+
+def flatten(sprite):
+    """returns the persisted fields of a sprite as a flat list"""
+    values = []
+    for field, fmt in sprite.persisted.items():
+        value = getattr(sprite, field)
+        if fmt[0].isdigit():
+            values.extend(value)
+        else:
+            values.append(value)
+    return values
+
+
+def unflatten(sprite_class, values):
+    """returns {field: value} from the flat list of a record"""
+    fields = {}
+    i = 0
+    for field, fmt in sprite_class.persisted.items():
+        if fmt[0].isdigit():
+            n = int(fmt[:-1])
+            value = tuple(values[i:i + n])
+            if fmt[-1] == 'd':
+                value = pg.math.Vector2(value)
+            i += n
+        else:
+            value = values[i]
+            i += 1
+        fields[field] = value
+    return fields
+
+
+def dumps(sprites, walls=((), ())):
+    """packs the sprites and the changes of the walls (added, removed)
+    into a bytes object"""
+    by_class = {}
+    for sprite in sprites:
+        by_class.setdefault(type(sprite), []).append(sprite)
+
+    chunks = [HEADER.pack(MAGIC, VERSION, len(by_class))]
+    for rects in walls:
+        chunks.append(COUNT.pack(len(rects)))
+        chunks.extend(RECT.pack(*rect) for rect in rects)
+    for sprite_class, members in by_class.items():
+        name = sprite_class.__name__.encode()
+        fmt = record_format(sprite_class)
+        record = struct.Struct(fmt)
+        chunks.append(bytes([len(name)]) + name)
+        chunks.append(bytes([len(fmt)]) + fmt.encode())
+        chunks.append(COUNT.pack(len(members)))
+        chunks.extend(record.pack(*flatten(s)) for s in members)
+    return b''.join(chunks)
+
+
+def loads(data, classes):
+    """unpacks a snapshot
+    Args:
+        data: bytes from dumps()
+        classes: dict with the sprite classes by name
+    Returns a dict {class name: [{field: value}, ...]} and the changes of
+    the walls"""
+    magic, version, sections = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a snapshot file')
+    if version != VERSION:
+        raise ValueError(f'Unsupported snapshot version {version}')
+    offset = HEADER.size
+
+    walls = []
+    for _ in range(2):
+        count, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        end = offset + RECT.size * count
+        walls.append(tuple(RECT.iter_unpack(data[offset:end])))
+        offset = end
+
+    result = {}
+    for _ in range(sections):
+        length = data[offset]
+        name = data[offset + 1:offset + 1 + length].decode()
+        offset += 1 + length
+        length = data[offset]
+        fmt = data[offset + 1:offset + 1 + length].decode()
+        offset += 1 + length
+        count, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+
+        record = struct.Struct(fmt)
+        end = offset + record.size * count
+        sprite_class = classes.get(name)
+        if sprite_class is None or record_format(sprite_class) != fmt:
+            raise ValueError(f'Snapshot doesn\'t match the class "{name}"')
+        result[name] = [unflatten(sprite_class, values) for values in
+                        record.iter_unpack(data[offset:end])]
+        offset = end
+    return result, tuple(walls)
+
+
+
+class SnapshotWriter:
+    """writes snapshots to disk on a background thread, so that saving
+    never blocks the game loop. Files are written to a temporary file
+    first and then replaced, so a crash never leaves a broken save"""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+
+
+    def write(self, filename, data):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+        self.queue.put((filename, data))
+
+
+    def work(self):
+        while True:
+            filename, data = self.queue.get()
+            if filename is None:
+                return
+            try:
+                tmp = filename + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, filename)
+            except Exception:
+                traceback.print_exc()
+
+
+    def close(self):
+        """waits until all snapshots are written"""
+        if self.thread is not None:
+            self.queue.put((None, None))
+            self.thread.join()
+            self.thread = None
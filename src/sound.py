@@ -0,0 +1,129 @@
+import pygame as pg
+import os
+
+import settings as st
+
+
+SOUND_EXTENSIONS = ('.wav', '.ogg', '.mp3', '.flac')
+
+
+def sound_files(folder):
+    """returns {name without extension: path} of the sound files"""
+    files = {}
+    for f in sorted(os.listdir(folder)):
+        name, extension = os.path.splitext(f)
+        if extension.lower() in SOUND_EXTENSIONS:
+            files[name] = os.path.join(folder, f)
+    return files
+
+
+def load_effects(folder):
+    """decodes the sound effects in a folder with their volume from
+    settings.SFX already applied. The mixer has to be started, this doesn't
+    touch its channels and can run on a worker thread
+    Returns: {name: SoundEffect}"""
+    effects = {}
+    for name, path in sound_files(folder).items():
+        volume, max_voices, priority = st.SFX.get(name, st.SFX_DEFAULT)
+        sound = pg.mixer.Sound(path)
+        sound.set_volume(st.SFX_VOLUME * volume)
+        effects[name] = SoundEffect(sound, max_voices, priority)
+    return effects
+
+
+
+class SoundEffect:
+    __slots__ = ('sound', 'max_voices', 'priority')
+
+    def __init__(self, sound, max_voices, priority):
+        self.sound = sound
+        self.max_voices = max_voices
+        self.priority = priority
+
+
+
+class SoundBank:
+    """plays the sound effects decoded by load_effects() on a pool of
+    reserved channels.
+    A sound never plays more often at the same time than its max number of
+    voices, the oldest voice is restarted instead. If all channels are
+    busy, the oldest voice with the lowest priority is stopped, unless its
+    priority is higher than the new sound's.
+    Music is streamed from disk with pygame.mixer.music
+    Args:
+        sounds_folder: folder with the 'sfx' and 'bgm' folders
+        channels: number of channels in the pool
+        effects: {name: SoundEffect} that were already decoded, by default
+                 the ones in the 'sfx' folder are"""
+    def __init__(self, sounds_folder, channels=st.SFX_CHANNELS, effects=None):
+        if pg.mixer.get_num_channels() < channels:
+            pg.mixer.set_num_channels(channels)
+        # Sound.play() doesn't use the reserved channels
+        pg.mixer.set_reserved(channels)
+        self.channels = [pg.mixer.Channel(i) for i in range(channels)]
+        # (name, priority, order) of the voice on each channel or None
+        self.voices = [None] * channels
+        # increases with every voice, to find the oldest one
+        self.order = 0
+
+        if effects is None:
+            effects = load_effects(os.path.join(sounds_folder, 'sfx'))
+        self.effects = effects
+
+        # only the paths, the files are streamed
+        self.music = sound_files(os.path.join(sounds_folder, 'bgm'))
+        self.current_music = None
+
+
+    def play(self, name, priority=None):
+        """plays a sound effect and returns its channel, or None if all
+        channels are busy with sounds of a higher priority
+        Args:
+            name: file name without extension
+            priority: overwrites the priority from the settings"""
+        effect = self.effects[name]
+        if priority is None:
+            priority = effect.priority
+
+        free = None
+        same = []
+        for i, channel in enumerate(self.channels):
+            if self.voices[i] is None or not channel.get_busy():
+                self.voices[i] = None
+                if free is None:
+                    free = i
+            elif self.voices[i][0] == name:
+                same.append(i)
+
+        if len(same) >= effect.max_voices:
+            # restart the oldest voice of this sound
+            index = min(same, key=lambda i: self.voices[i][2])
+        elif free is not None:
+            index = free
+        else:
+            # steal the oldest voice with the lowest priority
+            index = min(range(len(self.channels)),
+                        key=lambda i: self.voices[i][1:])
+            if self.voices[index][1] > priority:
+                return None
+
+        channel = self.channels[index]
+        channel.play(effect.sound)
+        self.voices[index] = (name, priority, self.order)
+        self.order += 1
+        return channel
+
+
+    def play_music(self, name, loop=True):
+        """streams a music file. Does nothing if it is already playing"""
+        if name == self.current_music and pg.mixer.music.get_busy():
+            return
+        pg.mixer.music.load(self.music[name])
+        pg.mixer.music.set_volume(st.MUSIC_VOLUME * st.MUSIC.get(name, 1))
+        pg.mixer.music.play(-1 if loop else 0)
+        self.current_music = name
+
+
+    def stop_music(self):
+        pg.mixer.music.stop()
+        self.current_music = None
@@ -0,0 +1,52 @@
+import heapq
+import numpy as np
+
+
+class SpatialGrid:
+    """uniform grid over the positions of all moving sprites (the
+    Kinematics arrays) for neighbor queries. Rebuilt once per tick, which
+    is linear in the number of sprites. A query only looks at the cells
+    within the search radius"""
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.kinematics = None
+        # (cell x, cell y): list of kinematics indices
+        self.cells = {}
+
+
+    def rebuild(self, kinematics):
+        self.kinematics = kinematics
+        self.cells = {}
+        n = kinematics.count
+        cell_coords = np.floor(kinematics.pos[:n] / self.cell_size).astype(int)
+        for index, (x, y) in enumerate(cell_coords.tolist()):
+            self.cells.setdefault((x, y), []).append(index)
+
+
+    def query_radius(self, pos, radius, exclude=None):
+        """returns a list of (distance, index) of all sprites within radius
+        around pos, except the one with the index exclude"""
+        x, y = pos
+        size = self.cell_size
+        min_x, max_x = int((x - radius) // size), int((x + radius) // size)
+        min_y, max_y = int((y - radius) // size), int((y + radius) // size)
+        positions = self.kinematics.pos
+
+        found = []
+        for cx in range(min_x, max_x + 1):
+            for cy in range(min_y, max_y + 1):
+                for index in self.cells.get((cx, cy), ()):
+                    if index == exclude:
+                        continue
+                    dx = positions[index, 0] - x
+                    dy = positions[index, 1] - y
+                    distance = (dx * dx + dy * dy) ** 0.5
+                    if distance <= radius:
+                        found.append((distance, index))
+        return found
+
+
+    def k_nearest(self, pos, k, radius, exclude=None):
+        """returns the k nearest sprites within radius as (distance, index)
+        sorted by distance"""
+        return heapq.nsmallest(k, self.query_radius(pos, radius, exclude))
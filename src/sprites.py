@@ -1,15 +1,23 @@
 import pygame as pg
 import pygame.freetype
 from collections import deque
+import math
+import time
+import numpy as np
 
 from astar import StepPathing, Vector
 import settings as st
 import utilities as utils
+import pathstats
+import clearance
 
 
 vec = Vector
 
 
+# spreads angles evenly, see NPC.crowd_steering
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
 RIGHT = 0
 DOWN = 1
 LEFT = 2
@@ -17,6 +25,16 @@ UP = 3
 
 
 class BaseSprite(pg.sprite.Sprite):
+    # fields that are read from the Tiled object (or kwargs) and their types
+    schema = {'id': int, 'name': str, 'x': float, 'y': float,
+              'width': float, 'height': float}
+    # fields that are written by Game.save and their struct format
+    # (see snapshot.py)
+    persisted = {'id': 'i', 'x': 'd', 'y': 'd'}
+    # fields that are stored in the in-memory snapshots (see history.py)
+    rewind_fields = ('prev_pos', 'anim_timer', 'anim_frame', 'image_state',
+                     'image', 'rect', 'hitbox')
+    
     def __init__(self, game, groups, **kwargs):
         """
         kwargs have to be at least:
@@ -28,17 +46,41 @@ class BaseSprite(pg.sprite.Sprite):
         self.game = game
         super().__init__(groups)
         
-        for key, value in kwargs.items():
-            setattr(self, key, value)
-        # set additional custom properties (from Tiled 'properties' dict)
-        if hasattr(self, 'properties'):
-            for key, value in self.properties.items():
-                setattr(self, key, value)
-        
+        self.id = 0
+        self.name = type(self).__name__
+        # Tiled fields and custom properties that aren't in the schema
+        self.extra = {}
+        properties = kwargs.pop('properties', {})
+        for key, value in list(kwargs.items()) + list(properties.items()):
+            field_type = self.schema.get(key)
+            if field_type is None:
+                self.extra[key] = value
+            elif value is not None:
+                setattr(self, key, field_type(value))
+        
+        self.draw_layer = None
         self.anim_timer = 0
         self.anim_frame = 0
         self.anim_delay = 0.2  # overwrite this in child class
+        
+        # position before the last simulation step, used for interpolation
+        self.prev_pos = None
+    
     
+    def store_previous(self):
+        if hasattr(self, 'pos'):
+            self.prev_pos = vec(self.pos)
+    
+    
+    def render_rect(self, alpha):
+        """returns the rect at the position between the previous and the
+        current simulation step
+        Args:
+            alpha: 0 (previous position) to 1 (current position)"""
+        if self.prev_pos is None:
+            return self.rect
+        offset = (self.prev_pos - self.pos) * (1 - alpha)
+        return self.rect.move(round(offset.x), round(offset.y))
     
     def animate(self, dt):
         # loop through all of self.images and set self.image to the next
@@ -56,26 +98,159 @@ class BaseSprite(pg.sprite.Sprite):
             self.rect.midbottom = self.hitbox.midbottom
     
     
+    def steer(self, dt):
+        """sets the acceleration before the kinematics step"""
+        pass
+    
+    
     def draw(self, screen, pos_or_rect):
         screen.blit(self.image, pos_or_rect)
         
                 
 
-class Player(BaseSprite):
+class KinematicSprite(BaseSprite):
+    """Base class for moving sprites. Position, velocity, acceleration,
+    speed and friction are stored in the game's Kinematics arrays, which
+    integrate all moving sprites in one step (see kinematics.py).
+    Child classes set self.acc in steer(), the game integrates and then
+    calls update(), which applies collisions and animation.
+    pos, vel and acc return copies as Vector2s, so changing them in place
+    (sprite.pos.x += 1) does nothing: assign the whole vector instead
+    (pos = sprite.pos, pos.x += 1, sprite.pos = pos). Every read creates
+    a new Vector2, code that runs for every sprite should read the arrays
+    with body_index directly (see apply_motion)"""
+    persisted = {**BaseSprite.persisted, 'pos': '2d', 'vel': '2d',
+                 'lastdir': 'B'}
+    rewind_fields = BaseSprite.rewind_fields + ('lastdir',)
+    
+    def __init__(self, game, groups, **kwargs):
+        self.body = game.kinematics
+        self.body_index = self.body.add(self, (kwargs['x'], kwargs['y']),
+                                        0, 0)
+        super().__init__(game, groups, **kwargs)
+        
+        # animation
+        self.lastdir = RIGHT
+    
+    
+    @property
+    def index(self):
+        """the index in the Kinematics arrays. A killed sprite has no
+        body anymore, the arrays would return all rows for None"""
+        if self.body_index is None:
+            raise ValueError(f'{self.name} {self.id} was killed and has no '
+                             f'body')
+        return self.body_index
+    
+    @property
+    def pos(self):
+        return vec(*self.body.pos[self.index])
+    
+    @pos.setter
+    def pos(self, value):
+        self.body.pos[self.index] = value
+    
+    @property
+    def vel(self):
+        return vec(*self.body.vel[self.index])
+    
+    @vel.setter
+    def vel(self, value):
+        self.body.vel[self.index] = value
+    
+    @property
+    def acc(self):
+        return vec(*self.body.acc[self.index])
+    
+    @acc.setter
+    def acc(self, value):
+        self.body.acc[self.index] = value
+    
+    @property
+    def speed(self):
+        return float(self.body.speed[self.index])
+    
+    @speed.setter
+    def speed(self, value):
+        self.body.speed[self.index] = value
+    
+    @property
+    def friction(self):
+        return float(self.body.friction[self.index])
+    
+    @friction.setter
+    def friction(self, value):
+        self.body.friction[self.index] = value
+    
+    
+    @property
+    def radius(self):
+        """half the width of the hitbox, for the clearance queries (see
+        clearance.py)"""
+        return self.hitbox.w / 2
+    
+    
+    def kill(self):
+        if self.body_index is not None:
+            self.body.remove(self.body_index)
+            self.body_index = None
+        super().kill()
+    
+    
+    def move_cutscene(self, dt):
+        # walk to the right, the title screen does the rest
+        self.acc = (1, 0)
+    
+    
+    def apply_motion(self, dt, collide=True, advance_animation=True):
+        """sets the animation state and the rects after the kinematics
+        step and resolves collisions with walls"""
+        i = self.body_index
+        if not self.body.moving[i]:
+            if self.lastdir == RIGHT:
+                self.image_state = 'idle_right'
+            else:
+                self.image_state = 'idle_left'
+        else:
+            if self.body.acc[i, 0] > 0:
+                self.image_state = 'run_right'
+                self.lastdir = RIGHT
+            elif self.body.acc[i, 0] < 0:
+                self.image_state = 'run_left'
+                self.lastdir = LEFT
+        
+        if collide:
+            start = time.perf_counter_ns()
+            # collision detection
+            # the center of the hitbox is always at the sprite's position
+            self.hitbox.centerx = self.body.pos[i, 0]
+            utils.collide_with_walls(self, self.game.walls, 'x')
+            self.hitbox.centery = self.body.pos[i, 1]
+            utils.collide_with_walls(self, self.game.walls, 'y')
+            self.game.profiler.add('collision',
+                                   time.perf_counter_ns() - start)
+        else:
+            self.hitbox.center = self.pos
+        # the rect(where the image is drawn)'s bottom is
+        # aligned with the hitbox's bottom
+        self.rect.midbottom = self.hitbox.midbottom
+        
+        if advance_animation:
+            self.animate(dt)
+
+
+
+class Player(KinematicSprite):
+    persisted = {**KinematicSprite.persisted, 'last_grid_pos': '2i'}
+    rewind_fields = KinematicSprite.rewind_fields + ('grid_pos',
+                                                     'last_grid_pos')
+    
     def __init__(self, game, kwargs):
         super().__init__(game, game.all_sprites, **kwargs)
         
         self.game.player = self
-        images = self.game.graphics['knight']
-        self.images = {
-                'hit': images[0:1],
-                'idle_right': images[1:5],
-                'idle_left': [pg.transform.flip(i, True, False)
-                              for i in images[1:5]],
-                'run_right': images[5:8],
-                'run_left': [pg.transform.flip(i, True, False)
-                             for i in images[5:8]]
-                }
+        # animation frames are shared between all instances
+        self.images = self.game.graphics['knight']
         
         #print(self.images)
         self.image_state = 'idle_right'
@@ -84,18 +259,14 @@ class Player(BaseSprite):
         self.rect = self.image.get_rect()
         self.hitbox = pg.Rect(0, 0, 12, 12)
         
-        self.pos = vec(self.x, self.y)
         self.hitbox.center = self.pos
         self.rect.midbottom = self.hitbox.midbottom
         
         # physics properties
-        self.acc = vec()
-        self.vel = vec()
         self.speed = 20
         self.friction = 0.8
         
         # animation
-        self.lastdir = RIGHT
         self.anim_delay = 0.15
         
         # A_star variables
@@ -103,116 +274,50 @@ class Player(BaseSprite):
                                           st.CELL_SIZE, 
                                           st.CELL_OFFSET)
         self.last_grid_pos = self.grid_pos
-        
     
-    def move_cutscene(self, dt):
-        self.acc *= 0
-        self.acc.x = 1
-        
-        if self.acc.length() > 1:
-            # prevent faster diagnoal movement
-            self.acc.scale_to_length(1)
-        # laws of motion
-        self.vel += self.acc * self.speed * dt
-        self.vel *= self.friction
-        
-        speed = self.vel.length()
-        
-        if speed < 0.05:
-            self.vel *= 0
-            if self.lastdir == RIGHT:
-                self.image_state = 'idle_right'
-            else:
-                self.image_state = 'idle_left'
+    
+    def steer(self, dt):
+        controller = self.game.player_controller
+        if controller:
+            # scripted or AI input (e.g. in headless mode)
+            self.acc = controller.get_move(self)
         else:
-            if self.acc.x > 0:
-                self.image_state = 'run_right'
-                self.lastdir = RIGHT
-            elif self.acc.x < 0:
-                self.image_state = 'run_left'
-                self.lastdir = LEFT
-        
-        self.pos += self.vel
-        
-        self.hitbox.center = self.pos
-        self.rect.midbottom = self.hitbox.midbottom
-        
-        self.animate(dt)
+            keys = self.game.key_state  # TODO use game key controller
+            self.acc = (keys[pg.K_d] - keys[pg.K_a],
+                        keys[pg.K_s] - keys[pg.K_w])
         
     
     def update(self, dt):
-        keys = pg.key.get_pressed()  # TODO use game key controller
-        
-        self.acc *= 0
-        self.acc.x = keys[pg.K_d] - keys[pg.K_a]
-        self.acc.y = keys[pg.K_s] - keys[pg.K_w]
-        
-        if self.acc.length() > 1:
-            # prevent faster diagnoal movement
-            self.acc.scale_to_length(1)
-        # laws of motion
-        self.vel += self.acc * self.speed * dt
-        self.vel *= self.friction
-        
-        speed = self.vel.length()
-        
-        if speed < 0.05:
-            self.vel *= 0
-            if self.lastdir == RIGHT:
-                self.image_state = 'idle_right'
-            else:
-                self.image_state = 'idle_left'
-        else:
-            if self.acc.x > 0:
-                self.image_state = 'run_right'
-                self.lastdir = RIGHT
-            elif self.acc.x < 0:
-                self.image_state = 'run_left'
-                self.lastdir = LEFT
-        
-        self.pos += self.vel
-        
-        # collision detection
-        # the center of the hitbox is always at the sprite's position
-        self.hitbox.centerx = self.pos.x
-        utils.collide_with_walls(self, self.game.walls, 'x')
-        self.hitbox.centery = self.pos.y
-        utils.collide_with_walls(self, self.game.walls, 'y')
-        # the rect(where the image is drawn)'s bottom is
-        # aligned with the hitbox's bottom
-        self.rect.midbottom = self.hitbox.midbottom
-        
-        self.animate(dt)
+        self.apply_motion(dt)
         
         # pathfinding stuff
         self.grid_pos = utils.pos_to_grid(self.pos, 
                                           st.CELL_SIZE, 
                                           st.CELL_OFFSET)
-        try:
-            maze_value = self.game.maze[self.grid_pos[0]][self.grid_pos[1]]
-        except IndexError:
-            maze_value = 1
-        # store grid pos if not on wall
-        if maze_value == -1:
+        # store grid pos if the NPC fits there
+        npc = getattr(self.game, 'npc', None)
+        radius = npc.radius if npc else self.radius
+        if clearance.passable(self.game.clearance, self.grid_pos, radius):
             self.last_grid_pos = self.grid_pos
         
         
-class NPC(BaseSprite):
+class NPC(KinematicSprite):
+    persisted = {**KinematicSprite.persisted, 'is_lost': '?',
+                 'counter': 'd'}
+    # path_points has to come before path_progress
+    rewind_fields = KinematicSprite.rewind_fields + (
+            'image_index', 'target', 'counter', 'path', 'is_lost',
+            'path_step', 'path_points', 'path_progress', 'path_length',
+            'line_to_target',
+            'lod_tier', 'ai_dt')
+    
     def __init__(self, game, kwargs):
         super().__init__(game, game.all_sprites, **kwargs)
         
         game.npc = self
         
-        images = self.game.graphics['elf']
-        self.images = {
-                'hit': images[0:1],
-                'idle_right': images[1:5],
-                'idle_left': [pg.transform.flip(i, True, False)
-                              for i in images[1:5]],
-                'run_right': images[5:8],
-                'run_left': [pg.transform.flip(i, True, False)
-                             for i in images[5:8]]
-                }
+        # animation frames are shared between all instances
+        self.images = self.game.graphics['elf']
 
         self.image_state = 'idle_right'
         self.image = self.images[self.image_state][0]
@@ -221,13 +326,10 @@ class NPC(BaseSprite):
         self.rect = self.image.get_rect()
         self.hitbox = pg.Rect(0, 0, 7, 7)
         
-        self.pos = vec(self.x, self.y)
         self.hitbox.center = self.pos
         self.rect.midbottom = self.hitbox.midbottom
         
         # physics properties
-        self.acc = vec()
-        self.vel = vec()
         self.speed = self.game.player.speed * 0.5
         self.friction = 0.8
         
@@ -239,73 +341,145 @@ class NPC(BaseSprite):
         self.path = []
         self.is_lost = False
         self.path_step = None
+        # positions of the current path, path_to_follow is a prefix of it
+        self.path_points = ()
         self.path_to_follow = None
+        # length of the path in cells, compared to max_path_length
+        self.path_length = 0
         self.line_to_target = None
         
         # animation
-        self.lastdir = RIGHT
         self.anim_delay = 0.15
-    
-    
-    def move_cutscene(self, dt):
-        self.acc *= 0
-        self.acc.x = 1
-        
-        if self.acc.length() > 1:
-            # prevent faster diagonal movement
-            self.acc.scale_to_length(1)
-        # laws of motion
-        self.vel += self.acc * self.speed * dt
-        self.vel *= self.friction
         
-        speed = self.vel.length()
-        
-        if speed < 0.05:
-            self.vel *= 0
-            if self.lastdir == RIGHT:
-                self.image_state = 'idle_right'
-            else:
-                self.image_state = 'idle_left'
-        else:
-            if self.acc.x > 0:
-                self.image_state = 'run_right'
-                self.lastdir = RIGHT
-            elif self.acc.x < 0:
-                self.image_state = 'run_left'
-                self.lastdir = LEFT
-        
-        self.pos += self.vel
-        
-        self.hitbox.center = self.pos
-        self.rect.midbottom = self.hitbox.midbottom
-        
-        self.animate(dt)
+        # level of detail, set by the AI scheduler (0 = full detail)
+        self.lod_tier = 0
+        # time since the last AI update
+        self.ai_dt = 0
         
     
+    def kill(self):
+        # the other NPCs don't have to plan around it anymore
+        self.game.path_planner.release(self)
+        super().kill()
+    
+    
     def find_path(self, target, dt):
         self.counter += dt
-        if self.counter >= self.pathfinding_interval:
+        if st.PATHFINDER == 'cooperative':
+            # the planner spreads the searches over the ticks
+            due = self.game.path_planner.wants_plan(self)
+        else:
+            due = self.counter >= self.pathfinding_interval
+        if due:
             self.counter = 0
-            # translate position to grid
-            start = utils.pos_to_grid(self.pos, st.CELL_SIZE, st.CELL_OFFSET)
-            # set target to last known player information
-            end = target.last_grid_pos
+            search_start = time.perf_counter_ns()
+            if st.PATHFINDER == 'navmesh':
+                found, expanded, open_peak = self.search_navmesh(target)
+            elif st.PATHFINDER == 'cooperative':
+                found, expanded, open_peak = self.search_cooperative(target)
+            else:
+                found, expanded, open_peak = self.search_grid(target)
+            self.path_to_follow = deque(self.path_points)
+            search_end = time.perf_counter_ns()
+            self.game.profiler.add('pathfinding', search_end - search_start)
             
-            grid_size = vec(len(self.game.maze), 
-                            len(self.game.maze[0]))
-            self.path_step = StepPathing(vec(start), 
-                                         vec(end),
-                                         self.game.maze, 
-                                         grid_size, 
-                                         '*', 
-                                         1)
-            self.path = self.path_step.get_path()[1:-1]
-            self.path_to_follow = deque([vec(utils.grid_to_pos(p, st.CELL_SIZE,
-                                         st.CELL_OFFSET)) for p in self.path])
+            if not found:
+                outcome = pathstats.UNREACHABLE
+            elif self.path_length >= self.max_path_length:
+                outcome = pathstats.CAPPED
+            else:
+                outcome = pathstats.FOUND
+            self.game.path_stats.record(self.id, search_start, search_end,
+                                        expanded, open_peak,
+                                        self.path_length, outcome)
+    
+    
+    def search_grid(self, target):
+        """searches the path with A* over the grid cells, the path has one
+        point per cell
+        Returns (path found, expanded nodes, peak size of the open list)"""
+        # translate position to grid
+        start = utils.pos_to_grid(self.pos, st.CELL_SIZE, st.CELL_OFFSET)
+        # set target to last known player information
+        end = target.last_grid_pos
+        
+        grid_size = vec(len(self.game.clearance), 
+                        len(self.game.clearance[0]))
+        # cells are blocked if the hitbox doesn't fit
+        self.path_step = StepPathing(vec(start), 
+                                     vec(end),
+                                     self.game.clearance, 
+                                     grid_size, 
+                                     '*', 
+                                     1,
+                                     self.radius)
+        full_path = self.path_step.get_path()
+        self.path = full_path[1:-1]
+        self.path_points = tuple(vec(utils.grid_to_pos(p, st.CELL_SIZE,
+                                 st.CELL_OFFSET)) for p in self.path)
+        self.path_length = len(self.path)
+        return (bool(full_path), self.path_step.expanded,
+                self.path_step.open_peak)
+    
+    
+    def search_navmesh(self, target):
+        """searches the path on the navigation mesh of the map (see
+        navmesh.py), the path only has the corners it goes around
+        Returns (path found, expanded regions, peak size of the open list)"""
+        end = utils.grid_to_pos(target.last_grid_pos, st.CELL_SIZE,
+                                st.CELL_OFFSET)
+        mesh = self.game.map.navmesh(self.hitbox.size)
+        points, expanded, open_peak = mesh.find_path(tuple(self.pos), end)
+        self.path_step = None
+        # like the grid path: from the end to the start, without the start
+        self.path_points = tuple(vec(p) for p in reversed(points[1:]))
+        self.path = [utils.pos_to_grid(p, st.CELL_SIZE, st.CELL_OFFSET)
+                     for p in self.path_points]
+        length = sum(vec(a).distance_to(b) for a, b in zip(points,
+                                                            points[1:]))
+        self.path_length = int(length // st.CELL_SIZE)
+        return bool(points), expanded, open_peak
+    
+    
+    def search_cooperative(self, target):
+        """plans the next time steps around the plans of the other NPCs
+        (see cooperative.py), the path has one point per time step
+        Returns (path found, expanded nodes, peak size of the open list)"""
+        start = utils.pos_to_grid(self.pos, st.CELL_SIZE, st.CELL_OFFSET)
+        cells, distance, expanded, open_peak = self.game.path_planner.plan(
+                self, start, tuple(target.last_grid_pos))
+        self.path_step = None
+        # like the grid path: from the end to the start, without the start
+        self.path = cells[:0:-1]
+        self.path_points = tuple(vec(utils.grid_to_pos(p, st.CELL_SIZE,
+                                 st.CELL_OFFSET)) for p in self.path)
+        self.path_length = int(distance)
+        return bool(cells), expanded, open_peak
+    
+    
+    @property
+    def path_progress(self):
+        """number of points of path_points that are left to follow. Points
+        are only removed from the end of path_to_follow, so this is enough
+        to restore it"""
+        if self.path_to_follow is None:
+            return None
+        return len(self.path_to_follow)
+    
+    @path_progress.setter
+    def path_progress(self, value):
+        if value is None:
+            self.path_to_follow = None
+        else:
+            self.path_to_follow = deque(self.path_points[:value])
     
     
     def follow_path(self):
-        if hasattr(self, 'path_to_follow') and len(self.path_to_follow) > 0:
+        step = self.game.path_planner.plan_step(self)
+        if step is not None:
+            self.follow_plan(step)
+            return
+        if self.path_to_follow:
             target = self.path_to_follow[-1]
             vec_to_target = target - self.pos
             if vec_to_target.length() > st.TILE_WIDTH:
@@ -317,15 +491,57 @@ class NPC(BaseSprite):
             self.acc = vec((0, 0))
     
     
-    def update(self, dt):
+    def follow_plan(self, step):
+        """follows a cooperative plan: the target is the point of the next
+        time step, so the NPC waits where the plan waits
+        Args:
+            step: time steps since the plan started"""
+        # drop the points of the steps that are over
+        while len(self.path_to_follow) > len(self.path_points) - step:
+            self.path_to_follow.pop()
+        if self.path_to_follow:
+            vec_to_target = self.path_to_follow[-1] - self.pos
+            if vec_to_target.length() > 1:
+                self.acc = vec_to_target.normalize()
+                return
+        self.acc = vec((0, 0))
+    
+    
+    def line_blocked_coarse(self, start, end):
+        """samples the maze along the line every CELL_SIZE pixels. Cheaper
+        than testing the line against every wall, but more pessimistic
+        since the maze cells around walls are blocked as well"""
+        maze = self.game.maze
+        distance = start.distance_to(end)
+        steps = int(distance // st.CELL_SIZE)
+        for i in range(1, steps):
+            point = start.lerp(end, i / steps)
+            x, y = utils.pos_to_grid(point, st.CELL_SIZE, st.CELL_OFFSET)
+            if 0 <= x < len(maze) and 0 <= y < len(maze[0]):
+                if maze[x][y] == 1:
+                    return True
+        return False
+    
+    
+    def steer(self, dt):
         # check if line between self and target intersects walls
         player = self.game.player
         self.line_to_target = utils.Line(self.pos, player.pos)
         intersects = False
-        for wall in self.game.walls:
-            hit, _ = self.line_to_target.intersects_rect(wall.hitbox)
-            if hit:
-                intersects = True
+        # most lines are answered by the PVS, the walls are only tested if
+        # the regions might see each other
+        visible = self.game.pvs.test(self.line_to_target.start,
+                                     self.line_to_target.end)
+        if visible is not None:
+            intersects = not visible
+        elif self.lod_tier > 0:
+            intersects = self.line_blocked_coarse(self.line_to_target.start,
+                                                  self.line_to_target.end)
+        else:
+            for wall in self.game.walls:
+                hit, _ = self.line_to_target.intersects_rect(wall.hitbox)
+                if hit:
+                    intersects = True
 
         if intersects:
             self.line_to_target.color = pg.Color('Red')
@@ -333,7 +549,9 @@ class NPC(BaseSprite):
                 self.find_path(player, dt)
                 self.follow_path()
             
-            if len(self.path) >= self.max_path_length:
+            if self.path_length >= self.max_path_length:
+                if not self.is_lost:
+                    self.game.path_stats.record_lost()
                 self.is_lost = True
                 self.path_to_follow.clear()
                 self.acc = vec((0, 0))
@@ -353,46 +571,68 @@ class NPC(BaseSprite):
             # reset pathfinding counter
             self.counter = self.pathfinding_interval
             self.path = []
+            self.path_length = 0
+            self.game.path_planner.release(self)
         
-        if self.acc.length() > 1:
-            self.acc.scale_to_length(1)
-        self.vel += self.acc * self.speed * dt
-        self.vel *= self.friction
-        
-        speed = self.vel.length()
-        
-        if speed < 0.05:
-            self.vel *= 0
-            if self.lastdir == RIGHT:
-                self.image_state = 'idle_right'
-            else:
-                self.image_state = 'idle_left'
-        else:
-            if self.acc.x > 0:
-                self.image_state = 'run_right'
-                self.lastdir = RIGHT
-            elif self.acc.x < 0:
-                self.image_state = 'run_left'
-                self.lastdir = LEFT
-                
-        self.pos += self.vel
-        
-        # collision detection
-        # the center of the hitbox is always at the sprite's position
-        self.hitbox.centerx = self.pos.x
-        utils.collide_with_walls(self, self.game.walls, 'x')
-        self.hitbox.centery = self.pos.y
-        utils.collide_with_walls(self, self.game.walls, 'y')
-        # the rect(where the image is drawn)'s bottom is aligned
-        # with the hitbox's bottom
-        self.rect.midbottom = self.hitbox.midbottom
-        
-        self.animate(dt)
+        # keep distance to other NPCs while staying close to the group
+        self.acc = self.acc + self.crowd_steering()
+    
+    
+    def crowd_steering(self):
+        """returns the sum of the separation and cohesion forces from the
+        NPCs around this one"""
+        i = self.body_index
+        neighbors = [index for _, index in
+                     self.game.spatial_grid.query_radius(
+                             self.body.pos[i], st.COHESION_RADIUS, i)
+                     if isinstance(self.body.sprites[index], NPC)]
+        if not neighbors:
+            return vec()
+        
+        offsets = self.body.pos[neighbors] - self.body.pos[i]
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        
+        # separation: push away from close neighbors, stronger if closer
+        close = distances < st.SEPARATION_RADIUS
+        separation = np.zeros(2)
+        if close.any():
+            close_offsets = offsets[close]
+            close_distances = distances[close]
+            # NPCs at the exact same position are pushed apart in a
+            # direction that is different for every pair (and opposite
+            # for the two NPCs of the pair)
+            stacked = close_distances == 0
+            if stacked.any():
+                angles = np.array(neighbors)[close][stacked] * GOLDEN_ANGLE
+                own = i * GOLDEN_ANGLE
+                directions = np.stack([np.cos(angles) - np.cos(own),
+                                       np.sin(angles) - np.sin(own)],
+                                      axis=1)
+                close_offsets[stacked] = directions / np.hypot(
+                        directions[:, 0], directions[:, 1])[:, None]
+                close_distances[stacked] = 1
+            separation = -(close_offsets
+                           / close_distances[:, None] ** 2).sum(axis=0)
+            separation *= st.SEPARATION_RADIUS
+        
+        # cohesion: pull towards the center of the neighbors
+        cohesion = offsets.mean(axis=0) / st.COHESION_RADIUS
+        
+        force = (separation * st.SEPARATION_WEIGHT
+                 + cohesion * st.COHESION_WEIGHT)
+        return vec(*force)
+    
+    
+    def update(self, dt):
+        # distant NPCs don't animate
+        self.apply_motion(dt, advance_animation=self.lod_tier == 0)
         
 
 
 class Wall(BaseSprite):
     """Invisible Wall object for collisions"""
+    persisted = {**BaseSprite.persisted, 'width': 'd', 'height': 'd'}
+    
     def __init__(self, game, kwargs):
         super().__init__(game, game.walls, **kwargs)
 
@@ -410,3 +650,6 @@ class Wall(BaseSprite):
             pg.draw.rect(screen, pg.Color('Red'), rect, 1)
 
 
+
+# sprites that can be placed on a map, by the object name used in Tiled
+SPRITES = {cls.__name__: cls for cls in (Player, NPC, Wall)}
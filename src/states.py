@@ -2,9 +2,12 @@ import pygame as pg
 from itertools import cycle
 
 import tilemaps
+import streaming
+import clearance
+from pvs import PVS, cache_file
 import sprites as spr
+import debug
 import utilities as utils
-import settings as st
 
 
 '''
@@ -15,6 +18,11 @@ https://python-forum.io/Thread-PyGame-Creating-a-state-machine
 
 class State(object):
     """Parent class for game states"""
+    # False for states that don't advance the game world and whose number
+    # of ticks can differ between runs (like loading). Their ticks are not
+    # part of input recordings
+    simulated = True
+    
     def __init__(self, game):
         self.game = game
         self.next = None  # what comes after if this is done
@@ -44,21 +52,101 @@ class GameStart(State):
     it initialises all persistent objects (like the player, inventory etc)
     """
 
+    def __init__(self, game):
+        State.__init__(self, game)
+        self.next = 'Loading'
+    
+    
+    def startup(self):
+        self.game.map_index = 0
+        
+        # just instantiates some stuff and then it's done
+        self.done = True
+
+
+
+class Loading(State):
+    """
+    Loads the map game.map_files[game.map_index] while the screen keeps
+    being updated. The map is parsed on a worker thread (see maploader.py),
+    then its layers are created one per tick. InGame also waits for the
+    sounds (see Loader.load_sounds)
+    """
+    simulated = False
+    
     def __init__(self, game):
         State.__init__(self, game)
         self.next = 'InGame'
+        self.filename = None
+        self.steps = None
+        self.timer = 0
+        self.text = None
     
     
     def startup(self):
-        self.game.map = tilemaps.Map(self.game, self.game.map_files[0])
-        self.game.map.create_map()
-        self.game.map.rect.topleft = (0, 0)
+        self.filename = self.game.map_files[self.game.map_index]
+        if self.game.map:
+            self.game.map.deactivate()
         
+        cached = self.game.map_cache.get(self.filename)
+        if self.game.world_dir:
+            self.game.map = streaming.StreamedMap(self.game,
+                                                  self.game.world_dir)
+            self.steps = self.game.map.create_steps()
+        elif cached:
+            # maps that were played before are ready immediately
+            self.game.map = cached
+            cached.activate()
+            self.steps = iter(())
+        else:
+            self.game.map_loader.request(self.filename)
+        font = self.game.fonts['default']
+        self.text = self.game.text_renderer.render('Loading', font,
+                                                   pg.Color('White'))
+    
+    
+    def update(self, dt):
+        self.timer += dt
+        loader = self.game.map_loader
+        if self.steps is None:
+            # without a window there is nothing to draw in the meantime
+            if not (loader.ready(self.filename) or self.game.headless):
+                return
+            self.game.map = loader.get(self.filename)
+            self.steps = self.game.map.create_steps()
+        
+        if self.game.headless:
+            for _ in self.steps:
+                pass
+        elif next(self.steps, False):
+            return
+        if not (self.game.asset_loader.sounds_ready() or self.game.headless):
+            return
+        
+        self.game.map.rect.topleft = (0, 0)
+        if not self.game.map.streamed:
+            self.game.map_cache.put(self.game.map)
         self.game.camera = utils.Camera(self.game, self.game.map.size.x, 
                                         self.game.map.size.y, 'FOLLOW')
         
-        # just instantiates some stuff and then it's done
+        # start loading the next map in the background
+        next_index = self.game.map_index + 1
+        if next_index < len(self.game.map_files) and not self.game.world_dir:
+            next_file = self.game.map_files[next_index]
+            if next_file not in self.game.map_cache:
+                loader.request(next_file)
         self.done = True
+    
+    
+    def draw(self):
+        self.game.screen.fill(pg.Color('Black'))
+        rect = self.text.get_rect(center=self.game.screen_rect.center)
+        self.game.screen.blit(self.text, rect)
+        # a dot moves below the text so that it's visible that the
+        # game doesn't hang
+        x = rect.left + (self.timer * 40) % rect.w
+        pg.draw.rect(self.game.screen, pg.Color('White'),
+                     (x, rect.bottom + 4, 2, 2))
 
 
 class InGame(State):
@@ -71,27 +159,33 @@ class InGame(State):
 
         self.camera_targets = []
         self.current_camera_target = None
+        self.debug_overlay = debug.DebugOverlay(game)
 
     
     def startup(self):
-        self.game.maze = []
-        for x in range(self.game.map.rect.w // st.CELL_SIZE):
-            self.game.maze.append([])
-            for y in range(self.game.map.rect.h // st.CELL_SIZE):
-                point = utils.grid_to_pos((x, y), st.CELL_SIZE, st.CELL_OFFSET)
-                intersects = False
-                for w in self.game.walls:
-                    rect = w.hitbox.inflate((st.CELL_SIZE, st.CELL_SIZE))
-                    if rect.collidepoint(point):
-                        intersects = True
-                self.game.maze[x].append(1 if intersects else -1)
+        game_map = self.game.map
+        walls = [w.hitbox for w in self.game.walls]
+        if game_map.maze is None:
+            game_map.maze = tilemaps.build_maze(game_map.size, walls)
+        if game_map.clearance is None:
+            game_map.clearance = clearance.build_clearance(game_map.size,
+                                                           walls)
+        if game_map.pvs is None:
+            game_map.pvs = PVS.cached(cache_file(game_map.filename),
+                                      game_map.size, walls)
+        self.game.maze = game_map.maze
+        self.game.clearance = game_map.clearance
+        self.game.pvs = game_map.pvs
         
         self.camera_targets = cycle([self.game.player, self.game.npc])
         self.current_camera_target = next(self.camera_targets)
+        self.game.history.clear()
+        self.game.path_planner.clear()
+        self.game.dynamic_walls.clear()
     
     
     def cleanup(self):
-        self.game.save('test.json')
+        self.game.save('test.sav')
     
     
     def get_event(self, event):
@@ -99,73 +193,60 @@ class InGame(State):
         if event.type == pg.KEYDOWN:
             if event.key == pg.K_F1:
                 self.current_camera_target = next(self.camera_targets)
+            elif event.key == pg.K_F5:
+                self.game.history.quick_save()
+            elif event.key == pg.K_F9:
+                self.game.history.quick_load()
+            elif (event.key in (pg.K_PAGEUP, pg.K_PAGEDOWN)
+                  and self.game.debug_mode):
+                # go to the previous/next map
+                step = 1 if event.key == pg.K_PAGEDOWN else -1
+                self.game.map_index = ((self.game.map_index + step)
+                                       % len(self.game.map_files))
+                self.next = 'Loading'
+                self.done = True
     
     
     def update(self, dt):
-        if not self.game.camera.is_sliding:
+        if self.game.keys_pressed['SELECT']:
+            # rewind one snapshot per tick while the button is held
+            self.game.history.rewind()
+        elif not self.game.camera.is_sliding:
+            for sprite in self.game.all_sprites:
+                sprite.store_previous()
+            self.game.spatial_grid.rebuild(self.game.kinematics)
+            self.game.path_planner.update()
+            # distant sprites are steered less often
+            self.game.ai_scheduler.steer(self.game.all_sprites, dt)
+            # move all sprites at once, then resolve collisions
+            self.game.kinematics.step(dt)
             self.game.all_sprites.update(dt)
+            # load and unload the regions of streamed maps
+            self.game.map.update()
+            self.game.history.update()
         self.game.camera.update(self.current_camera_target)
 
 
-    def path_to_map_positions(self, sprite):
-        """calculates where to draw the path points"""
-        f = lambda x: self.game.camera.apply_pos(x)
-        path_points = []
-        for p in sprite.path:
-            path_points.append(f(utils.grid_to_pos(p,
-                                                  st.CELL_SIZE,
-                                                  st.CELL_OFFSET)))
-        return path_points
-
-        
     def draw(self):
         self.game.screen.fill(pg.Color('black'))
+        alpha = self.game.alpha
+        self.game.camera.interpolate(alpha)
         
         # draw map layers
         for layer in range(self.game.map.max_layer + 1):
             # TODO: this is not optimal since it has to loop through all of the
-            # layers and sprites for each layer...
-            for i, tiles in self.game.map.layers.items():
-                if i == layer:
-                    self.game.screen.blit(tiles, 
-                                          self.game.camera.apply_bg(self.game.map.rect))
+            # sprites for each layer...
+            self.game.map.draw_layer(self.game.screen, self.game.camera,
+                                     layer)
             for sprite in self.game.all_sprites:
                 if sprite.draw_layer == layer:
                     sprite.draw(self.game.screen,
-                                self.game.camera.apply(sprite))
-                    
-                    if self.game.debug_mode:
-                        # if debug mode is active, draw the rects as well
-                        # as the path the npc is following
-                        if hasattr(sprite, 'hitbox'):
-                            pg.draw.rect(self.game.screen, pg.Color('Red'), 
-                                         self.game.camera.apply_rect(
-                                             sprite.hitbox), 1)
-                        if hasattr(sprite, 'line_to_target'):
-                            sprite.line_to_target.draw(self.game.screen,
-                                                       camera=self.game.camera)
-                        if hasattr(sprite, 'path'):
-                            if sprite.path:
-                                path_points = self.path_to_map_positions(
-                                    sprite)
-                                if len(path_points) > 1:
-                                    pg.draw.lines(self.game.screen,
-                                                  pg.Color('Blue'),
-                                                  False,
-                                                  path_points)
-
-        for wall in self.game.walls:
-            wall.draw(self.game.screen, self.game.camera.apply(wall))
+                                self.game.camera.apply_rect(
+                                    sprite.render_rect(alpha)))
 
         if self.game.debug_mode:
-            pg.draw.line(self.game.screen,
-                         pg.Color('white'),
-                         self.game.screen_rect.midleft,
-                         self.game.screen_rect.midright)
-            pg.draw.line(self.game.screen,
-                         pg.Color('white'),
-                         self.game.screen_rect.midtop,
-                         self.game.screen_rect.midbottom)
+            # hitboxes, line of sight and npc paths are drawn on top
+            self.debug_overlay.draw(self.game.screen, self.game.camera)
 
 
 
@@ -186,13 +267,14 @@ class TitleScreen(State):
                 ' ',
                 'Press any key to start'
                 ]
+        # parse the first map while the title screen is shown
+        self.game.map_loader.request(
+                self.game.map_files[self.game.map_index])
                     
         for y, s in enumerate(strings):
             font = self.game.fonts['default']
-            txt, txt_rect = font.render(s,
-                                        fgcolor=pg.Color('White'),
-                                        bgcolor=None)
-                                                    
+            txt = self.game.text_renderer.render(s, font, pg.Color('White'))
+            txt_rect = txt.get_rect()
             txt_rect.centerx = self.game.screen_rect.centerx
             txt_rect.centery = ((y + 1) * self.game.screen_rect.h
                                 / (len(strings) + 2))
@@ -221,6 +303,9 @@ class TitleScreen(State):
     def update(self, dt):
         self.game.player.move_cutscene(dt)
         self.npc.move_cutscene(dt)
+        self.game.kinematics.step(dt)
+        self.game.player.apply_motion(dt, collide=False)
+        self.npc.apply_motion(dt, collide=False)
               
         
     def draw(self):
@@ -231,9 +316,14 @@ class TitleScreen(State):
         player = self.game.player
         player.draw(self.game.screen, player.rect)
         if player.pos.x >= self.game.screen_rect.w + 16:
-            player.pos.x = -16
+            player.pos = (-16, player.pos.y)
             
         self.npc.draw(self.game.screen, self.npc.rect)
         if self.npc.pos.x >= self.game.screen_rect.w + 16:
-            self.npc.pos.x = -16
+            self.npc.pos = (-16, self.npc.pos.y)
+
+
 
+# all states by name (see State.next)
+STATES = {cls.__name__: cls for cls in (GameStart, Loading, InGame,
+                                        TitleScreen)}
@@ -0,0 +1,562 @@
+import pygame as pg
+import gzip
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import sprites as spr
+import tilemaps
+import clearance
+from navmesh import NavMesh
+from pvs import LocalPVS
+import utilities as utils
+import settings as st
+
+vec = pg.math.Vector2
+
+
+'''
+Streamed worlds
+
+split_map() cuts a tmx file into square regions of REGION_TILES tiles and
+writes them to a directory:
+    world.json: size, tilesets, layers, the start positions of the
+        player and the NPC and the size and reach of the PVS regions
+    region_<column>_<row>.json.gz: per region
+        layers: {layer: raw Tiled gids, row by row}
+        walls: wall rects, cut at the region's border
+        maze: the region's part of the collision grid ([x][y])
+        clearance: the region's part of the clearance grid ([x][y])
+        objects: all other objects whose position is in the region
+        pvs: [PVS region index, visible, clear] of the PVS regions whose
+            top left corner is in the region, see pvs.LocalPVS
+A StreamedMap only keeps the regions around the camera, the player and
+the NPC in memory and can be used in place of a tilemaps.Map.
+'''
+
+VERSION = 5
+INDEX_FILE = 'world.json'
+
+# flip flags of Tiled gids
+FLIPPED_H = 1 << 31
+FLIPPED_V = 1 << 30
+FLIPPED_D = 1 << 29
+GID_MASK = ~(FLIPPED_H | FLIPPED_V | FLIPPED_D)
+
+
+def region_file(column, row):
+    return f'region_{column}_{row}.json.gz'
+
+
+def split_map(filename, out_dir, region_tiles=st.REGION_TILES):
+    """writes the tmx file as a streamed world to out_dir"""
+    from pytmx import TiledTileLayer, TiledObjectGroup
+    
+    tiled_map = tilemaps.parse_map(filename)
+    tile_w, tile_h = tiled_map.tilewidth, tiled_map.tileheight
+    size = (tiled_map.width * tile_w, tiled_map.height * tile_h)
+    region_w, region_h = region_tiles * tile_w, region_tiles * tile_h
+    columns = math.ceil(tiled_map.width / region_tiles)
+    rows = math.ceil(tiled_map.height / region_tiles)
+
+    # pytmx numbers the tiles itself, get the original gids with flags
+    raw_gids = {0: 0}
+    for real_gid, gids in tiled_map.gidmap.items():
+        for gid, flags in gids:
+            raw_gids[gid] = (real_gid
+                             | (FLIPPED_H if flags.flipped_horizontally else 0)
+                             | (FLIPPED_V if flags.flipped_vertically else 0)
+                             | (FLIPPED_D if flags.flipped_diagonally else 0))
+
+    regions = {(c, r): {'layers': {}, 'walls': [], 'objects': []}
+               for c in range(columns) for r in range(rows)}
+    layers = []
+    max_layer = 0
+    start = (size[0] / 2, size[1] / 2)
+    npc_start = None
+    walls = tilemaps.wall_rects(tiled_map)
+
+    for layer in tiled_map.layers:
+        draw_layer = layer.properties.get('layer')
+        if draw_layer:
+            max_layer = max(max_layer, draw_layer)
+        if not layer.visible:
+            continue
+        if isinstance(layer, TiledTileLayer):
+            if draw_layer is None:
+                # layers without a layer property are never drawn
+                continue
+            layers.append(draw_layer)
+            for (c, r), region in regions.items():
+                region['layers'][draw_layer] = [
+                        raw_gids[layer.data[y][x]]
+                        for y in range(r * region_tiles,
+                                       min((r + 1) * region_tiles,
+                                           tiled_map.height))
+                        for x in range(c * region_tiles,
+                                       min((c + 1) * region_tiles,
+                                           tiled_map.width))]
+        elif isinstance(layer, TiledObjectGroup):
+            for obj in layer:
+                if obj.name == 'Wall':
+                    continue
+                if obj.name == 'Player':
+                    start = (obj.x, obj.y)
+                elif obj.name == 'NPC':
+                    # like in a tilemaps.Map, game.npc is the last one
+                    npc_start = (obj.x, obj.y)
+                key = (min(max(int(obj.x // region_w), 0), columns - 1),
+                       min(max(int(obj.y // region_h), 0), rows - 1))
+                regions[key]['objects'].append({
+                        'id': obj.id, 'name': obj.name, 'x': obj.x,
+                        'y': obj.y, 'width': obj.width,
+                        'height': obj.height, 'layer': draw_layer,
+                        'properties': {k: v for k, v in obj.properties.items()
+                                       if utils.is_jsonable(v)}
+                        })
+
+    pvs = LocalPVS.build(size, walls)
+    pvs_size = pvs.region_size
+
+    os.makedirs(out_dir, exist_ok=True)
+    for (c, r), region in regions.items():
+        rect = pg.Rect(c * region_w, r * region_h, region_w,
+                       region_h).clip(pg.Rect((0, 0), size))
+        region['pvs'] = []
+        for y in range(-(-rect.top // pvs_size), -(-rect.bottom // pvs_size)):
+            for x in range(-(-rect.left // pvs_size),
+                           -(-rect.right // pvs_size)):
+                a = y * pvs.columns + x
+                region['pvs'].append([a, pvs.visible[a], pvs.clear[a]])
+        for wall in walls:
+            clipped = wall.clip(rect)
+            if clipped.w and clipped.h:
+                region['walls'].append(list(clipped))
+        # walls of the neighboring regions block the cells at the border
+        near = [wall for wall in walls
+                if wall.colliderect(rect.inflate(st.CELL_SIZE * 2,
+                                                 st.CELL_SIZE * 2))]
+        origin = (rect.x // st.CELL_SIZE, rect.y // st.CELL_SIZE)
+        region['maze'] = tilemaps.build_maze(rect.size, near, origin)
+        # and the clearance of the cells within MAX_CLEARANCE
+        margin = (st.MAX_CLEARANCE + st.CELL_SIZE) * 2
+        near = [wall for wall in walls
+                if wall.colliderect(rect.inflate(margin, margin))]
+        region['clearance'] = clearance.build_clearance(rect.size, near,
+                                                        origin)
+        with gzip.open(os.path.join(out_dir, region_file(c, r)), 'wt') as f:
+            json.dump(region, f, separators=(',', ':'))
+
+    tilesets = []
+    for ts in tiled_map.tilesets:
+        image = os.path.join(os.path.dirname(filename), ts.source)
+        tilesets.append({
+                'firstgid': ts.firstgid,
+                'image': os.path.relpath(image, out_dir),
+                'tilewidth': ts.tilewidth, 'tileheight': ts.tileheight,
+                'spacing': ts.spacing, 'margin': ts.margin,
+                'columns': ((ts.width - 2 * ts.margin + ts.spacing)
+                            // (ts.tilewidth + ts.spacing))
+                })
+    index = {'version': VERSION, 'width': tiled_map.width,
+             'height': tiled_map.height, 'tilewidth': tile_w,
+             'tileheight': tile_h, 'region_tiles': region_tiles,
+             'columns': columns, 'rows': rows, 'layers': layers,
+             'max_layer': max_layer, 'tilesets': tilesets, 'start': start,
+             'npc': npc_start, 'pvs_region_size': pvs_size,
+             'pvs_reach': pvs.reach}
+    with open(os.path.join(out_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+
+
+class Region:
+    __slots__ = ('key', 'rect', 'layers', 'walls', 'pvs_regions')
+
+    def __init__(self, key, rect):
+        self.key = key
+        self.rect = rect
+        # layer: Surface
+        self.layers = {}
+        self.walls = []
+        # indices of the PVS regions whose sets came with the region
+        self.pvs_regions = []
+
+
+
+class RegionGrid:
+    """a grid of cells that is indexed with [x][y] like the maze of a
+    tilemaps.Map, but only the cells of the loaded regions are stored.
+    The cells of the other regions have the default value
+    Args:
+        size: (width, height) in cells
+        region_size: (width, height) of a region in cells
+        default: value of the cells that aren't loaded"""
+    def __init__(self, size, region_size, default):
+        self.width, self.height = size
+        self.region_w, self.region_h = region_size
+        self.default = default
+        # (column, row): cells of the region, [x][y]
+        self.regions = {}
+        # x: GridColumn
+        self.columns = {}
+
+
+    def __len__(self):
+        return self.width
+
+
+    def __getitem__(self, x):
+        column = self.columns.get(x)
+        if column is None:
+            if not 0 <= x < self.width:
+                raise IndexError('grid index out of range')
+            column = self.columns[x] = GridColumn(self, x)
+        return column
+
+
+    def set_region(self, key, cells):
+        self.regions[key] = cells
+
+
+    def clear_region(self, key):
+        self.regions.pop(key, None)
+
+
+    def memory_size(self):
+        """returns the size of the stored cell references in bytes"""
+        return sum(len(cells) * len(cells[0]) * 8
+                   for cells in self.regions.values() if cells)
+
+
+
+class GridColumn:
+    __slots__ = ('grid', 'column', 'x')
+
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.column = x // grid.region_w
+        # x in the region
+        self.x = x % grid.region_w
+
+
+    def __len__(self):
+        return self.grid.height
+
+
+    def __getitem__(self, y):
+        grid = self.grid
+        if not 0 <= y < grid.height:
+            raise IndexError('grid index out of range')
+        cells = grid.regions.get((self.column, y // grid.region_h))
+        if cells is None:
+            return grid.default
+        return cells[self.x][y % grid.region_h]
+
+
+
+class StreamedMap:
+    """a map that is split into regions (see split_map). Only the regions
+    near the camera, the player and the NPC are loaded: their layers are
+    drawn, their walls are added to the game and their part of the maze,
+    the clearance grid and the PVS is filled in.
+    Regions are read on a worker thread. They are loaded within
+    STREAM_LOAD_DISTANCE and unloaded beyond STREAM_UNLOAD_DISTANCE, so
+    that a sprite moving along a border doesn't load and unload the same
+    region over and over.
+    Moving sprites are spawned the first time their region is loaded.
+    When a region is unloaded, the sprites in it are removed and spawned
+    again at the same position with the region"""
+    streamed = True
+
+    def __init__(self, game, world_dir):
+        self.game = game
+        self.filename = world_dir
+        with open(os.path.join(world_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        if self.index['version'] != VERSION:
+            raise ValueError(f'Unsupported world version '
+                             f'{self.index["version"]}')
+
+        self.tilesize = vec(self.index['tilewidth'], self.index['tileheight'])
+        self.size = vec(self.index['width'] * self.tilesize.x,
+                        self.index['height'] * self.tilesize.y)
+        self.rect = pg.Rect((0, 0), self.size)
+        self.region_tiles = self.index['region_tiles']
+        self.region_size = self.tilesize * self.region_tiles
+        self.max_layer = self.index['max_layer']
+        self.background_color = None
+        # the layers are drawn per region
+        self.layers = {}
+
+        # cells of regions that aren't loaded count as walls
+        cells = (int(self.size.x) // st.CELL_SIZE,
+                 int(self.size.y) // st.CELL_SIZE)
+        region_cells = (int(self.region_size.x) // st.CELL_SIZE,
+                        int(self.region_size.y) // st.CELL_SIZE)
+        self.maze = RegionGrid(cells, region_cells, 1)
+        self.clearance = RegionGrid(cells, region_cells, 0)
+        # the sets come with the regions
+        pvs_size = self.index['pvs_region_size']
+        self.pvs = LocalPVS(math.ceil(self.size.x / pvs_size),
+                            math.ceil(self.size.y / pvs_size), pvs_size,
+                            self.index['pvs_reach'])
+        # (column, row): Region
+        self.regions = {}
+        # (hitbox size, loaded regions), NavMesh
+        self.navmesh_key = None
+        self.navmesh_cache = None
+        # (column, row): Future of the region data
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # raw gid: Surface
+        self.tiles = {}
+        self.tileset_images = {}
+        # ids of the objects that were spawned already
+        self.spawned_ids = set()
+        # (column, row): objects that were removed with their region
+        self.parked = {}
+
+
+    def region_rect(self, key):
+        return pg.Rect(key[0] * self.region_size.x,
+                       key[1] * self.region_size.y,
+                       self.region_size.x, self.region_size.y)
+
+
+    def read_region(self, key):
+        # runs on the worker thread
+        with gzip.open(os.path.join(self.filename, region_file(*key)),
+                       'rt') as f:
+            return json.load(f)
+
+
+    def regions_near(self, points, distance):
+        """returns the keys of the regions within distance of the points"""
+        keys = set()
+        size = self.region_size
+        for x, y in points:
+            for column in range(max(int((x - distance) // size.x), 0),
+                                min(int((x + distance) // size.x),
+                                    self.index['columns'] - 1) + 1):
+                for row in range(max(int((y - distance) // size.y), 0),
+                                 min(int((y + distance) // size.y),
+                                     self.index['rows'] - 1) + 1):
+                    rect = self.region_rect((column, row))
+                    # distance from the point to the closest point
+                    # of the region
+                    dx = max(rect.left - x, 0, x - rect.right)
+                    dy = max(rect.top - y, 0, y - rect.bottom)
+                    if dx * dx + dy * dy <= distance * distance:
+                        keys.add((column, row))
+        return keys
+
+
+    def stream_centers(self):
+        camera = self.game.camera
+        centers = [(-camera.rect.x + self.game.world_screen_rect.w / 2,
+                    -camera.rect.y + self.game.world_screen_rect.h / 2)]
+        for sprite in (getattr(self.game, 'player', None),
+                       getattr(self.game, 'npc', None)):
+            if sprite and sprite.alive():
+                centers.append(tuple(sprite.pos))
+        return centers
+
+
+    def get_tile(self, raw_gid):
+        tile = self.tiles.get(raw_gid)
+        if tile is None:
+            gid = raw_gid & GID_MASK
+            tileset = max((ts for ts in self.index['tilesets']
+                           if ts['firstgid'] <= gid),
+                          key=lambda ts: ts['firstgid'])
+            image = self.tileset_images.get(tileset['image'])
+            if image is None:
+                image = pg.image.load(os.path.join(
+                        self.filename, tileset['image'])).convert_alpha()
+                self.tileset_images[tileset['image']] = image
+            i = gid - tileset['firstgid']
+            x = (tileset['margin'] + (i % tileset['columns'])
+                 * (tileset['tilewidth'] + tileset['spacing']))
+            y = (tileset['margin'] + (i // tileset['columns'])
+                 * (tileset['tileheight'] + tileset['spacing']))
+            tile = image.subsurface((x, y, tileset['tilewidth'],
+                                     tileset['tileheight']))
+            if raw_gid & FLIPPED_D:
+                tile = pg.transform.flip(pg.transform.rotate(tile, 270),
+                                         True, False)
+            if raw_gid & (FLIPPED_H | FLIPPED_V):
+                tile = pg.transform.flip(tile, bool(raw_gid & FLIPPED_H),
+                                         bool(raw_gid & FLIPPED_V))
+            self.tiles[raw_gid] = tile
+        return tile
+
+
+    def load_region(self, key, data):
+        """creates the layers, walls, maze and clearance cells and sprites
+        of a region"""
+        region = Region(key, self.region_rect(key).clip(self.rect))
+        width = region.rect.w // int(self.tilesize.x)
+        for layer, gids in data['layers'].items():
+            surface = pg.Surface(region.rect.size, pg.SRCALPHA)
+            for i, raw_gid in enumerate(gids):
+                if raw_gid:
+                    surface.blit(self.get_tile(raw_gid),
+                                 ((i % width) * self.tilesize.x,
+                                  (i // width) * self.tilesize.y))
+            # json keys are strings
+            region.layers[int(layer)] = surface
+
+        for x, y, w, h in data['walls']:
+            region.walls.append(spr.Wall(self.game, {'x': x, 'y': y,
+                                                     'width': w,
+                                                     'height': h}))
+
+        self.maze.set_region(key, data['maze'])
+        self.clearance.set_region(key, data['clearance'])
+        for a, visible, clear in data['pvs']:
+            self.pvs.add(a, visible, clear)
+            region.pvs_regions.append(a)
+
+        objects = [obj for obj in data['objects']
+                   if obj['id'] not in self.spawned_ids]
+        objects += self.parked.pop(key, [])
+        for obj in objects:
+            sprite_class = spr.SPRITES.get(obj['name'])
+            if sprite_class is None:
+                print(f'No sprite "{obj["name"]}" found in sprites module')
+                continue
+            kwargs = dict(obj)
+            draw_layer = kwargs.pop('layer')
+            s = sprite_class(self.game, kwargs)
+            s.draw_layer = draw_layer
+            self.spawned_ids.add(obj['id'])
+
+        self.regions[key] = region
+
+
+    def unload_region(self, key):
+        region = self.regions.pop(key)
+        for wall in region.walls:
+            wall.kill()
+
+        self.maze.clear_region(key)
+        self.clearance.clear_region(key)
+        for a in region.pvs_regions:
+            self.pvs.remove(a)
+
+        # the regions around the player and the NPC stay loaded (see
+        # stream_centers), so they are never parked
+        keep = (getattr(self.game, 'player', None),
+                getattr(self.game, 'npc', None))
+        kinematics = self.game.kinematics
+        for sprite in kinematics.sprites[:kinematics.count]:
+            if sprite in keep or not region.rect.collidepoint(sprite.pos):
+                continue
+            self.parked.setdefault(key, []).append({
+                    'id': sprite.id, 'name': type(sprite).__name__,
+                    'x': sprite.pos.x, 'y': sprite.pos.y,
+                    'width': sprite.width, 'height': sprite.height,
+                    'layer': sprite.draw_layer,
+                    'properties': dict(sprite.extra)})
+            sprite.kill()
+
+
+    def create_map(self):
+        for _ in self.create_steps():
+            pass
+
+
+    def create_steps(self):
+        """loads the regions around the start positions of the player and
+        the NPC, one per step"""
+        start = self.index['start']
+        starts = [start]
+        if self.index['npc']:
+            # InGame.startup expects the NPC to exist
+            starts.append(self.index['npc'])
+        keys = self.regions_near(starts, st.STREAM_LOAD_DISTANCE)
+        # the player's region comes first, other sprites (like the NPC)
+        # expect the player to exist
+        keys = sorted(keys, key=lambda key: vec(start).distance_to(
+                self.region_rect(key).center))
+        for key in keys:
+            self.load_region(key, self.read_region(key))
+            yield True
+
+
+    def update(self):
+        centers = self.stream_centers()
+        wanted = self.regions_near(centers, st.STREAM_LOAD_DISTANCE)
+        keep = self.regions_near(centers, st.STREAM_UNLOAD_DISTANCE)
+
+        for key in [key for key in self.regions if key not in keep]:
+            self.unload_region(key)
+        for key in [key for key in self.pending if key not in keep]:
+            self.pending.pop(key).cancel()
+
+        for key in wanted:
+            if key in self.regions or key in self.pending:
+                continue
+            if self.game.headless:
+                # keep headless runs deterministic
+                self.load_region(key, self.read_region(key))
+            else:
+                self.pending[key] = self.executor.submit(self.read_region,
+                                                         key)
+
+        # create at most one region per tick to spread the work
+        for key, future in self.pending.items():
+            if future.done():
+                del self.pending[key]
+                self.load_region(key, future.result())
+                break
+
+
+    def navmesh(self, agent_size):
+        """returns the navigation mesh of the loaded regions for hitboxes
+        of this size. Regions that aren't loaded count as walls. The mesh is
+        built again when other regions are loaded"""
+        key = (tuple(agent_size), frozenset(self.regions))
+        if key != self.navmesh_key:
+            blocked = [wall.hitbox for wall in self.game.walls]
+            blocked += [self.region_rect((column, row)).clip(self.rect)
+                        for column in range(self.index['columns'])
+                        for row in range(self.index['rows'])
+                        if (column, row) not in self.regions]
+            self.navmesh_cache = NavMesh(self.size, blocked, agent_size)
+            self.navmesh_key = key
+        return self.navmesh_cache
+
+
+    def draw_layer(self, screen, camera, layer):
+        view = screen.get_rect().move(-camera.rect.x, -camera.rect.y)
+        for region in self.regions.values():
+            surface = region.layers.get(layer)
+            if surface and view.colliderect(region.rect):
+                screen.blit(surface, camera.apply_rect(region.rect))
+
+
+    def deactivate(self):
+        for key in list(self.regions):
+            self.unload_region(key)
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        for sprite in (getattr(self.game, 'player', None),
+                       getattr(self.game, 'npc', None)):
+            if sprite:
+                sprite.kill()
+        self.executor.shutdown(wait=False)
+
+
+    def memory_size(self):
+        images = [surface for region in self.regions.values()
+                  for surface in region.layers.values()]
+        images += list(self.tileset_images.values())
+        return (sum(image.get_width() * image.get_height()
+                    * image.get_bytesize() for image in images)
+                + self.pvs.memory_size()
+                + self.maze.memory_size() + self.clearance.memory_size())
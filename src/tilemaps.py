@@ -1,20 +1,32 @@
 import pygame as pg
-from pytmx import TiledTileLayer, TiledObjectGroup
-from pytmx.util_pygame import load_pygame
-import inspect
+import sys
 
 import sprites as spr
+import utilities as utils
+import settings as st
+from navmesh import NavMesh
 
 vec = pg.math.Vector2
 
 
 class Map():
-    def __init__(self, game, filename):
+    # see streaming.StreamedMap
+    streamed = False
+    
+    def __init__(self, game, filename, tiled_map=None, maze=None,
+                 clearance=None, pvs=None):
+        """
+        tiled_map, maze, clearance and pvs can be passed if they were loaded
+        before (see maploader.py), otherwise the file is loaded here
+        """
         self.game = game
         self.filename = filename
         
         # load map data
-        self.tiled_map = load_pygame(self.filename)
+        if tiled_map is None:
+            from pytmx.util_pygame import load_pygame
+            tiled_map = load_pygame(self.filename)
+        self.tiled_map = tiled_map
         self.tilesize = vec(self.tiled_map.tilewidth, self.tiled_map.tileheight)
         self.size = vec(self.tiled_map.width * self.tilesize.x, 
                         self.tiled_map.height * self.tilesize.y)
@@ -22,10 +34,39 @@ class Map():
         self.layers = {}
         self.max_layer = 0
         self.rect = None
+        # collision grid (see build_maze)
+        self.maze = maze
+        # distance to the walls per grid cell (see clearance.py)
+        self.clearance = clearance
+        # visibility between regions of the map (see pvs.py)
+        self.pvs = pvs
+        # hitbox size: NavMesh, built when it is needed
+        self.navmeshes = {}
+        # (sprite class, kwargs, draw layer) of every object on the map
+        self.spawn_data = []
+        # sprites of this map that are currently in the game
+        self.sprites = []
+        # (sprite, groups) of the sprites that don't move, they are kept
+        # when the map is deactivated
+        self.static_sprites = []
+        # changes of the walls while the game runs (see dynamicwalls.py):
+        # the Wall sprites that were added and the (x, y, width, height) of
+        # the walls of the tmx file that were removed
+        self.added_walls = []
+        self.removed_walls = []
         
     
     def create_map(self):
         """ectracts tileset and object data from a tmx file"""
+        for _ in self.create_steps():
+            pass
+    
+    
+    def create_steps(self):
+        """same as create_map, but as a generator that creates one layer
+        per step, so that the work can be spread over several frames"""
+        from pytmx import TiledTileLayer, TiledObjectGroup
+        
         # loop through all available layers
         for layer in self.tiled_map:
             if layer.properties.get('layer'):
@@ -45,14 +86,130 @@ class Map():
             elif isinstance(layer, TiledObjectGroup) and layer.visible:
                 # if layer is an object layer, fetch the corresponding sprite
                 # from the sprites.py (spr) module
-                sprites = dict(inspect.getmembers(spr, inspect.isclass))
                 for obj in layer:
-                    if obj.name in sprites:
+                    if obj.name in spr.SPRITES:
                         # check if the sprite exists in sprites.py
                         # if so, instantiate the sprite
-                        s = sprites[obj.name](self.game, obj.__dict__)
-                        s.draw_layer = layer.properties.get('layer')
+                        spawn = (spr.SPRITES[obj.name], obj.__dict__,
+                                 layer.properties.get('layer'))
+                        self.spawn_data.append(spawn)
+                        self.spawn(*spawn)
                     else:
                         print(f'No sprite "{obj.name}" found in sprites module')
+            yield True
+    
+    
+    def spawn(self, sprite_class, kwargs, draw_layer):
+        # the sprites change the kwargs, so they get a copy
+        s = sprite_class(self.game, dict(kwargs))
+        s.draw_layer = draw_layer
+        self.sprites.append(s)
+        if not isinstance(s, spr.KinematicSprite):
+            self.static_sprites.append((s, s.groups()))
+        return s
+    
+    
+    def deactivate(self):
+        """removes the sprites of this map from the game, so that it can be
+        kept in the map cache while another map is played"""
+        for s in self.sprites:
+            s.kill()
+        self.sprites = []
+    
+    
+    def activate(self):
+        """adds the sprites of a deactivated map back to the game. Moving
+        sprites start again at their spawn position"""
+        for s, groups in self.static_sprites:
+            s.add(*groups)
+            self.sprites.append(s)
+        for spawn in self.spawn_data:
+            if issubclass(spawn[0], spr.KinematicSprite):
+                self.spawn(*spawn)
+    
+    
+    def update(self):
+        pass
+    
+    
+    def draw_layer(self, screen, camera, layer):
+        tiles = self.layers.get(layer)
+        if tiles:
+            screen.blit(tiles, camera.apply_bg(self.rect))
+    
+    
+    def navmesh(self, agent_size):
+        """returns the navigation mesh for hitboxes of this size"""
+        mesh = self.navmeshes.get(agent_size)
+        if mesh is None:
+            mesh = NavMesh(self.size, [w.hitbox for w in self.game.walls],
+                           agent_size)
+            self.navmeshes[agent_size] = mesh
+        return mesh
+    
+    
+    def memory_size(self):
+        """returns the approximate size of the map in bytes (layers, tile
+        images, the maze, the clearance grid and the PVS)"""
+        images = list(self.layers.values()) + [
+                image for image in self.tiled_map.images
+                if isinstance(image, pg.Surface)]
+        size = sum(image.get_width() * image.get_height()
+                   * image.get_bytesize() for image in images)
+        for grid in (self.maze, self.clearance):
+            if grid:
+                size += sum(sys.getsizeof(column) for column in grid)
+        if self.pvs:
+            size += self.pvs.memory_size()
+        return size
+
+
+
+def parse_map(filename):
+    """loads the map data without the tile images. This doesn't create
+    any Surfaces, so it can be called from a worker thread. The images are
+    loaded by load_images()"""
+    # pytmx is imported when the first map is loaded, so that it doesn't
+    # delay the title screen
+    from pytmx import TiledMap
+    return TiledMap(filename)
+
+
+def load_images(tiled_map):
+    """loads the tile images of a map from parse_map(). Has to be called
+    from the main thread"""
+    from pytmx.util_pygame import pygame_image_loader
+    tiled_map.image_loader = pygame_image_loader
+    tiled_map.reload_images()
+
+
+def wall_rects(tiled_map):
+    """returns the rects of the Wall objects of the map"""
+    return [pg.Rect(obj.x, obj.y, obj.width, obj.height)
+            for layer in tiled_map.visible_object_groups
+            for obj in tiled_map.layers[layer]
+            if obj.name == 'Wall']
+
+
+def build_maze(size, walls, origin=(0, 0)):
+    """returns the collision grid for the pathfinding, indexed with
+    [x][y]. Cells that are close to a wall are 1, free cells are -1
+    Args:
+        size: size of the map (or the part of it) in pixels
+        walls: list of wall rects
+        origin: grid position of the first cell"""
+    maze = []
+    inflated = [w.inflate((st.CELL_SIZE, st.CELL_SIZE)) for w in walls]
+    for x in range(int(size[0]) // st.CELL_SIZE):
+        maze.append([])
+        for y in range(int(size[1]) // st.CELL_SIZE):
+            point = utils.grid_to_pos((x + origin[0], y + origin[1]),
+                                      st.CELL_SIZE, st.CELL_OFFSET)
+            intersects = False
+            for rect in inflated:
+                if rect.collidepoint(point):
+                    intersects = True
+            maze[x].append(1 if intersects else -1)
+    return maze
 
 
@@ -1,5 +1,7 @@
 import pygame as pg
+import pygame.freetype
 import json
+from collections import OrderedDict
 
 import settings as st
 
@@ -23,14 +25,18 @@ def collide_with_walls(sprite, group, dir_):
         if hits:
             wall = hits[0]
             # hit from left
+            pos = sprite.pos
             if wall.hitbox.centerx > sprite.hitbox.centerx:
-                sprite.pos.x = wall.hitbox.left - sprite.hitbox.w / 2
+                pos.x = wall.hitbox.left - sprite.hitbox.w / 2
             # hit from right
             elif wall.hitbox.centerx < sprite.hitbox.centerx:
-                sprite.pos.x = wall.hitbox.right + sprite.hitbox.w / 2
-                            
-            sprite.vel.x = 0
-            sprite.hitbox.centerx = sprite.pos.x
+                pos.x = wall.hitbox.right + sprite.hitbox.w / 2
+            # assign the vectors again, the sprite might store them elsewhere
+            sprite.pos = pos
+            vel = sprite.vel
+            vel.x = 0
+            sprite.vel = vel
+            sprite.hitbox.centerx = pos.x
             return True
             
     elif dir_ == 'y':
@@ -38,14 +44,18 @@ def collide_with_walls(sprite, group, dir_):
         if hits:
             wall = hits[0]
             # hit from top
+            pos = sprite.pos
             if wall.hitbox.centery > sprite.hitbox.centery:
-                sprite.pos.y = wall.hitbox.top - sprite.hitbox.h / 2
+                pos.y = wall.hitbox.top - sprite.hitbox.h / 2
             # hit from bottom
             elif wall.hitbox.centery < sprite.hitbox.centery:
-                sprite.pos.y = wall.hitbox.bottom + sprite.hitbox.h / 2
-                
-            sprite.vel.y = 0
-            sprite.hitbox.centery = sprite.pos.y
+                pos.y = wall.hitbox.bottom + sprite.hitbox.h / 2
+            
+            sprite.pos = pos
+            vel = sprite.vel
+            vel.y = 0
+            sprite.vel = vel
+            sprite.hitbox.centery = pos.y
             return True
     return False
 
@@ -57,14 +67,9 @@ def difference(list1, list2):
 def draw_text(surface, text, file, size, color, pos, align='topleft'):
     '''
     draws the text string at a given position with the given text file
-    (might be too performance intensive?)
+    fonts and rendered strings are cached by the module's TextRenderer
     '''
-    font = pg.font.Font(file, size)
-    font.set_bold(False)
-    text_surface = font.render(text, False, color)
-    text_rect = text_surface.get_rect()
-    setattr(text_rect, align, pos)
-    surface.blit(text_surface, text_rect)
+    text_renderer.draw(surface, text, file, size, color, pos, align)
 
 
 def grid_to_pos(grid, cellsize, offset):
@@ -83,6 +88,119 @@ def pos_to_grid(pos, cellsize, offset):
     return (int((pos[0] - offset[0]) / cellsize), int((pos[1] - offset[0]) / cellsize))
 
 
+class TextRenderer:
+    """caches font objects by (file, size, type) and rendered text surfaces
+    by (string, font, color, antialias) in a bounded LRU, so that labels
+    that don't change are only rendered once. Text that changes often
+    (numbers, counters) is drawn from cached glyphs with draw_glyphs()
+    instead, so it doesn't fill the LRU.
+    Works with pygame.font.Font and pygame.freetype.Font objects"""
+    def __init__(self, max_surfaces=st.TEXT_CACHE_SIZE):
+        self.max_surfaces = max_surfaces
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        # (char, font, color, antialias): (surface, offset, advance)
+        self.glyphs = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_font(self, file, size, freetype=False):
+        key = (file, size, freetype)
+        font = self.fonts.get(key)
+        if font is None:
+            # the font modules are started when the first font is needed
+            if freetype:
+                if not pygame.freetype.get_init():
+                    pygame.freetype.init()
+                font = pygame.freetype.Font(file=file, size=size)
+            else:
+                if not pg.font.get_init():
+                    pg.font.init()
+                font = pg.font.Font(file, size)
+            self.fonts[key] = font
+        return font
+
+
+    def render(self, text, font, color, antialias=False):
+        """returns a (cached) surface with the rendered text"""
+        color = tuple(pg.Color(color))
+        key = (text, font, color, antialias)
+        text_surface = self.surfaces.get(key)
+        if text_surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return text_surface
+
+        self.misses += 1
+        if isinstance(font, pygame.freetype.Font):
+            font.antialiased = antialias
+            text_surface, _ = font.render(text, fgcolor=color, bgcolor=None)
+        else:
+            text_surface = font.render(text, antialias, color)
+
+        self.surfaces[key] = text_surface
+        if len(self.surfaces) > self.max_surfaces:
+            # remove the least recently used surface
+            self.surfaces.popitem(last=False)
+        return text_surface
+
+
+    def glyph(self, char, font, color, antialias=False):
+        """returns the cached surface of a character, its offset from the
+        pen position (top of the line) and the advance to the next one"""
+        key = (char, font, color, antialias)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            if isinstance(font, pygame.freetype.Font):
+                font.antialiased = antialias
+                image, rect = font.render(char, fgcolor=color, bgcolor=None)
+                # freetype crops the glyph to its ink, rect.y is its top
+                # above the baseline
+                offset = (rect.x, font.get_sized_ascender() - rect.y)
+                advance = font.get_metrics(char)[0][4]
+            else:
+                # the surfaces of pygame.font all have the line's height
+                image = font.render(char, antialias, color)
+                offset = (0, 0)
+                advance = font.metrics(char)[0][4]
+            glyph = self.glyphs[key] = (image, offset, advance)
+        return glyph
+
+
+    def draw_glyphs(self, surface, text, font, color, pos, antialias=False):
+        """draws text that changes often character by character from
+        cached glyphs, without kerning. Returns the pen position after the
+        text"""
+        color = tuple(pg.Color(color))
+        x, y = pos
+        for char in text:
+            image, (dx, dy), advance = self.glyph(char, font, color,
+                                                  antialias)
+            surface.blit(image, (x + dx, y + dy))
+            x += advance
+        return x, y
+
+
+    def draw(self, surface, text, file, size, color, pos, align='topleft',
+             antialias=False, freetype=False):
+        font = self.get_font(file, size, freetype)
+        text_surface = self.render(text, font, color, antialias)
+        text_rect = text_surface.get_rect()
+        setattr(text_rect, align, pos)
+        surface.blit(text_surface, text_rect)
+        return text_rect
+
+
+    def clear(self):
+        self.surfaces.clear()
+        self.glyphs.clear()
+
+
+
+text_renderer = TextRenderer()
+
+
 class Camera:
     """modified from http://kidscancode.org/lessons/
     modes are
@@ -105,6 +223,10 @@ class Camera:
         
         self.slide_speed = 0.05 # percent, change this to dt
         self.slide_amount = 0
+        
+        # rects of the last two simulation steps, used for interpolation
+        self.last_rect = self.rect.copy()
+        self.next_rect = self.rect.copy()
 
 
     def apply(self, entity):
@@ -194,7 +316,19 @@ class Camera:
         y = min(0, y) # top
         y = max(-(self.map_height - self.game.world_screen_rect.h), y) # bottom
         
-        self.rect = pg.Rect(x, y, self.map_width, self.map_height)
+        self.last_rect = self.next_rect
+        self.next_rect = pg.Rect(x, y, self.map_width, self.map_height)
+        self.rect = self.next_rect.copy()
+    
+    
+    def interpolate(self, alpha):
+        """moves the camera between the last two simulation steps
+        Args:
+            alpha: 0 (last step) to 1 (current step)"""
+        self.rect.x = round(self.last_rect.x
+                            + (self.next_rect.x - self.last_rect.x) * alpha)
+        self.rect.y = round(self.last_rect.y
+                            + (self.next_rect.y - self.last_rect.y) * alpha)
         
 
 class Line:
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# no window and no sound device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import game as game_module
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+DUNGEON = os.path.join(DATA_DIR, 'tilemaps', 'dungeon.tmx')
+
+
+@pytest.fixture
+def headless_game():
+    """a headless game in the InGame state of the first map"""
+    game = game_module.Game(headless=True)
+    game.run_headless(2)
+    assert game.state_name == 'InGame'
+    return game
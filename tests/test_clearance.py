@@ -0,0 +1,50 @@
+import numpy as np
+import pygame as pg
+
+import settings as st
+from clearance import build_clearance, distance_field
+
+# one wall cell in the middle of an empty area of 12 x 12 cells
+SIZE = (12 * st.CELL_SIZE, 12 * st.CELL_SIZE)
+WALL = pg.Rect(5 * st.CELL_SIZE, 5 * st.CELL_SIZE, st.CELL_SIZE,
+               st.CELL_SIZE)
+
+
+def test_distance_field_in_half_cells():
+    occupied = np.zeros((7, 7), dtype=bool)
+    occupied[3, 3] = True
+    field = distance_field(occupied, 2)
+    assert field[3, 3] == 0
+    # from the center to the border of the wall cell
+    assert field[2, 3] == field[3, 4] == 1 ** 2
+    assert field[1, 3] == field[3, 5] == 3 ** 2
+    # to its corner
+    assert field[2, 2] == 1 ** 2 + 1 ** 2
+    assert field[1, 2] == 3 ** 2 + 1 ** 2
+    # further than max_distance
+    assert field[0, 3] == field[0, 0] == 5 ** 2
+
+
+def test_single_wall():
+    assert st.CELL_SIZE == 8 and st.MAX_CLEARANCE == 16
+    clearance = build_clearance(SIZE, [WALL])
+    assert clearance[5][5] == 0
+    # half a cell from the center of the next cell to the wall
+    assert clearance[4][5] == clearance[6][5] == 4
+    assert clearance[5][4] == clearance[5][6] == 4
+    assert clearance[3][5] == clearance[7][5] == 12
+    # 20 pixels, capped
+    assert clearance[2][5] == st.MAX_CLEARANCE
+    # the corner is sqrt(4 ** 2 + 4 ** 2) away, rounded down
+    assert clearance[4][4] == 5
+    assert clearance[0][0] == clearance[11][11] == st.MAX_CLEARANCE
+
+
+def test_wall_outside_of_the_area():
+    # cells 6 to 9, the wall is in cell 5 just left of them
+    clearance = build_clearance((4 * st.CELL_SIZE, 4 * st.CELL_SIZE),
+                                [WALL], origin=(6, 4))
+    assert clearance[0][1] == 4
+    assert clearance[1][1] == 12
+    assert clearance[2][1] == st.MAX_CLEARANCE
+    assert clearance[0][0] == 5
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import settings as st
+from cooperative import CooperativePlanner, DistanceField, octile
+
+RADIUS = 3.5
+
+
+def cell(pos):
+    return (int(pos[0]) // st.CELL_SIZE, int(pos[1]) // st.CELL_SIZE)
+
+
+def planner_on(rows):
+    """a planner on a small map, '#' are walls"""
+    clearance = [[0 if rows[y][x] == '#' else st.MAX_CLEARANCE
+                  for y in range(len(rows))] for x in range(len(rows[0]))]
+    return CooperativePlanner(SimpleNamespace(clearance=clearance))
+
+
+def agent(sprite_id):
+    return SimpleNamespace(id=sprite_id, radius=RADIUS)
+
+
+def check_apart(a, b):
+    """the plans don't share a cell at the same step and don't swap"""
+    # a sprite that arrived stays in its cell
+    steps = max(len(a), len(b))
+    a = a + [a[-1]] * (steps - len(a))
+    b = b + [b[-1]] * (steps - len(b))
+    for t in range(steps):
+        assert a[t] != b[t]
+        if t + 1 < steps:
+            assert not (a[t] == b[t + 1] and a[t + 1] == b[t])
+
+
+def test_heuristic_is_built_over_ticks(headless_game):
+    game = headless_game
+    planner = game.path_planner
+    planner.clear()
+    npc = game.npc
+    goal = cell(game.player.pos)
+
+    # no field yet: only the distance without walls
+    h = planner.heuristic(goal, npc.radius)
+    field = planner.fields[(goal, npc.radius)]
+    assert not field.done
+    assert h(0, 0) == octile(goal[0], goal[1])
+
+    ticks = 0
+    while not field.done:
+        planner.update()
+        ticks += 1
+    passable = np.array(game.clearance) >= npc.radius
+    exact = DistanceField(goal, passable)
+    assert exact.step(ticks * st.COOP_FIELD_ITERATIONS)
+    assert field.distances == exact.distances
+
+    # a goal next to it reuses the field and is a lower bound of its own
+    near = (goal[0] + 1, goal[1])
+    h = planner.heuristic(near, npc.radius)
+    assert len(planner.fields) == 1
+    own = DistanceField(near, passable)
+    own.step(len(passable) * len(passable[0]))
+    for x in range(len(passable)):
+        for y in range(len(passable[0])):
+            assert h(x, y) <= own.distances[x][y] + 1e-9
+
+
+def test_kill_releases_reservations(headless_game):
+    game = headless_game
+    planner = game.path_planner
+    npc = game.npc
+    planner.plan(npc, cell(npc.pos), cell(game.player.pos))
+    assert npc.id in planner.reserved
+    npc.kill()
+    assert npc.id not in planner.reserved
+    assert npc.id not in planner.reservations.values()
+
+
+def test_plan_avoids_reserved_cells():
+    planner = planner_on(['.....'] * 5)
+    # another sprite is in the middle of the straight line at step 2
+    planner.reservations[(2, 2, 2)] = 'other'
+    cells, distance, expanded, open_peak = planner.plan(agent('a'), (0, 2),
+                                                        (4, 2))
+    assert cells[0] == (0, 2) and cells[-1] == (4, 2)
+    assert cells[2] != (2, 2)
+    # the detour or the wait costs something
+    assert distance > 4
+    assert planner.reservations[(2, 2, 2)] == 'other'
+
+
+def test_blocked_stops_swaps():
+    planner = planner_on(['....'])
+    # b moves from (1, 0) to (0, 0) between step 0 and 1
+    planner.reservations[(1, 0, 0)] = 'b'
+    planner.reservations[(0, 0, 1)] = 'b'
+    assert planner.blocked('a', (0, 0), (1, 0), 0)
+    # following it is fine, standing in its way at step 1 isn't
+    assert not planner.blocked('a', (2, 0), (1, 0), 1)
+    assert planner.blocked('a', (1, 0), (0, 0), 0)
+    # its own reservations don't block it
+    assert not planner.blocked('b', (1, 0), (0, 0), 0)
+
+
+def test_plans_per_tick(monkeypatch):
+    monkeypatch.setattr(st, 'COOP_PLANS_PER_TICK', 2)
+    planner = planner_on(['......'] * 3)
+    agents = [agent(i) for i in range(3)]
+    for i in range(2):
+        assert planner.wants_plan(agents[i])
+        planner.plan(agents[i], (0, i), (5, i))
+    assert not planner.wants_plan(agents[2])
+
+    planner.update()
+    assert planner.wants_plan(agents[2])
+    # the others still have a plan that isn't old
+    assert not planner.wants_plan(agents[0])
+    assert planner.plan_step(agents[0]) == 0
+    assert planner.plan_step(agents[2]) is None
+
+
+def test_boxed_in_agent_waits():
+    planner = planner_on(['#.###',
+                          '.....',
+                          '#.###'])
+    # the other sprite stays around the dead end for the whole window
+    for x, y in ((0, 1), (1, 0), (1, 2), (2, 1)):
+        for t in range(st.COOP_WINDOW + 2):
+            planner.reservations[(x, y, t)] = 'other'
+    cells, distance, expanded, open_peak = planner.plan(agent('a'), (1, 1),
+                                                        (4, 1))
+    assert set(cells) == {(1, 1)}
+    assert distance >= 3
+    assert all(planner.reservations[(1, 1, t)] == 'a'
+               for t in range(st.COOP_WINDOW + 1))
+
+
+def test_two_agents_in_a_corridor():
+    # a corridor with a niche that b can reach before it meets a
+    planner = planner_on(['######.##',
+                          '.........',
+                          '#########'])
+    a, b = agent('a'), agent('b')
+    a_cells = planner.plan(a, (0, 1), (8, 1))[0]
+    b_cells = planner.plan(b, (8, 1), (0, 1))[0]
+    assert a_cells and b_cells
+    check_apart(a_cells, b_cells)
+    # no key is reserved twice, the first plan is kept
+    assert set(planner.reserved['a']).isdisjoint(planner.reserved['b'])
+
+    # and again while they meet
+    for _ in range(4 * st.COOP_STEP_TICKS):
+        planner.update()
+    step = planner.plan_step(a)
+    a_start, b_start = a_cells[min(step, len(a_cells) - 1)], \
+        b_cells[min(step, len(b_cells) - 1)]
+    a_cells = planner.plan(a, a_start, (8, 1))[0]
+    b_cells = planner.plan(b, b_start, (0, 1))[0]
+    check_apart(a_cells, b_cells)
+    assert set(planner.reserved['a']).isdisjoint(planner.reserved['b'])
@@ -0,0 +1,102 @@
+import pygame as pg
+
+import clearance
+import game as game_module
+import replay
+import tilemaps
+from pvs import PVS
+
+# free floor next to the start of the dungeon map
+RECT = (128, 96, 16, 16)
+# between the NPC and the player, the NPC has to walk around it
+BLOCKING = (96, 56, 8, 24)
+
+
+def check_rebuild(game):
+    """the incremental updates are the same as building everything again"""
+    walls = [wall.hitbox for wall in game.walls]
+    size = game.map.size
+    assert game.maze == tilemaps.build_maze(size, walls)
+    assert game.clearance == clearance.build_clearance(size, walls)
+    pvs = PVS.build(size, walls)
+    assert game.pvs.visible == pvs.visible
+    assert game.pvs.clear == pvs.clear
+
+
+def test_incremental_update(headless_game):
+    game = headless_game
+    walls = game.dynamic_walls
+    wall = walls.add(RECT)
+    check_rebuild(game)
+
+    walls.remove(wall)
+    walls.remove(walls.find(next(iter(game.walls)).hitbox))
+    check_rebuild(game)
+
+
+def test_state(headless_game):
+    game = headless_game
+    walls = game.dynamic_walls
+    map_wall = tuple(next(iter(game.walls)).hitbox)
+    walls.remove(walls.find(map_wall))
+    wall = walls.add(RECT)
+    assert walls.state() == ((RECT,), (map_wall,))
+
+    # a wall of the map that comes back isn't a change anymore
+    walls.remove(wall)
+    walls.add(map_wall)
+    assert walls.state() == ((), ())
+
+
+def test_save_and_load(headless_game, tmp_path):
+    game = headless_game
+    game.save_dir = str(tmp_path)
+    walls = game.dynamic_walls
+    walls.add(RECT)
+    saved = walls.state()
+    game.save('walls.sav')
+
+    walls.remove(walls.find(RECT))
+    walls.remove(next(iter(game.walls)))
+    game.load('walls.sav')
+    assert walls.state() == saved
+    assert walls.find(RECT) is not None
+
+
+def test_rewind(headless_game):
+    game = headless_game
+    walls = game.dynamic_walls
+    history = game.history
+    history.quick_save()
+    walls.add(RECT)
+    history.quick_load()
+    assert walls.state() == ((), ())
+    assert walls.find(RECT) is None
+    check_rebuild(game)
+
+
+def test_replay(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'walls.rec.gz')
+    game = game_module.Game(headless=True)
+    game.input_recorder = replay.InputRecorder(filename, game)
+    for tick in range(120):
+        if tick == 30:
+            game.dynamic_walls.add(BLOCKING)
+        # rewind to before the wall was added, the rewind is replayed from
+        # the keys and removes the wall again by itself
+        pressed = [pg.K_BACKSPACE] if 60 <= tick < 100 else []
+        monkeypatch.setattr(pg.key, 'get_pressed',
+                            lambda: replay.KeyState(pressed))
+        game.events()
+        game.update(game.tick_dt)
+    monkeypatch.undo()
+    game.input_recorder.close()
+    assert game.dynamic_walls.find(BLOCKING) is None
+    recorded = (game.dynamic_walls.state(), tuple(game.npc.pos))
+    pg.quit()
+
+    input_replay = replay.InputReplay(filename)
+    game = game_module.Game(headless=True, start_state=input_replay.state)
+    game.input_replay = input_replay
+    game.run_headless(input_replay.ticks)
+    assert (game.dynamic_walls.state(), tuple(game.npc.pos)) == recorded
@@ -0,0 +1,43 @@
+import sprites
+
+
+def check_bodies(game):
+    """every live body belongs to the sprite at its index"""
+    kinematics = game.kinematics
+    bodies = kinematics.sprites[:kinematics.count]
+    for index, sprite in enumerate(bodies):
+        assert sprite.alive()
+        assert sprite.body_index == index
+    assert {sprite for sprite in game.all_sprites
+            if sprite.body_index is not None} == set(bodies)
+
+
+def test_killed_sprite_comes_back(headless_game):
+    game = headless_game
+    npc = game.npc
+    groups = set(npc.groups())
+    pos = tuple(npc.pos)
+    game.history.quick_save()
+
+    npc.kill()
+    assert not npc.alive()
+    game.history.quick_load()
+    assert npc.alive()
+    assert set(npc.groups()) == groups
+    assert tuple(npc.pos) == pos
+    check_bodies(game)
+
+
+def test_created_sprite_goes_away(headless_game):
+    game = headless_game
+    game.history.quick_save()
+    first = game.npc
+    x, y = first.pos
+    npc = sprites.NPC(game, {'x': x, 'y': y, 'width': 8, 'height': 8})
+    game.npc = first
+    assert npc.alive()
+
+    game.history.quick_load()
+    assert not npc.alive()
+    assert npc.body_index is None
+    check_bodies(game)
@@ -0,0 +1,137 @@
+import random
+
+import pygame as pg
+import pytest
+
+import clearance
+import settings as st
+import tilemaps
+from astar import StepPathing, Vector
+from conftest import DUNGEON
+from navmesh import NavMesh, string_pull
+
+AGENT = (7, 7)
+RADIUS = AGENT[0] / 2
+
+
+@pytest.fixture(scope='module')
+def dungeon():
+    tiled_map = tilemaps.parse_map(DUNGEON)
+    size = (tiled_map.width * tiled_map.tilewidth,
+            tiled_map.height * tiled_map.tileheight)
+    walls = tilemaps.wall_rects(tiled_map)
+    grown = [wall.inflate(AGENT) for wall in walls]
+    return (NavMesh(size, walls, AGENT), grown,
+            clearance.build_clearance(size, walls))
+
+
+def inside(point, rects):
+    return any(rect.left < point[0] < rect.right
+               and rect.top < point[1] < rect.bottom for rect in rects)
+
+
+def crosses(points, rects):
+    """tests points along the lines, 1 pixel apart"""
+    for a, b in zip(points, points[1:]):
+        steps = int(pg.Vector2(a).distance_to(b)) + 1
+        for i in range(steps + 1):
+            t = i / steps
+            if inside((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t),
+                      rects):
+                return True
+    return False
+
+
+def length(points):
+    return sum(pg.Vector2(a).distance_to(b) for a, b in zip(points,
+                                                            points[1:]))
+
+
+def center(cell):
+    return ((cell[0] + 0.5) * st.CELL_SIZE, (cell[1] + 0.5) * st.CELL_SIZE)
+
+
+def free_cells(grid):
+    return [(x, y) for x in range(len(grid)) for y in range(len(grid[0]))
+            if grid[x][y] >= RADIUS]
+
+
+def test_string_pull_around_a_corner():
+    # through a door at x = 10 and a gap at y = 20, (left, right) seen
+    # from the way they are crossed
+    portals = [((10, 5), (10, 0)), ((15, 20), (20, 20))]
+    assert string_pull((0, 0), (30, 40), portals) == [(0, 0), (10, 5),
+                                                      (30, 40)]
+    assert string_pull((0, 0), (0, 40), portals) == [(0, 0), (10, 5),
+                                                     (15, 20), (0, 40)]
+    # nothing in the way
+    assert string_pull((0, 0), (30, 0), [((10, 5), (10, -5))]) == [
+            (0, 0), (30, 0)]
+
+
+def test_paths_dont_cross_the_walls(dungeon):
+    mesh, grown, grid = dungeon
+    rnd = random.Random(0)
+    cells = free_cells(grid)
+    found = 0
+    for _ in range(100):
+        start, end = (center(cell) for cell in rnd.sample(cells, 2))
+        points, expanded, open_peak = mesh.find_path(start, end)
+        if points:
+            found += 1
+            assert points[0] == start and points[-1] == end
+            assert not crosses(points, grown)
+    assert found > 50
+
+
+def test_unreachable_goal():
+    # a closed room in the middle of an empty map
+    walls = [pg.Rect(32, 32, 64, 8), pg.Rect(32, 88, 64, 8),
+             pg.Rect(32, 40, 8, 48), pg.Rect(88, 40, 8, 48)]
+    mesh = NavMesh((128, 128), walls, AGENT)
+    points, expanded, open_peak = mesh.find_path((8, 8), (64, 64))
+    assert points == []
+    assert expanded > 0
+    assert mesh.find_path((8, 8), (120, 120))[0] != []
+
+
+def test_length_close_to_the_grid_path(dungeon):
+    mesh, grown, grid = dungeon
+    rnd = random.Random(1)
+    cells = free_cells(grid)
+    size = Vector(len(grid), len(grid[0]))
+    compared = 0
+    while compared < 15:
+        start, end = rnd.sample(cells, 2)
+        cells_path = StepPathing(Vector(start), Vector(end), grid, size, '*',
+                                 1, RADIUS).get_path()
+        points = mesh.find_path(center(start), center(end))[0]
+        # both agree on what is reachable
+        assert bool(points) == bool(cells_path)
+        if not points:
+            continue
+        compared += 1
+        grid_length = length(cells_path) * st.CELL_SIZE
+        straight = pg.Vector2(center(start)).distance_to(center(end))
+        # the walls are grown by a square, not a circle like the clearance
+        # grid, so the mesh can be a bit more careful around corners
+        assert straight - 1e-6 <= length(points) <= grid_length * 1.15
+
+
+def test_region_at_a_point_in_a_wall(dungeon):
+    mesh, grown, grid = dungeon
+    wall = max(grown, key=lambda rect: rect.w * rect.h)
+    point = wall.center
+    region = mesh.region_at(point)
+    assert region is not None
+    distance = mesh.distance_to_region(point, region)
+    assert distance > 0
+    assert distance == min(mesh.distance_to_region(point, i)
+                           for i in range(len(mesh.regions)))
+
+    clamped = mesh.clamp(point, region)
+    assert not inside(clamped, grown)
+    # paths start at the clamped point
+    end = next(center(cell) for cell in free_cells(grid)
+               if mesh.find_path(clamped, center(cell))[0])
+    assert mesh.find_path(point, end)[0][0] == clamped
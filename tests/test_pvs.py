@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import tilemaps
+import utilities as utils
+from pvs import PVS, LocalPVS
+from conftest import DUNGEON
+
+
+@pytest.fixture(scope='module')
+def dungeon():
+    tiled_map = tilemaps.parse_map(DUNGEON)
+    size = (tiled_map.width * tiled_map.tilewidth,
+            tiled_map.height * tiled_map.tileheight)
+    walls = tilemaps.wall_rects(tiled_map)
+    return size, walls, PVS.build(size, walls)
+
+
+def line_free(start, end, walls):
+    # the test of NPC.steer
+    line = utils.Line(start, end)
+    return not any(line.intersects_rect(wall)[0] for wall in walls)
+
+
+def test_line_through_a_doorway(dungeon):
+    size, walls, pvs = dungeon
+    start, end = (192.7, 553.6), (142.0, 476.1)
+    assert line_free(start, end, walls)
+    assert pvs.test(start, end) is not False
+
+
+def test_random_lines(dungeon):
+    size, walls, pvs = dungeon
+    rnd = random.Random(0)
+    answers = {True: 0, False: 0, None: 0}
+    for _ in range(5000):
+        start = (rnd.uniform(0, size[0]), rnd.uniform(0, size[1]))
+        end = (start[0] + rnd.uniform(-200, 200),
+               start[1] + rnd.uniform(-200, 200))
+        visible = pvs.test(start, end)
+        answers[visible] += 1
+        if visible is not None:
+            assert visible == line_free(start, end, walls), (start, end)
+    # most blocked lines are still answered
+    assert answers[False] > answers[None] / 2
+
+
+def test_local_pvs(dungeon):
+    size, walls, pvs = dungeon
+    local = LocalPVS.build(size, walls)
+    rnd = random.Random(1)
+    for _ in range(5000):
+        start = (rnd.uniform(0, size[0]), rnd.uniform(0, size[1]))
+        end = (rnd.uniform(0, size[0]), rnd.uniform(0, size[1]))
+        assert local.test(start, end) == pvs.test(start, end)
+
+    # regions that aren't loaded are "maybe"
+    a = local.region((100, 100))
+    local.remove(a)
+    assert local.test((100, 100), (110, 110)) is None
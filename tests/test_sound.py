@@ -0,0 +1,69 @@
+import pygame as pg
+import pytest
+
+from sound import SoundBank, SoundEffect
+
+
+@pytest.fixture
+def bank(tmp_path):
+    """three channels and generated sounds that play for a few seconds"""
+    (tmp_path / 'bgm').mkdir()
+    pg.mixer.init()
+    # 3 seconds of silence, 16 bit stereo at 44100 Hz
+    sound = pg.mixer.Sound(buffer=bytes(44100 * 4 * 3))
+    effects = {'step': SoundEffect(sound, 2, 0),
+               'coin': SoundEffect(sound, 3, 1),
+               'alarm': SoundEffect(sound, 3, 2)}
+    bank = SoundBank(str(tmp_path), channels=3, effects=effects)
+    yield bank
+    pg.mixer.stop()
+
+
+def voices(bank, name):
+    return [i for i, voice in enumerate(bank.voices)
+            if voice is not None and voice[0] == name]
+
+
+def test_sounds_load_at_startup(headless_game):
+    loader = headless_game.asset_loader
+    # requested when the game starts, not by the first sound
+    assert loader.sound_future is not None
+    loader.sound_future.result(timeout=10)
+    assert loader.sounds_ready()
+    assert loader.sound_bank.effects is loader.sound_future.result()
+    assert loader.sound_bank is loader.sound_bank
+
+
+def test_max_voices(bank):
+    first = bank.play('step')
+    second = bank.play('step')
+    assert first is not None and second is not None and first is not second
+    # the oldest voice of the sound is restarted, a channel stays free
+    assert bank.play('step') is first
+    assert len(voices(bank, 'step')) == 2
+    assert bank.play('coin') is not None
+
+
+def test_steal_a_lower_priority(bank):
+    oldest = bank.play('coin')
+    step = bank.play('step')
+    bank.play('coin')
+    # the step has the lowest priority, not the oldest coin
+    assert bank.play('alarm') is step
+    assert voices(bank, 'step') == []
+    assert len(voices(bank, 'alarm')) == 1
+    # between equal priorities the oldest voice is stolen
+    assert bank.play('alarm') is oldest
+    assert len(voices(bank, 'coin')) == 1
+
+
+def test_drop_a_lower_priority(bank):
+    for _ in range(3):
+        assert bank.play('alarm') is not None
+    before = list(bank.voices)
+    assert bank.play('step') is None
+    assert bank.play('coin') is None
+    assert bank.voices == before
+    # unless the priority is raised for this call
+    assert bank.play('step', priority=2) is not None
+    assert len(voices(bank, 'step')) == 1
@@ -0,0 +1,47 @@
+import random
+
+import numpy as np
+
+import sprites
+import settings as st
+from kinematics import Kinematics
+from spatial import SpatialGrid
+
+
+def test_query_radius_matches_brute_force():
+    rng = random.Random(0)
+    kinematics = Kinematics()
+    for _ in range(200):
+        kinematics.add(None, (rng.uniform(0, 300), rng.uniform(0, 300)),
+                       0, 0)
+    grid = SpatialGrid(32)
+    grid.rebuild(kinematics)
+    positions = kinematics.pos[:kinematics.count]
+    for index in range(0, 200, 7):
+        found = grid.query_radius(positions[index], 40, exclude=index)
+        distances = np.hypot(*(positions - positions[index]).T)
+        expected = {i for i in range(200)
+                    if i != index and distances[i] <= 40}
+        assert {i for _, i in found} == expected
+        nearest = grid.k_nearest(positions[index], 5, 40, exclude=index)
+        assert np.allclose([d for d, _ in nearest],
+                           sorted(distances[i] for i in expected)[:5])
+
+
+def test_stacked_npcs_spread_out(headless_game):
+    game = headless_game
+    clearance = np.array(game.clearance)
+    x, y = np.unravel_index(clearance.argmax(), clearance.shape)
+    npcs = [sprites.NPC(game, {'x': x * st.CELL_SIZE + 4,
+                               'y': y * st.CELL_SIZE + 4, 'width': 16,
+                               'height': 28, 'id': 1000 + i})
+            for i in range(30)]
+    # 5 seconds
+    game.run_headless(300)
+    positions = np.array([npc.pos for npc in npcs])
+    offsets = positions[:, None] - positions[None]
+    distances = np.hypot(offsets[..., 0], offsets[..., 1])
+    np.fill_diagonal(distances, np.inf)
+    nearest = distances.min(axis=1)
+    assert nearest.min() >= st.SEPARATION_RADIUS * 0.75
+    assert nearest.mean() >= st.SEPARATION_RADIUS * 0.9
@@ -0,0 +1,73 @@
+import pytest
+
+import game as game_module
+import settings as st
+import streaming
+from conftest import DUNGEON
+
+
+@pytest.fixture(scope='module')
+def world(tmp_path_factory):
+    """the dungeon map split into regions of 2 tiles"""
+    out_dir = tmp_path_factory.mktemp('world')
+    streaming.split_map(DUNGEON, str(out_dir), region_tiles=2)
+    return str(out_dir)
+
+
+def start_game(world_dir=None):
+    game = game_module.Game(headless=True)
+    game.world_dir = world_dir
+    game.run_headless(2)
+    assert game.state_name == 'InGame'
+    return game
+
+
+def test_npc_far_from_the_start(world, monkeypatch):
+    # the NPC's region isn't within the load distance of the player's
+    monkeypatch.setattr(st, 'STREAM_LOAD_DISTANCE', 16)
+    monkeypatch.setattr(st, 'STREAM_UNLOAD_DISTANCE', 24)
+    game = start_game(world)
+    assert game.npc.alive() and game.player.alive()
+
+    centers = game.map.stream_centers()
+    assert tuple(game.player.pos) in centers
+    assert tuple(game.npc.pos) in centers
+
+
+def test_grids_match_the_tmx_map(world):
+    streamed = start_game(world)
+    tmx = start_game()
+    grid = streamed.maze
+    assert (len(grid), len(grid[0])) == (len(tmx.maze), len(tmx.maze[0]))
+    # only the loaded regions are stored
+    assert len(grid.regions) == len(streamed.map.regions)
+    assert len(grid.regions) < (streamed.map.index['columns']
+                                * streamed.map.index['rows'])
+
+    for key in streamed.map.regions:
+        rect = streamed.map.region_rect(key).clip(streamed.map.rect)
+        for x in range(rect.left // st.CELL_SIZE, rect.right // st.CELL_SIZE):
+            for y in range(rect.top // st.CELL_SIZE,
+                           rect.bottom // st.CELL_SIZE):
+                assert streamed.maze[x][y] == tmx.maze[x][y]
+                assert streamed.clearance[x][y] == tmx.clearance[x][y]
+
+    # and only the PVS sets of the loaded regions
+    pvs = streamed.map.pvs
+    assert set(pvs.visible) == {a for region in streamed.map.regions.values()
+                                for a in region.pvs_regions}
+    assert len(pvs.visible) < pvs.columns * pvs.rows
+    size = pvs.region_size
+    for a in pvs.visible:
+        start = ((a % pvs.columns + 0.5) * size,
+                 (a // pvs.columns + 0.5) * size)
+        for end in ((0, 0), (200, 300), tuple(tmx.player.pos)):
+            assert pvs.test(start, end) == tmx.pvs.test(start, end)
+
+    missing = next((column, row)
+                   for column in range(streamed.map.index['columns'])
+                   for row in range(streamed.map.index['rows'])
+                   if (column, row) not in streamed.map.regions)
+    x, y = streamed.map.region_rect(missing).topleft
+    assert streamed.maze[x // st.CELL_SIZE][y // st.CELL_SIZE] == 1
+    assert streamed.clearance[x // st.CELL_SIZE][y // st.CELL_SIZE] == 0
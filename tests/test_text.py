@@ -0,0 +1,44 @@
+import os
+
+import pygame as pg
+import pytest
+
+from conftest import DATA_DIR
+from utilities import TextRenderer
+
+FONT = os.path.join(DATA_DIR, '..', 'assets', 'fonts', 'slkscr.ttf')
+
+
+@pytest.fixture
+def renderer():
+    pg.display.init()
+    return TextRenderer()
+
+
+@pytest.mark.parametrize('freetype', [False, True])
+def test_glyphs_match_render(renderer, freetype):
+    font = renderer.get_font(FONT, 16, freetype)
+    text = '12.50 ms'
+    rendered = renderer.render(text, font, 'White')
+    if freetype:
+        # freetype crops the text to its ink, move it to its line
+        _, rect = font.render(text)
+        pos = (rect.x, font.get_sized_ascender() - rect.y)
+    else:
+        pos = (0, 0)
+    expected = pg.Surface((200, 40), pg.SRCALPHA)
+    expected.blit(rendered, pos)
+    surface = pg.Surface((200, 40), pg.SRCALPHA)
+    renderer.draw_glyphs(surface, text, font, 'White', (0, 0))
+    assert pg.mask.from_surface(expected).count()
+    assert (pg.image.tostring(surface, 'RGBA') ==
+            pg.image.tostring(expected, 'RGBA'))
+
+
+def test_numbers_reuse_glyphs(renderer):
+    font = renderer.get_font(FONT, 8)
+    surface = pg.Surface((100, 20), pg.SRCALPHA)
+    for i in range(1000):
+        renderer.draw_glyphs(surface, f'{i / 7:.2f}', font, 'White', (0, 0))
+    assert len(renderer.glyphs) == 11
+    assert not renderer.surfaces